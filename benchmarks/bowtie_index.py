@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+bowtie_index.py
+
+Part of neoepiscope
+Benchmarks loading a Bowtie index with BowtieIndexReference() against the
+previous field-by-field and record-by-record parser, and sequence extraction
+with BowtieIndexReference.get_stretch() against the previous per-character
+implementation, for random 3 bp, 100 bp, and 10 kb fetches.
+
+Usage: python benchmarks/bowtie_index.py [-x <BOWTIE INDEX PREFIX>]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+from bisect import bisect_right
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neoepiscope.bowtie_index import BowtieIndexReference
+
+
+def per_record_extents(idx_prefix):
+    """Parses reference names and unambiguous-stretch extents from a Bowtie
+    index one field and one record at a time, as BowtieIndexReference()
+    previously did
+
+    idx_prefix: path to Bowtie index prefix
+
+    Return value: tuple of (reference lengths, unambiguous-stretch records,
+        offsets of records in their references, unambiguous characters
+        preceding records), each a dictionary keyed by reference name
+    """
+    with open(idx_prefix + ".1.ebwt", "rb") as fh1:
+        assert struct.unpack("<i", fh1.read(4))[0] == 1
+        ln = struct.unpack("I", fh1.read(4))[0]
+        line_rate = struct.unpack("<i", fh1.read(4))[0]
+        lines_per_side = struct.unpack("<i", fh1.read(4))[0]
+        struct.unpack("<i", fh1.read(4))
+        ftab_chars = struct.unpack("<i", fh1.read(4))[0]
+        struct.unpack("<i", fh1.read(4))
+        nref = struct.unpack("I", fh1.read(4))[0]
+        for _ in range(nref):
+            struct.unpack("<i", fh1.read(4))
+        nfrag = struct.unpack("I", fh1.read(4))[0]
+        side_sz = (1 << line_rate) * lines_per_side
+        num_side_pairs = (ln // 4 + 1 + 2 * (side_sz - 8) - 1) // (2 * (side_sz - 8))
+        fh1.seek(
+            nfrag * 12
+            + num_side_pairs * 2 * side_sz
+            + 24
+            + ((1 << (ftab_chars * 2)) + 1) * 4
+            + ftab_chars * 8,
+            1,
+        )
+        refnames = []
+        while True:
+            refname = fh1.readline().decode("UTF-8")
+            if len(refname) == 0 or ord(refname[0]) == 0:
+                break
+            refnames.append(refname.split()[0])
+    recs, offset_in_ref, unambig_preceding = (
+        defaultdict(list),
+        defaultdict(list),
+        defaultdict(list),
+    )
+    length = {}
+    with open(idx_prefix + ".3.ebwt", "rb") as fh3:
+        assert struct.unpack("<i", fh3.read(4))[0] == 1
+        nrecs = struct.unpack("I", fh3.read(4))[0]
+        running_unambig, running_length, ref_id, ref_name = 0, 0, 0, None
+        for i in range(nrecs):
+            off = struct.unpack("I", fh3.read(4))[0]
+            ln = struct.unpack("I", fh3.read(4))[0]
+            first_of_chromosome = ord(fh3.read(1)) != 0
+            if first_of_chromosome:
+                if i > 0:
+                    length[ref_name] = running_length
+                ref_name = refnames[ref_id]
+                ref_id += 1
+                running_length = 0
+            recs[ref_name].append((off, ln, first_of_chromosome))
+            offset_in_ref[ref_name].append(running_length)
+            unambig_preceding[ref_name].append(running_unambig)
+            running_length += off + ln
+            running_unambig += ln
+        length[ref_name] = running_length
+    return length, recs, offset_in_ref, unambig_preceding
+
+
+def time_call(function, repeats):
+    """Times the fastest of several calls to a function
+
+    function: function taking no arguments
+    repeats: number of calls
+
+    Return value: tuple of (fastest time in seconds, return value)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def per_character_stretch(reference_index, ref_id, ref_off, count):
+    """Extracts a stretch of reference one character at a time, as
+    BowtieIndexReference.get_stretch() previously did
+
+    reference_index: BowtieIndexReference object
+    ref_id: name of reference sequence
+    ref_off: offset into reference, 0-based
+    count: number of characters
+
+    Return value: string extracted from reference
+    """
+    N_count = min(abs(min(ref_off, 0)), count)
+    stretch = ["N"] * N_count
+    count -= N_count
+    if not count:
+        return "".join(stretch)
+    ref_off = max(ref_off, 0)
+    starting_rec = bisect_right(reference_index.offset_in_ref[ref_id], ref_off) - 1
+    off = reference_index.offset_in_ref[ref_id][starting_rec]
+    buf_off = reference_index.unambig_preceding[ref_id][starting_rec]
+    for rec in reference_index.recs[ref_id][starting_rec:]:
+        off += rec[0]
+        while ref_off < off and count > 0:
+            stretch.append("N")
+            count -= 1
+            ref_off += 1
+        if count == 0:
+            break
+        if ref_off < off + rec[1]:
+            buf_off += ref_off - off
+        else:
+            buf_off += rec[1]
+        off += rec[1]
+        while ref_off < off and count > 0:
+            buf_elt = buf_off >> 2
+            shift_amt = (buf_off & 3) << 1
+            stretch.append("ACGT"[(reference_index.fh4mm[buf_elt] >> shift_amt) & 3])
+            buf_off += 1
+            count -= 1
+            ref_off += 1
+        if count == 0:
+            break
+    while count > 0:
+        count -= 1
+        stretch.append("N")
+    return "".join(stretch)
+
+
+def random_fetches(reference_index, size, number, seed=0):
+    """Samples random stretches of reference
+
+    reference_index: BowtieIndexReference object
+    size: length of each stretch
+    number: number of stretches
+    seed: random seed
+
+    Return value: list of (reference name, offset, size) tuples
+    """
+    rng = random.Random(seed)
+    refs = [ref for ref in reference_index.length if reference_index.length[ref] > size]
+    fetches = []
+    for _ in range(number):
+        ref = rng.choice(refs)
+        fetches.append((ref, rng.randint(0, reference_index.length[ref] - size), size))
+    return fetches
+
+
+def time_fetches(function, fetches, repeats):
+    """Times the fastest of several rounds of fetches
+
+    function: function taking reference name, offset, and size
+    fetches: list of (reference name, offset, size) tuples
+    repeats: number of rounds
+
+    Return value: tuple of (fastest time in seconds, list of stretches)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        stretches = [function(*fetch) for fetch in fetches]
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, stretches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-x",
+        "--bowtie-index",
+        type=str,
+        required=False,
+        default=os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "tests",
+            "Chr11.ref",
+        ),
+        help="path to Bowtie index prefix",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    old_time, (length, recs, offset_in_ref, unambig_preceding) = time_call(
+        lambda: per_record_extents(args.bowtie_index), args.repeats
+    )
+    new_time, reference_index = time_call(
+        lambda: BowtieIndexReference(args.bowtie_index), args.repeats
+    )
+    assert length == reference_index.length
+    assert recs == reference_index.recs
+    assert offset_in_ref == {
+        ref: list(offsets) for ref, offsets in reference_index.offset_in_ref.items()
+    }
+    assert unambig_preceding == {
+        ref: list(counts) for ref, counts in reference_index.unambig_preceding.items()
+    }
+    print(
+        "Startup: per record {:.3f} s, BowtieIndexReference {:.3f} s ({:.1f}x)".format(
+            old_time, new_time, old_time / new_time
+        )
+    )
+    for size, number in [(3, 100000), (100, 20000), (10000, 500)]:
+        fetches = random_fetches(reference_index, size, number)
+        old_time, old_stretches = time_fetches(
+            lambda ref, off, count: per_character_stretch(
+                reference_index, ref, off, count
+            ),
+            fetches,
+            args.repeats,
+        )
+        new_time, new_stretches = time_fetches(
+            reference_index.get_stretch, fetches, args.repeats
+        )
+        assert old_stretches == new_stretches
+        print(
+            "{} x {} bp: per character {:.3f} s, get_stretch {:.3f} s ({:.1f}x)".format(
+                number, size, old_time, new_time, old_time / new_time
+            )
+        )
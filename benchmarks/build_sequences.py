@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+build_sequences.py
+
+Part of neoepiscope
+Benchmarks time and peak memory of Transcript._build_sequences() and
+Transcript.neopeptides() on a long synthetic transcript (by default, with
+as many exons and as long a coding sequence as TTN), with run-length
+coordinate maps against dictionaries filled one entry per position, as
+_build_sequences() previously built them.
+
+Usage: python benchmarks/build_sequences.py [-e <EXONS>] [-l <EXON LENGTH>]
+    [-v <EDITS>]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import neoepiscope.transcript as transcript_module
+from neoepiscope.reference import SequenceReference
+from neoepiscope.transcript import Transcript, multiassign
+
+_stop_codons = ["TAA", "TAG", "TGA"]
+
+
+class StringReference(SequenceReference):
+    """Holds one synthetic chromosome in memory"""
+
+    def __init__(self, sequence):
+        self.idx_prefix = "synthetic"
+        self.sequence = sequence.encode("ascii")
+        self.length = {"chrT": len(sequence)}
+
+    def _fetch(self, ref_id, start, end):
+        return self.sequence[start:end]
+
+
+class DictionaryMap(dict):
+    """Dictionary filled one entry per position by add_run(), as
+    _build_sequences() filled its coordinate dictionaries previously
+    """
+
+    def add_run(self, key_start, key_step, value_start, value_step, length):
+        multiassign(
+            self,
+            [key_start + i * key_step for i in range(length)],
+            [value_start + i * value_step for i in range(length)],
+        )
+
+
+def long_transcript(exons, exon_length, edits, seed=0):
+    """Builds a forward-strand transcript with a random open reading frame
+    spanning all of its exons, along with random edits
+
+    exons: number of exons
+    exon_length: length of each exon; introns are twice as long
+    edits: number of SNVs; one insertion and one deletion are also added
+
+    Return value: tuple of (StringReference, Transcript object)
+    """
+    rng = random.Random(seed)
+    codons = [
+        a + b + c
+        for a in "ACGT"
+        for b in "ACGT"
+        for c in "ACGT"
+        if a + b + c not in _stop_codons
+    ]
+    coding_length = exons * exon_length
+    coding = "".join(
+        ["ATG"] + [rng.choice(codons) for _ in range(coding_length // 3 - 2)] + ["TAA"]
+    )
+    coding += "".join(rng.choice("ACGT") for _ in range(coding_length - len(coding)))
+    pieces, blocks, position = ["A" * 1000], [], 1000
+    for i in range(exons):
+        pieces.append(coding[i * exon_length : (i + 1) * exon_length])
+        blocks.append(["chrT", "blah", "exon", str(position + 1), "", ".", "+"])
+        position += exon_length
+        blocks[-1][4] = str(position)
+        pieces.append("".join(rng.choice("ACGT") for _ in range(2 * exon_length)))
+        position += 2 * exon_length
+    reference = StringReference("".join(pieces))
+    stop_end = int(blocks[-1][4]) - (coding_length - (coding_length // 3) * 3)
+    blocks.append(["chrT", "blah", "start_codon", "1001", "1003", ".", "+"])
+    blocks.append(
+        ["chrT", "blah", "stop_codon", str(stop_end - 2), str(stop_end), ".", "+"]
+    )
+    transcript = Transcript(reference, blocks, "ENSTSYNTHETIC.1", False)
+    exon_starts = [int(block[3]) for block in blocks[:exons]]
+    for start in rng.sample(exon_starts[1:-1], edits + 2):
+        pos = start + rng.randrange(10, exon_length - 10)
+        base = reference.sequence[pos - 1 : pos].decode("ascii")
+        transcript.edit(rng.choice([x for x in "ACGT" if x != base]), pos, "V", "S")
+    transcript.edit("GAT", exon_starts[exons // 3] + 20, "I", "S")
+    transcript.edit(6, exon_starts[2 * exons // 3] + 20, "D", "S")
+    return reference, transcript
+
+
+def time_call(function, repeats):
+    """Times the fastest of several calls to a function and measures the
+    peak memory allocated by the last
+
+    function: function taking no arguments
+    repeats: number of calls
+
+    Return value: tuple of (fastest time in seconds, peak memory in bytes,
+        return value)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-e", "--exons", type=int, required=False, default=363, help="number of exons"
+    )
+    parser.add_argument(
+        "-l",
+        "--exon-length",
+        type=int,
+        required=False,
+        default=300,
+        help="length of each exon",
+    )
+    parser.add_argument(
+        "-v",
+        "--edits",
+        type=int,
+        required=False,
+        default=5,
+        help="number of SNVs on transcript",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    reference, transcript = long_transcript(args.exons, args.exon_length, args.edits)
+    annotated_seq = transcript.annotated_seq(include_somatic=1, include_germline=2)
+    results = {}
+    for name, map_class in [
+        ("dictionaries", DictionaryMap),
+        ("run-length maps", transcript_module._CoordinateMap),
+    ]:
+        transcript_module._CoordinateMap = map_class
+        build_time, build_peak, built = time_call(
+            lambda: transcript._build_sequences(
+                annotated_seq, strand=1, include_somatic=1, include_germline=2
+            ),
+            args.repeats,
+        )
+        neopeptide_time, neopeptide_peak, neopeptides = time_call(
+            lambda: transcript.neopeptides(include_somatic=1, include_germline=2),
+            args.repeats,
+        )
+        results[name] = (built, neopeptides)
+        print(
+            "{}: _build_sequences() {:.3f} s, peak {:.1f} MB; "
+            "neopeptides() {:.3f} s, peak {:.1f} MB".format(
+                name,
+                build_time,
+                build_peak / 1e6,
+                neopeptide_time,
+                neopeptide_peak / 1e6,
+            )
+        )
+    (dict_built, dict_neopeptides), (map_built, map_neopeptides) = (
+        results["dictionaries"],
+        results["run-length maps"],
+    )
+    assert dict_built[:2] == map_built[:2]
+    for dictionary, coordinate_map in zip(dict_built[2:6], map_built[2:6]):
+        assert dictionary == dict(coordinate_map)
+    assert dict_neopeptides == map_neopeptides
+    print(
+        "{} positions, {} neopeptides".format(len(map_built[0]), len(map_neopeptides))
+    )
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+gtf_to_cds.py
+
+Part of neoepiscope
+Benchmarks parsing a GTF with gtf_to_cds()'s precompiled attribute scans
+against the previous per-attribute re.sub() calls and against splitting the
+attribute column into a key/value mapping, on copies of tests/Chr14.gtf
+(or another GTF) concatenated with distinct transcript IDs, and times
+gtf_to_cds() with one or more processes.
+
+Usage: python benchmarks/gtf_to_cds.py [-g <GTF>] [-n <COPIES>]
+    [-p <PROCESSES>]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import collections
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neoepiscope.transcript import gtf_to_cds, _parse_gtf_lines
+
+_indexed_transcript_types = [
+    "protein_coding",
+    "nonsense_mediated_decay",
+    "polymorphic_pseudogene",
+    "IG_V_gene",
+    "TR_V_gene",
+]
+
+
+def scaled_gtf(gtf, copies, scaled_path):
+    """Writes copies of a GTF, giving each copy its own transcript IDs
+
+    gtf: path to GTF
+    copies: number of copies
+    scaled_path: path to output GTF
+
+    No return value.
+    """
+    with open(gtf) as gtf_stream:
+        lines = [line for line in gtf_stream if line[0] != "#"]
+    with open(scaled_path, "w") as scaled_stream:
+        for copy in range(copies):
+            for line in lines:
+                scaled_stream.write(
+                    re.sub(
+                        r'transcript_id "([A-Z0-9._]+)"',
+                        r'transcript_id "\1_{}"'.format(copy),
+                        line,
+                    )
+                )
+
+
+def resub_parse(gtf):
+    """Parses a GTF with a re.sub() call per attribute, as gtf_to_cds()
+    previously did
+
+    gtf: path to GTF
+
+    Return value: tuple of (blocks, transcript data) dictionaries
+    """
+    cds_dict = collections.defaultdict(list)
+    tx_data_dict = collections.defaultdict(list)
+    with open(gtf) as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            tokens = line.strip().split("\t")
+            if tokens[2] in ["exon", "start_codon", "stop_codon"]:
+                transcript_id = re.sub(
+                    r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
+                )
+                transcript_type = re.sub(
+                    r".*transcript_type \"([A-Za-z_]+)\"[;].*", r"\1", tokens[8]
+                )
+                if transcript_type in _indexed_transcript_types:
+                    cds_dict[transcript_id].append(
+                        [
+                            tokens[0],
+                            tokens[2],
+                            int(tokens[3]),
+                            int(tokens[4]),
+                            tokens[6],
+                            transcript_type,
+                        ]
+                    )
+            elif tokens[2] == "CDS":
+                re.sub(r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8])
+            elif tokens[2] == "transcript":
+                transcript_id = re.sub(
+                    r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
+                )
+                transcript_type = re.sub(
+                    r".*transcript_type \"([A-Za-z_]+)\"[;].*", r"\1", tokens[8]
+                )
+                gene_id = re.sub(r".*gene_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8])
+                gene_name = re.sub(
+                    r".*gene_name \"([A-Za-z0-9._-]+)\"[;].*", r"\1", tokens[8]
+                )
+                tags = re.findall('tag "([A-Za-z0-9_]+)"', tokens[8])
+                tsl = None
+                support_level = re.sub(
+                    r".*transcript_support_level \"([0-9A-Z]+)\"[;].*",
+                    r"\1",
+                    tokens[8],
+                )
+                try:
+                    tsl = int(support_level)
+                except ValueError:
+                    if support_level == "NA":
+                        tsl = "NA"
+                if transcript_type in _indexed_transcript_types:
+                    tx_data_dict[transcript_id] = [
+                        transcript_type,
+                        gene_id,
+                        gene_name,
+                        tags,
+                        tsl,
+                    ]
+    return cds_dict, tx_data_dict
+
+
+def tokenized_parse(gtf):
+    """Parses a GTF by splitting each attribute column into a mapping of
+    keys to values, with repeated tag keys collected in a list; values are
+    taken as is, so attributes must be well formed
+
+    gtf: path to GTF
+
+    Return value: tuple of (blocks, transcript data) dictionaries
+    """
+    cds_dict = collections.defaultdict(list)
+    tx_data_dict = collections.defaultdict(list)
+    with open(gtf) as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            tokens = line.strip().split("\t")
+            if tokens[2] not in ["exon", "start_codon", "stop_codon", "transcript"]:
+                continue
+            # Quoted values are the odd-numbered pieces
+            pieces = tokens[8].split('"')
+            attributes, tags = {}, []
+            for i in range(1, len(pieces) - 1, 2):
+                key = pieces[i - 1].rsplit(None, 1)[-1]
+                if key == "tag":
+                    tags.append(pieces[i])
+                else:
+                    attributes[key] = pieces[i]
+            transcript_type = attributes.get("transcript_type")
+            if transcript_type not in _indexed_transcript_types:
+                continue
+            if tokens[2] != "transcript":
+                cds_dict[attributes["transcript_id"]].append(
+                    [
+                        tokens[0],
+                        tokens[2],
+                        int(tokens[3]),
+                        int(tokens[4]),
+                        tokens[6],
+                        transcript_type,
+                    ]
+                )
+                continue
+            support_level = attributes.get("transcript_support_level")
+            if support_level is not None and support_level.isdigit():
+                tsl = int(support_level)
+            elif support_level == "NA":
+                tsl = "NA"
+            else:
+                tsl = None
+            tx_data_dict[attributes["transcript_id"]] = [
+                transcript_type,
+                attributes["gene_id"],
+                attributes["gene_name"],
+                tags,
+                tsl,
+            ]
+    return cds_dict, tx_data_dict
+
+
+def time_call(function, repeats):
+    """Times the fastest of several calls to a function
+
+    function: function taking no arguments
+    repeats: number of calls
+
+    Return value: tuple of (fastest time in seconds, return value)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-g",
+        "--gtf",
+        type=str,
+        required=False,
+        default=os.path.join(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            "tests",
+            "Chr14.gtf",
+        ),
+        help="path to GTF",
+    )
+    parser.add_argument(
+        "-n",
+        "--copies",
+        type=int,
+        required=False,
+        default=20000,
+        help="number of copies of GTF to concatenate",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        required=False,
+        default=4,
+        help="number of processes for parallel gtf_to_cds() run",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        gtf = os.path.join(temp_dir, "scaled.gtf")
+        scaled_gtf(args.gtf, args.copies, gtf)
+        resub_time, (resub_cds, resub_tx) = time_call(
+            lambda: resub_parse(gtf), args.repeats
+        )
+        tokenized_time, (tokenized_cds, tokenized_tx) = time_call(
+            lambda: tokenized_parse(gtf), args.repeats
+        )
+
+        def compiled_parse():
+            with open(gtf) as gtf_stream:
+                return _parse_gtf_lines(gtf_stream)
+
+        compiled_time, (compiled_cds, _, compiled_tx) = time_call(
+            compiled_parse, args.repeats
+        )
+        assert resub_cds == compiled_cds and resub_tx == compiled_tx
+        assert tokenized_cds == compiled_cds and tokenized_tx == compiled_tx
+        print(
+            "Parse {} copies: re.sub {:.3f} s, key/value mapping {:.3f} s, "
+            "precompiled scans {:.3f} s ({:.1f}x over re.sub)".format(
+                args.copies,
+                resub_time,
+                tokenized_time,
+                compiled_time,
+                resub_time / compiled_time,
+            )
+        )
+        serial_time, serial_dicts = time_call(
+            lambda: gtf_to_cds(gtf, "NA", pickle_it=False), args.repeats
+        )
+        parallel_time, parallel_dicts = time_call(
+            lambda: gtf_to_cds(gtf, "NA", pickle_it=False, processes=args.processes),
+            args.repeats,
+        )
+        assert serial_dicts == parallel_dicts
+        print(
+            "gtf_to_cds: 1 process {:.3f} s, {} processes {:.3f} s".format(
+                serial_time, args.processes, parallel_time
+            )
+        )
+    finally:
+        shutil.rmtree(temp_dir)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+interval_index.py
+
+Part of neoepiscope
+Benchmarks transcript lookups for variants with the array-backed interval
+index built by cds_to_tree() against per-variant IntervalTree queries.
+
+Usage: python benchmarks/interval_index.py -g <GTF> [-c <HAPCUT2 OUTPUT>]
+
+If no HapCUT2 output (e.g. from neoepiscope prep on a whole-exome VCF) is
+given, variants are sampled uniformly from annotated exons.
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intervaltree import IntervalTree
+from neoepiscope.transcript import (
+    gtf_to_cds,
+    cds_to_tree,
+    get_transcripts_from_tree,
+    process_haplotypes,
+    _hapcut_line_to_variants,
+)
+from neoepiscope.interval_index import get_transcripts_from_tree_batch
+
+
+def interval_tree_index(cds_dict):
+    """Builds the per-contig IntervalTree dictionary previously used by
+    cds_to_tree()
+
+    cds_dict: CDS dictionary produced by gtf_to_cds()
+
+    Return value: dictionary linking contigs to IntervalTree objects
+    """
+    searchable_tree = {}
+    for transcript_id in cds_dict:
+        transcript = cds_dict[transcript_id]
+        chrom = transcript[0][0]
+        if chrom not in searchable_tree:
+            searchable_tree[chrom] = IntervalTree()
+        for cds in transcript:
+            if cds[3] + 1 > cds[2]:
+                searchable_tree[chrom][cds[2] : cds[3] + 1] = transcript_id
+    return searchable_tree
+
+
+def hapcut_queries(hapcut_output):
+    """Extracts variant coordinates from HapCUT2 output
+
+    hapcut_output: path to HapCUT2 output
+
+    Return value: list of (contig, start, stop) tuples
+    """
+    queries = []
+    with open(hapcut_output) as f:
+        for line in f:
+            if line.startswith("BLOCK") or line[0] == "*":
+                continue
+            tokens = line.strip("\n").split()
+            for variants in _hapcut_line_to_variants(tokens):
+                for variant in variants:
+                    queries.append((tokens[3], variant[0], variant[3]))
+    return queries
+
+
+def sampled_queries(cds_dict, count, seed=0):
+    """Samples single-base variant coordinates from annotated blocks
+
+    cds_dict: CDS dictionary produced by gtf_to_cds()
+    count: number of coordinates to sample
+    seed: random seed
+
+    Return value: list of (contig, start, stop) tuples
+    """
+    rng = random.Random(seed)
+    blocks = [block for blocks in cds_dict.values() for block in blocks]
+    queries = []
+    for _ in range(count):
+        block = rng.choice(blocks)
+        pos = rng.randint(block[2] - 50, block[3] + 50)
+        queries.append((block[0], pos, pos + 1))
+    return queries
+
+
+def time_call(function, repeats):
+    """Times the fastest of several calls to a function
+
+    function: function taking no arguments
+    repeats: number of calls
+
+    Return value: tuple of (fastest time in seconds, return value)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-g", "--gtf", type=str, required=True, help="path to GTF")
+    parser.add_argument(
+        "-c",
+        "--hapcut2-output",
+        type=str,
+        required=False,
+        help="path to HapCUT2 output (as adjusted by neoepiscope prep)",
+    )
+    parser.add_argument(
+        "-n",
+        "--variants",
+        type=int,
+        required=False,
+        default=50000,
+        help="number of variants to sample if no HapCUT2 output is given",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    cds_dict, _ = gtf_to_cds(args.gtf, "NA", pickle_it=False)
+    build_time, interval_tree = time_call(lambda: interval_tree_index(cds_dict), 1)
+    print("IntervalTree build: {:.3f} s".format(build_time))
+    build_time, index = time_call(lambda: cds_to_tree(cds_dict, "NA", False), 1)
+    print("Array index build: {:.3f} s".format(build_time))
+    if args.hapcut2_output:
+        queries = hapcut_queries(args.hapcut2_output)
+    else:
+        queries = sampled_queries(cds_dict, args.variants)
+    print("Variants: {}".format(len(queries)))
+    tree_time, tree_hits = time_call(
+        lambda: [
+            get_transcripts_from_tree(contig, start, stop, interval_tree)
+            for contig, start, stop in queries
+        ],
+        args.repeats,
+    )
+    single_time, single_hits = time_call(
+        lambda: [
+            get_transcripts_from_tree(contig, start, stop, index)
+            for contig, start, stop in queries
+        ],
+        args.repeats,
+    )
+    batch_time, batch_hits = time_call(
+        lambda: get_transcripts_from_tree_batch(queries, index), args.repeats
+    )
+    assert [sorted(hits) for hits in tree_hits] == [sorted(hits) for hits in batch_hits]
+    assert single_hits == batch_hits
+    print("IntervalTree, per variant: {:.3f} s".format(tree_time))
+    print(
+        "Array index, per variant: {:.3f} s ({:.1f}x)".format(
+            single_time, tree_time / single_time
+        )
+    )
+    print(
+        "Array index, batch: {:.3f} s ({:.1f}x)".format(
+            batch_time, tree_time / batch_time
+        )
+    )
+    if args.hapcut2_output:
+        for label, tree in [("IntervalTree", interval_tree), ("Array index", index)]:
+            elapsed, _ = time_call(
+                lambda: process_haplotypes(args.hapcut2_output, tree, True),
+                args.repeats,
+            )
+            print("process_haplotypes with {}: {:.3f} s".format(label, elapsed))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+neopeptides.py
+
+Part of neoepiscope
+Benchmarks differencing mutant peptides against a reference protein with one
+prefix-hashing index shared by every peptide size, against building a set of
+reference subsequences per size and collecting mutation data in lists
+deduplicated after every append, as Transcript.neopeptides() previously did,
+on long synthetic proteins over class I (8-11) and class II (8-25) size
+ranges. Also times Transcript.neopeptides() on a long synthetic transcript.
+
+Usage: python benchmarks/neopeptides.py [-l <PROTEIN LENGTH>]
+    [-w <WINDOWS>] [-r <REPEATS>]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neoepiscope.transcript import kmerize_peptide, reference_kmer_index
+from build_sequences import long_transcript
+
+_amino_acids = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def mutant_windows(protein, windows, seed=0):
+    """Mutates random positions of a protein, returning windows around them
+
+    protein: protein seq
+    windows: number of mutated positions
+    seed: random seed
+
+    Return value: list of (start, end, mutation data) tuples, with the
+        mutant protein
+    """
+    rng = random.Random(seed)
+    mutant = list(protein)
+    coords = []
+    for position in rng.sample(range(30, len(protein) - 30), windows):
+        mutant[position] = rng.choice(_amino_acids)
+        coords.append((position, position + 1, [("V", position)]))
+    return coords, "".join(mutant)
+
+
+def list_difference(protein, protein_ref, coords, min_size, max_size):
+    """Differences peptides with a set of reference subsequences per size,
+    deduplicating mutation data after every append
+
+    protein: mutant protein seq
+    protein_ref: reference protein seq
+    coords: list of (start, end, mutation data) tuples
+    min_size: minimum peptide size
+    max_size: maximum peptide size
+
+    Return value: dictionary mapping peptides to lists of mutation data
+    """
+    peptide_seqs = collections.defaultdict(list)
+    for size in range(min_size, max_size + 1):
+        peptides_ref = frozenset(
+            kmerize_peptide(protein_ref, min_size=size, max_size=size)
+        )
+        for start, end, data_set in coords:
+            peptides = kmerize_peptide(
+                protein[max(0, start - size + 1) : end + size - 1],
+                min_size=size,
+                max_size=size,
+            )
+            for pep in peptides:
+                if pep not in peptides_ref:
+                    for mutation_data in data_set:
+                        peptide_seqs[pep].append(mutation_data)
+                    peptide_seqs[pep] = list(set(peptide_seqs[pep]))
+    return peptide_seqs
+
+
+def index_difference(protein, protein_ref, coords, min_size, max_size):
+    """Differences peptides with one index of reference subsequences,
+    collecting mutation data in sets
+
+    protein: mutant protein seq
+    protein_ref: reference protein seq
+    coords: list of (start, end, mutation data) tuples
+    min_size: minimum peptide size
+    max_size: maximum peptide size
+
+    Return value: dictionary mapping peptides to lists of mutation data
+    """
+    peptide_seqs = collections.defaultdict(set)
+    peptides_ref = reference_kmer_index(protein_ref, min_size)
+    for size in range(min_size, max_size + 1):
+        for start, end, data_set in coords:
+            window = protein[max(0, start - size + 1) : end + size - 1]
+            for pep in (window[i : i + size] for i in range(len(window) - size + 1)):
+                if pep not in peptides_ref:
+                    peptide_seqs[pep].update(data_set)
+    return collections.defaultdict(
+        list, ((pep, list(mutations)) for pep, mutations in peptide_seqs.items())
+    )
+
+
+def time_call(function, repeats, setup=None):
+    """Times the fastest of several calls to a function
+
+    function: function taking no arguments
+    repeats: number of calls
+    setup: function taking no arguments to call before each call, or None
+
+    Return value: tuple of (fastest time in seconds, return value)
+    """
+    best = None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-l",
+        "--protein-length",
+        type=int,
+        required=False,
+        default=35000,
+        help="length of synthetic protein",
+    )
+    parser.add_argument(
+        "-w",
+        "--windows",
+        type=int,
+        required=False,
+        default=200,
+        help="number of mutated positions",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    rng = random.Random(0)
+    protein_ref = "".join(rng.choice(_amino_acids) for _ in range(args.protein_length))
+    coords, protein = mutant_windows(protein_ref, args.windows)
+    for min_size, max_size in [(8, 11), (8, 25)]:
+        list_time, list_peptides = time_call(
+            lambda: list_difference(protein, protein_ref, coords, min_size, max_size),
+            args.repeats,
+        )
+        index_time, index_peptides = time_call(
+            lambda: index_difference(protein, protein_ref, coords, min_size, max_size),
+            args.repeats,
+            setup=reference_kmer_index.cache_clear,
+        )
+        assert {pep: sorted(data) for pep, data in list_peptides.items()} == {
+            pep: sorted(data) for pep, data in index_peptides.items()
+        }
+        print(
+            "{} aa, {} mutations, sizes {}-{}: sets per size {:.3f} s, "
+            "shared index {:.3f} s ({:.1f}x); {} peptides".format(
+                args.protein_length,
+                args.windows,
+                min_size,
+                max_size,
+                list_time,
+                index_time,
+                list_time / index_time,
+                len(index_peptides),
+            )
+        )
+    reference, transcript = long_transcript(363, 300, 30)
+    reference_protein = transcript.reference_protein()
+    for min_size, max_size in [(8, 11), (8, 25)]:
+        neopeptide_time, neopeptides = time_call(
+            lambda: transcript.neopeptides(
+                min_size=min_size,
+                max_size=max_size,
+                reference_protein=reference_protein,
+            ),
+            args.repeats,
+            setup=reference_kmer_index.cache_clear,
+        )
+        print(
+            "neopeptides(), sizes {}-{}: {:.3f} s; {} peptides".format(
+                min_size, max_size, neopeptide_time, len(neopeptides)
+            )
+        )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+reference.py
+
+Part of neoepiscope
+Benchmarks sequence extraction from 2bit files and indexed FASTA files
+against a Bowtie index of the same genome, for random 3 bp, 100 bp, and
+10 kb fetches, as well as the time taken to open each reference.
+
+Usage: python benchmarks/reference.py -x <BOWTIE INDEX PREFIX>
+    -f <2BIT OR INDEXED FASTA FILE> [<2BIT OR INDEXED FASTA FILE> ...]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neoepiscope.bowtie_index import BowtieIndexReference
+from neoepiscope.reference import open_reference
+from bowtie_index import random_fetches, time_call, time_fetches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-x",
+        "--bowtie-index",
+        type=str,
+        required=True,
+        help="path to Bowtie index prefix",
+    )
+    parser.add_argument(
+        "-f",
+        "--references",
+        type=str,
+        nargs="+",
+        required=True,
+        help="paths to 2bit files and/or FASTA files indexed with samtools faidx",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    bowtie_time, bowtie_reference = time_call(
+        lambda: BowtieIndexReference(args.bowtie_index), args.repeats
+    )
+    references = []
+    for path in args.references:
+        open_time, reference = time_call(lambda: open_reference(path), args.repeats)
+        assert reference.length == bowtie_reference.length
+        references.append((os.path.basename(path), reference))
+        print(
+            "Startup: Bowtie {:.3f} s, {} {:.3f} s".format(
+                bowtie_time, references[-1][0], open_time
+            )
+        )
+    for size, number in [(3, 100000), (100, 20000), (10000, 500)]:
+        fetches = random_fetches(bowtie_reference, size, number)
+        bowtie_time, bowtie_stretches = time_fetches(
+            bowtie_reference.get_stretch, fetches, args.repeats
+        )
+        for name, reference in references:
+            fetch_time, stretches = time_fetches(
+                reference.get_stretch, fetches, args.repeats
+            )
+            assert stretches == bowtie_stretches
+            print(
+                "{} x {} bp: Bowtie {:.3f} s ({:.0f} fetches/s), "
+                "{} {:.3f} s ({:.0f} fetches/s)".format(
+                    number,
+                    size,
+                    bowtie_time,
+                    number / bowtie_time,
+                    name,
+                    fetch_time,
+                    number / fetch_time,
+                )
+            )
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+seq_to_peptide.py
+
+Part of neoepiscope
+Benchmarks seq_to_peptide()'s codon tables, indexed with numpy for long
+sequences, against translating codon by codon with dictionary lookups, as
+seq_to_peptide() previously did, on random coding sequences of several
+lengths with and without Ns, under the standard and mitochondrial codon
+tables.
+
+Usage: python benchmarks/seq_to_peptide.py [-n <SEQUENCES>] [-r <REPEATS>]
+"""
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from neoepiscope.transcript import (
+    seq_to_peptide,
+    _codon_table,
+    _mitochondrial_codon_table,
+)
+
+
+def loop_seq_to_peptide(seq, mitochondrial=False, allow_partial_codons=False):
+    """Translates nucleotide sequence codon by codon, as seq_to_peptide()
+    previously did
+
+    seq: nucleotide sequence
+    mitochondrial: True iff use mitochondrial codon table
+    allow_partial_codons: True iff attempt to translate partial
+        codons at end of sequence
+
+    Return value: peptide string, list of peptide warnings
+    """
+    seq_size = len(seq)
+    peptide = []
+    peptide_warnings = []
+    for i in range(0, seq_size - seq_size % 3, 3):
+        chunk = seq[i : i + 3]
+        if "N" not in chunk:
+            if not mitochondrial:
+                codon = _codon_table[chunk]
+            else:
+                codon = _mitochondrial_codon_table[chunk]
+        elif chunk.count("N") == 1 and seq[i + 2] == "N":
+            # Only 1 N in the wobble position
+            if not mitochondrial:
+                codon_options = set(
+                    [
+                        _codon_table["".join([seq[i : i + 2], x])]
+                        for x in ["A", "C", "G", "T"]
+                    ]
+                )
+            else:
+                codon_options = set(
+                    [
+                        _mitochondrial_codon_table["".join([seq[i : i + 2], x])]
+                        for x in ["A", "C", "G", "T"]
+                    ]
+                )
+            if len(codon_options) == 1:
+                codon = list(codon_options)[0]
+            else:
+                codon = "?"
+        else:
+            # More than 1 N or N not in wobble position
+            codon = "?"
+        peptide.append(codon)
+    if seq_size % 3:
+        peptide_warnings.append("incomplete_CDS")
+        if allow_partial_codons:
+            # 1-2 nucleotides remaining
+            if seq_size % 3 == 2:
+                # 2 nucleotides remaining - check if amino acid can be determined
+                if not mitochondrial:
+                    codon_options = set(
+                        [
+                            _codon_table["".join([seq[-2:], x])]
+                            for x in ["A", "C", "G", "T"]
+                        ]
+                    )
+                else:
+                    codon_options = set(
+                        [
+                            _mitochondrial_codon_table["".join([seq[-2:], x])]
+                            for x in ["A", "C", "G", "T"]
+                        ]
+                    )
+                if len(codon_options) == 1:
+                    codon = list(codon_options)[0]
+                else:
+                    codon = "?"
+            else:
+                # Only 1 amino acid left - can't determine amino acid
+                codon = "?"
+            peptide.append(codon)
+    if mitochondrial and peptide[0] != "M":
+        peptide[0] = "M"
+    return "".join(peptide), peptide_warnings
+
+
+def random_sequences(number, length, n_rate, seed=0):
+    """Generates random nucleotide sequences
+
+    number: number of sequences
+    length: length of each sequence
+    n_rate: probability that a base is N
+
+    Return value: list of sequences
+    """
+    rng = random.Random(seed)
+    return [
+        "".join(
+            "N" if rng.random() < n_rate else rng.choice("ACGT") for _ in range(length)
+        )
+        for _ in range(number)
+    ]
+
+
+def time_call(function, repeats):
+    """Times the fastest of several calls to a function
+
+    function: function taking no arguments
+    repeats: number of calls
+
+    Return value: tuple of (fastest time in seconds, return value)
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n",
+        "--sequences",
+        type=int,
+        required=False,
+        default=2000,
+        help="number of sequences of each length",
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, required=False, default=3, help="timing repeats"
+    )
+    args = parser.parse_args()
+    for length in [48, 201, 1500, 9999]:
+        for n_rate in [0, 0.01]:
+            sequences = random_sequences(args.sequences, length, n_rate)
+            for mitochondrial in [False, True]:
+                loop_time, loop_peptides = time_call(
+                    lambda: [
+                        loop_seq_to_peptide(
+                            seq, mitochondrial=mitochondrial, allow_partial_codons=True
+                        )
+                        for seq in sequences
+                    ],
+                    args.repeats,
+                )
+                table_time, table_peptides = time_call(
+                    lambda: [
+                        seq_to_peptide(
+                            seq, mitochondrial=mitochondrial, allow_partial_codons=True
+                        )
+                        for seq in sequences
+                    ],
+                    args.repeats,
+                )
+                assert loop_peptides == table_peptides
+                print(
+                    "{} x {} bp, N rate {}, {} table: codon loop {:.3f} s, "
+                    "codon tables {:.3f} s ({:.1f}x)".format(
+                        args.sequences,
+                        length,
+                        n_rate,
+                        "mitochondrial" if mitochondrial else "standard",
+                        loop_time,
+                        table_time,
+                        loop_time / table_time,
+                    )
+                )
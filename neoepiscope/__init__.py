@@ -43,24 +43,60 @@ import collections
 import tempfile
 import subprocess
 import warnings
+import itertools
+import shutil
 from . import paths
 from .transcript import (
     Transcript,
     gtf_to_cds,
+    changed_transcripts,
     cds_to_feature_length,
     cds_to_tree,
+    cds_to_reference_proteome,
+    reference_digest,
     get_transcripts_from_tree,
+    get_transcripts_from_tree_batch,
+    iterate_haplotype_blocks,
     process_haplotypes,
     get_peptides_from_transcripts,
+    ReferenceSequenceCache,
+    reference_sequence_cache,
+)
+from .annotation_store import (
+    write_annotation_store,
+    load_annotation,
+    load_reference_proteome,
 )
 from .transcript_expression import feature_to_tpm_dict, get_expressed_variants
-from .binding_scores import get_binding_tools, gather_binding_scores
+from .binding_scores import (
+    get_binding_tools,
+    gather_binding_scores,
+    chunk_peptides,
+    score_in_chunks,
+    AlleleRegistry,
+    resolve_allele,
+)
+from .reference import (
+    SequenceReference,
+    TwoBitReference,
+    FastaReference,
+    open_reference,
+)
+from .annotation_server import (
+    AnnotationServer,
+    AnnotationClient,
+    connect_annotation_server,
+    serve_annotation,
+)
+from .score_cache import BindingScoreCache, default_score_cache, open_score_cache
 from .file_processing import (
     adjust_tumor_column,
     combine_vcf,
     prep_hapcut_output,
     which,
     get_vaf_pos,
+    spill_neoepitopes,
+    merge_spilled_neoepitopes,
     write_results,
 )
 from operator import itemgetter
@@ -76,6 +112,79 @@ def help_formatter(prog):
     return argparse.HelpFormatter(prog, max_help_position=40)
 
 
+def _annotation_paths(args):
+    """Locates annotation and reference for call and serve modes
+
+    args: parsed command-line arguments, with build, bowtie_index,
+        reference, and dicts attributes
+
+    Return value: tuple of (path to directory containing annotation, path
+        to reference; see open_reference())
+    """
+    # Locate bowtie index and annotation for genome build
+    if args.build is not None:
+        if (
+            args.build == "GRCh38"
+            and paths.gencode_v35 is not None
+            and paths.bowtie_grch38 is not None
+        ):
+            dict_dir = paths.gencode_v35
+            reference_path = paths.bowtie_grch38
+        elif (
+            args.build == "hg19"
+            and paths.gencode_v19 is not None
+            and paths.bowtie_hg19 is not None
+        ):
+            dict_dir = paths.gencode_v19
+            reference_path = paths.bowtie_hg19
+        elif (
+            args.build == "mm9"
+            and paths.gencode_vM1 is not None
+            and paths.bowtie_mm9 is not None
+        ):
+            dict_dir = paths.gencode_vM1
+            reference_path = paths.bowtie_mm9
+        elif (
+            args.build == "mm10"
+            and paths.gencode_vM25 is not None
+            and paths.bowtie_mm10 is not None
+        ):
+            dict_dir = paths.gencode_vM25
+            reference_path = paths.bowtie_mm10
+        else:
+            raise RuntimeError(
+                "".join(
+                    [
+                        args.build,
+                        " is not an available genome build. Please "
+                        "check that you have run neoepiscope download and are "
+                        "using 'hg19', 'GRCh38', 'mm10', or 'mm9' for this argument.",
+                    ]
+                )
+            )
+    else:
+        if args.reference is not None and args.dicts is not None:
+            dict_dir = args.dicts
+        elif args.bowtie_index is not None and args.dicts is not None:
+            dict_dir = args.dicts
+            bowtie_files = [
+                "".join([args.bowtie_index, ".", str(x), ".ebwt"]) for x in range(1, 5)
+            ]
+            if list(set([os.path.isfile(x) for x in bowtie_files])) == [True]:
+                reference_path = args.bowtie_index
+            else:
+                raise RuntimeError("Cannot find specified bowtie index")
+        else:
+            raise RuntimeError(
+                "User must specify either --build OR "
+                "--bowtie_index (or --reference) and --dicts options"
+            )
+    if args.reference is not None:
+        # Use reference sequence file in place of Bowtie index
+        reference_path = args.reference
+    return dict_dir, reference_path
+
+
 def main():
     """ Entry point for neoepiscope software """
     parser = argparse.ArgumentParser(
@@ -116,6 +225,13 @@ def main():
         "prep", help=("combines HAPCUT2 output with unphased variants for call mode")
     )
     call_parser = subparsers.add_parser("call", help="calls neoepitopes")
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help=(
+            "serves annotation and reference sequence to call mode "
+            "jobs over a Unix socket"
+        ),
+    )
     # Index parser options (produces pickled dictionaries for transcript data)
     index_parser.add_argument(
         "-g", "--gtf", type=str, required=True, help="input path to GTF file"
@@ -127,6 +243,36 @@ def main():
         required=True,
         help="output path to pickled CDS dictionary directory",
     )
+    index_parser.add_argument(
+        "-x",
+        "--bowtie-index",
+        type=str,
+        required=False,
+        help="path to bowtie index (or 2bit or indexed FASTA file) for the "
+        "GTF's genome build; if provided, reference proteins are precomputed "
+        "for each transcript",
+    )
+    index_parser.add_argument(
+        "--processes",
+        type=int,
+        required=False,
+        default=1,
+        help="number of processes to use for parsing the GTF",
+    )
+    index_parser.add_argument(
+        "--incremental",
+        action="store_true",
+        required=False,
+        help="only reprocess transcripts whose GTF content differs from "
+        "that of the index specified with --previous",
+    )
+    index_parser.add_argument(
+        "--previous",
+        type=str,
+        required=False,
+        help="path to pickled CDS dictionary directory from an earlier run "
+        "of neoepiscope index; used with --incremental",
+    )
     # Swap parser options (swaps columns in somatic VCF)
     swap_parser.add_argument(
         "-i", "--input", type=str, required=True, help="input path to somatic VCF"
@@ -195,6 +341,14 @@ def main():
         required=False,
         help="path to Bowtie index basename",
     )
+    call_parser.add_argument(
+        "--reference",
+        type=str,
+        required=False,
+        help="path to 2bit file or FASTA file indexed with samtools faidx "
+        "(optionally bgzip-compressed) from which to retrieve genome sequence "
+        "instead of a Bowtie index",
+    )
     call_parser.add_argument(
         "-v", "--vcf", type=str, required=False, help="input path to somatic VCF"
     )
@@ -244,6 +398,50 @@ def main():
         "binding affinity prediction tools specified via "
         "--affinity-predictor option",
     )
+    call_parser.add_argument(
+        "--score-cache",
+        type=str,
+        required=False,
+        help="path to cache of binding scores from previous runs, consulted "
+        "before running binding prediction tools (default: "
+        "~/.cache/neoepiscope/binding_scores.sqlite)",
+    )
+    call_parser.add_argument(
+        "--no-score-cache",
+        required=False,
+        action="store_true",
+        help="do not read or write cached binding scores",
+    )
+    call_parser.add_argument(
+        "--score-cache-size",
+        type=float,
+        required=False,
+        default=1024,
+        help="maximum size of binding score cache in megabytes; least "
+        "recently used scores are evicted beyond this size",
+    )
+    call_parser.add_argument(
+        "--binding-jobs",
+        type=int,
+        required=False,
+        default=1,
+        help="number of binding prediction jobs (one per allele and tool) "
+        "to run concurrently",
+    )
+    call_parser.add_argument(
+        "--binding-chunk-size",
+        type=int,
+        required=False,
+        help="split each binding prediction job into runs of at most this "
+        "many peptides, which run concurrently up to --binding-jobs",
+    )
+    call_parser.add_argument(
+        "--binding-retries",
+        type=int,
+        required=False,
+        default=1,
+        help="number of times to rerun a failed binding prediction run",
+    )
     call_parser.add_argument(
         "-a",
         "--alleles",
@@ -378,6 +576,75 @@ def main():
         required=False,
         help="minimum TPM to consider a transcript expressed",
     )
+    call_parser.add_argument(
+        "--stream-blocks",
+        type=int,
+        required=False,
+        help="process haplotypes this many HapCUT2 blocks at a time, spilling "
+        "scored neoepitopes to temporary files that are merged at the end, "
+        "so that memory use does not grow with the number of variants",
+    )
+    call_parser.add_argument(
+        "--processes",
+        type=int,
+        required=False,
+        default=1,
+        help="number of processes to use for neoepitope enumeration",
+    )
+    call_parser.add_argument(
+        "--reference-cache-size",
+        type=int,
+        required=False,
+        default=4096,
+        help="maximum number of transcripts whose spliced reference sequence "
+        "is kept in memory by each process; 0 disables caching",
+    )
+    call_parser.add_argument(
+        "--annotation-server",
+        type=str,
+        required=False,
+        help="path to Unix socket of an annotation server started with "
+        "neoepiscope serve; annotation is loaded locally if no server is "
+        "reachable",
+    )
+    # Serve parser options (serves annotation to call mode jobs)
+    serve_parser.add_argument(
+        "-s",
+        "--socket",
+        type=str,
+        required=True,
+        help="path to Unix socket on which to serve annotation",
+    )
+    serve_parser.add_argument(
+        "-x",
+        "--bowtie-index",
+        type=str,
+        required=False,
+        help="path to Bowtie index basename",
+    )
+    serve_parser.add_argument(
+        "--reference",
+        type=str,
+        required=False,
+        help="path to 2bit file or FASTA file indexed with samtools faidx "
+        "(optionally bgzip-compressed) from which to retrieve genome sequence "
+        "instead of a Bowtie index",
+    )
+    serve_parser.add_argument(
+        "-d",
+        "--dicts",
+        type=str,
+        required=False,
+        help="input path to pickled CDS dictionary directory",
+    )
+    serve_parser.add_argument(
+        "-b",
+        "--build",
+        type=str,
+        required=False,
+        help="which default genome build to use (human hg19 or GRCh38, or mouse "
+        "mm9 or mm10); must have used download.py script to install these",
+    )
     args = parser.parse_args()
     if args.subparser_name == "download":
         from .download import NeoepiscopeDownloader
@@ -385,9 +652,38 @@ def main():
         downloader = NeoepiscopeDownloader()
         downloader.run()
     elif args.subparser_name == "index":
-        cds_dict, tx_data_dict = gtf_to_cds(args.gtf, args.dicts)
+        previous_dictdir, changed = None, None
+        if args.incremental:
+            if args.previous is None:
+                sys.exit("The --incremental option requires --previous")
+            if os.path.realpath(args.previous) == os.path.realpath(args.dicts):
+                sys.exit(
+                    "The directory specified with --previous must differ from "
+                    "the output directory"
+                )
+            previous_dictdir = args.previous
+        cds_dict, tx_data_dict = gtf_to_cds(
+            args.gtf,
+            args.dicts,
+            processes=args.processes,
+            previous_dictdir=previous_dictdir,
+        )
+        if previous_dictdir is not None:
+            changed = changed_transcripts(args.dicts, previous_dictdir)
         gene_lengths = cds_to_feature_length(cds_dict, tx_data_dict, args.dicts)
-        tree = cds_to_tree(cds_dict, args.dicts)
+        tree = cds_to_tree(
+            cds_dict, args.dicts, previous_dictdir=previous_dictdir, changed=changed
+        )
+        write_annotation_store(cds_dict, tx_data_dict, gene_lengths, args.dicts)
+        if args.bowtie_index is not None:
+            cds_to_reference_proteome(
+                cds_dict,
+                tx_data_dict,
+                open_reference(args.bowtie_index),
+                args.dicts,
+                previous_dictdir=previous_dictdir,
+                changed=changed,
+            )
     elif args.subparser_name == "swap":
         adjust_tumor_column(args.input, args.output)
     elif args.subparser_name == "merge":
@@ -396,6 +692,9 @@ def main():
         )
     elif args.subparser_name == "prep":
         prep_hapcut_output(args.output, args.hapcut2_output, args.vcf, args.phased)
+    elif args.subparser_name == "serve":
+        dict_dir, reference_path = _annotation_paths(args)
+        serve_annotation(args.socket, dict_dir, reference_path)
     elif args.subparser_name == "call":
         # Check that output options are compatible
         if args.fasta and args.output == "-":
@@ -404,198 +703,29 @@ def main():
                 "please specify an output file using the -o/--output option when "
                 "using the -f/--fasta flag"
             )
-        # Load pickled dictionaries and prepare bowtie index
-        if args.build is not None:
-            if (
-                args.build == "GRCh38"
-                and paths.gencode_v35 is not None
-                and paths.bowtie_grch38 is not None
-            ):
-                with open(
-                    os.path.join(paths.gencode_v35, "intervals_to_transcript.pickle"),
-                    "rb",
-                ) as interval_stream:
-                    interval_dict = pickle.load(interval_stream)
-                with open(
-                    os.path.join(paths.gencode_v35, "transcript_to_CDS.pickle"), "rb"
-                ) as cds_stream:
-                    cds_dict = pickle.load(cds_stream)
-                with open(
-                    os.path.join(paths.gencode_v35, "transcript_to_gene_info.pickle"),
-                    "rb",
-                ) as info_stream:
-                    info_dict = pickle.load(info_stream)
-                with open(
-                    os.path.join(paths.gencode_v35, "feature_to_feature_length.pickle"),
-                    "rb",
-                ) as info_stream:
-                    feature_length_dict = pickle.load(info_stream)
-                reference_index = bowtie_index.BowtieIndexReference(paths.bowtie_grch38)
-            elif (
-                args.build == "hg19"
-                and paths.gencode_v19 is not None
-                and paths.bowtie_hg19 is not None
-            ):
-                with open(
-                    os.path.join(paths.gencode_v19, "intervals_to_transcript.pickle"),
-                    "rb",
-                ) as interval_stream:
-                    interval_dict = pickle.load(interval_stream)
-                with open(
-                    os.path.join(paths.gencode_v19, "transcript_to_CDS.pickle"), "rb"
-                ) as cds_stream:
-                    cds_dict = pickle.load(cds_stream)
-                with open(
-                    os.path.join(paths.gencode_v19, "transcript_to_gene_info.pickle"),
-                    "rb",
-                ) as info_stream:
-                    info_dict = pickle.load(info_stream)
-                with open(
-                    os.path.join(paths.gencode_v19, "feature_to_feature_length.pickle"),
-                    "rb",
-                ) as info_stream:
-                    feature_length_dict = pickle.load(info_stream)
-                reference_index = bowtie_index.BowtieIndexReference(paths.bowtie_hg19)
-            elif (
-                args.build == "mm9"
-                and paths.gencode_vM1 is not None
-                and paths.bowtie_mm9 is not None
-            ):
-                with open(
-                    os.path.join(paths.gencode_vM1, "intervals_to_transcript.pickle"),
-                    "rb",
-                ) as interval_stream:
-                    interval_dict = pickle.load(interval_stream)
-                with open(
-                    os.path.join(paths.gencode_vM1, "transcript_to_CDS.pickle"), "rb"
-                ) as cds_stream:
-                    cds_dict = pickle.load(cds_stream)
-                with open(
-                    os.path.join(paths.gencode_vM1, "transcript_to_gene_info.pickle"),
-                    "rb",
-                ) as info_stream:
-                    info_dict = pickle.load(info_stream)
-                with open(
-                    os.path.join(paths.gencode_vM1, "feature_to_feature_length.pickle"),
-                    "rb",
-                ) as info_stream:
-                    feature_length_dict = pickle.load(info_stream)
-                reference_index = bowtie_index.BowtieIndexReference(paths.bowtie_mm9)
-            elif (
-                args.build == "mm10"
-                and paths.gencode_vM25 is not None
-                and paths.bowtie_mm10 is not None
-            ):
-                with open(
-                    os.path.join(paths.gencode_vM25, "intervals_to_transcript.pickle"),
-                    "rb",
-                ) as interval_stream:
-                    interval_dict = pickle.load(interval_stream)
-                with open(
-                    os.path.join(paths.gencode_vM25, "transcript_to_CDS.pickle"), "rb"
-                ) as cds_stream:
-                    cds_dict = pickle.load(cds_stream)
-                with open(
-                    os.path.join(paths.gencode_vM25, "transcript_to_gene_info.pickle"),
-                    "rb",
-                ) as info_stream:
-                    info_dict = pickle.load(info_stream)
-                with open(
-                    os.path.join(
-                        paths.gencode_vM25, "feature_to_feature_length.pickle"
-                    ),
-                    "rb",
-                ) as info_stream:
-                    feature_length_dict = pickle.load(info_stream)
-                reference_index = bowtie_index.BowtieIndexReference(paths.bowtie_mm10)
-            else:
-                raise RuntimeError(
-                    "".join(
-                        [
-                            args.build,
-                            " is not an available genome build. Please "
-                            "check that you have run neoepiscope download and are "
-                            "using 'hg19', 'GRCh38', 'mm10', or 'mm9' for this argument.",
-                        ]
-                    )
-                )
+        annotation_client = None
+        if args.annotation_server is not None:
+            annotation_client = connect_annotation_server(args.annotation_server)
+        if annotation_client is not None:
+            # Retrieve annotation and reference sequence from annotation server
+            interval_dict = annotation_client.intervals
+            cds_dict = annotation_client.cds
+            info_dict = annotation_client.info
+            feature_length_dict = annotation_client.feature_lengths
+            reference_proteome = annotation_client.reference_proteome
+            reference_index = annotation_client.reference
         else:
-            if args.bowtie_index is not None and args.dicts is not None:
-                intervals_path = os.path.join(
-                    args.dicts, "intervals_to_transcript.pickle"
-                )
-                if os.path.isfile(intervals_path):
-                    with open(intervals_path, "rb") as interval_stream:
-                        interval_dict = pickle.load(interval_stream)
-                else:
-                    raise RuntimeError(
-                        "".join(
-                            [
-                                "Cannot find ",
-                                intervals_path,
-                                "; have you indexed your GTF with neoepiscope index?",
-                            ]
-                        )
-                    )
-                cds_path = os.path.join(args.dicts, "transcript_to_CDS.pickle")
-                if os.path.isfile(cds_path):
-                    with open(cds_path, "rb") as cds_stream:
-                        cds_dict = pickle.load(cds_stream)
-                else:
-                    raise RuntimeError(
-                        "".join(
-                            [
-                                "Cannot find ",
-                                cds_path,
-                                "; have you indexed your GTF with neoepiscope index?",
-                            ]
-                        )
-                    )
-                info_path = os.path.join(args.dicts, "transcript_to_gene_info.pickle")
-                if os.path.isfile(info_path):
-                    with open(info_path, "rb") as info_stream:
-                        info_dict = pickle.load(info_stream)
-                else:
-                    raise RuntimeError(
-                        "".join(
-                            [
-                                "Cannot find ",
-                                info_path,
-                                "; have you indexed your GTF with neoepiscope index?",
-                            ]
-                        )
-                    )
-                feature_length_path = os.path.join(
-                    args.dicts, "feature_to_feature_length.pickle"
-                )
-                if os.path.isfile(feature_length_path):
-                    with open(feature_length_path, "rb") as length_stream:
-                        feature_length_dict = pickle.load(length_stream)
-                else:
-                    raise RuntimeError(
-                        "".join(
-                            [
-                                "Cannot find ",
-                                feature_length_path,
-                                "; have you indexed your GTF with neoepiscope index?",
-                            ]
-                        )
-                    )
-                bowtie_files = [
-                    "".join([args.bowtie_index, ".", str(x), ".ebwt"])
-                    for x in range(1, 5)
-                ]
-                if list(set([os.path.isfile(x) for x in bowtie_files])) == [True]:
-                    reference_index = bowtie_index.BowtieIndexReference(
-                        args.bowtie_index
-                    )
-                else:
-                    raise RuntimeError("Cannot find specified bowtie index")
-            else:
-                raise RuntimeError(
-                    "User must specify either --build OR "
-                    "--bowtie_index and --dicts options"
-                )
+            dict_dir, reference_path = _annotation_paths(args)
+            reference_index = open_reference(reference_path)
+            # Load annotation store if available, otherwise pickled dictionaries
+            (
+                interval_dict,
+                cds_dict,
+                info_dict,
+                feature_length_dict,
+            ) = load_annotation(dict_dir)
+            reference_proteome = load_reference_proteome(dict_dir)
+        reference_sequence_cache.max_transcripts = args.reference_cache_size
         # Check affinity predictor(s)
         if args.no_affinity:
             args.affinity_predictor = None
@@ -609,7 +739,15 @@ def main():
                 Warning,
             )
             hla_alleles = []
+            score_cache = None
         else:
+            if args.no_score_cache:
+                score_cache = None
+            else:
+                score_cache = open_score_cache(
+                    args.score_cache or default_score_cache(),
+                    max_size=int(args.score_cache_size * 1024 * 1024),
+                )
             if args.alleles:
                 hla_alleles = sorted(args.alleles.split(","))
             else:
@@ -708,45 +846,178 @@ def main():
             # Not using expression data
             tpm_dict = None
             tpm_threshold = None
-        # Find transcripts that haplotypes overlap
-        relevant_transcripts, homozygous_variants = process_haplotypes(
-            args.merged_hapcut2_output, interval_dict, phase_mutations
-        )
-        # Apply mutations to transcripts and get neoepitopes
-        neoepitopes, fasta = get_peptides_from_transcripts(
-            relevant_transcripts,
-            homozygous_variants,
-            vaf_pos,
-            cds_dict,
-            info_dict,
-            only_novel_upstream,
-            only_downstream,
-            only_reference,
-            reference_index,
-            size_list,
-            args.nmd,
-            args.pp,
-            args.igv,
-            args.trv,
-            args.allow_nonstart,
-            args.allow_nonstop,
-            args.allow_partial_codons,
-            include_germline,
-            include_somatic,
-            protein_fasta=args.fasta,
-        )
-        # If neoepitopes are found, get binding scores and write results
-        if len(neoepitopes) > 0:
-            full_neoepitopes = gather_binding_scores(
-                neoepitopes, tool_dict, hla_alleles, size_list
+        if args.stream_blocks is None:
+            # Find transcripts that haplotypes overlap
+            relevant_transcripts, homozygous_variants = process_haplotypes(
+                args.merged_hapcut2_output, interval_dict, phase_mutations
+            )
+            # Apply mutations to transcripts and get neoepitopes
+            neoepitopes, fasta = get_peptides_from_transcripts(
+                relevant_transcripts,
+                homozygous_variants,
+                vaf_pos,
+                cds_dict,
+                info_dict,
+                only_novel_upstream,
+                only_downstream,
+                only_reference,
+                reference_index,
+                size_list,
+                args.nmd,
+                args.pp,
+                args.igv,
+                args.trv,
+                args.allow_nonstart,
+                args.allow_nonstop,
+                args.allow_partial_codons,
+                include_germline,
+                include_somatic,
+                protein_fasta=args.fasta,
+                processes=args.processes,
+                reference_proteome=reference_proteome,
             )
-            # Find expressed variants if relevant
-            if args.rna_bam:
-                expressed_variants, covered_variants = get_expressed_variants(
-                    args.rna_bam, reference_index, full_neoepitopes
+            # If neoepitopes are found, get binding scores
+            if len(neoepitopes) > 0:
+                full_neoepitopes = gather_binding_scores(
+                    neoepitopes,
+                    tool_dict,
+                    hla_alleles,
+                    size_list,
+                    score_cache,
+                    jobs=args.binding_jobs,
+                    chunk_size=args.binding_chunk_size,
+                    retries=args.binding_retries,
+                )
+                # Find expressed variants if relevant
+                if args.rna_bam:
+                    expressed_variants, covered_variants = get_expressed_variants(
+                        args.rna_bam, reference_index, full_neoepitopes
+                    )
+                else:
+                    expressed_variants, covered_variants = None, None
+            else:
+                full_neoepitopes = None
+        else:
+            # Stream groups of HapCUT2 blocks through neoepitope enumeration
+            # and binding prediction, spilling results for a final merge
+            hapcut2_output = args.merged_hapcut2_output
+            if hapcut2_output == "-":
+                # Haplotypes are read twice, so spool standard input to disk
+                spool_handle, hapcut2_output = tempfile.mkstemp(suffix=".hapcut.out")
+                with os.fdopen(spool_handle, "w") as spool_stream:
+                    shutil.copyfileobj(sys.stdin, spool_stream)
+            try:
+                # Homozygous variants are applied to haplotypes from every
+                # block, so collect them first, along with the order in which
+                # transcripts are first affected
+                homozygous_variants = collections.defaultdict(list)
+                transcript_order = {}
+                for block_transcripts, block_homozygous in iterate_haplotype_blocks(
+                    hapcut2_output, interval_dict, phase_mutations, args.stream_blocks
+                ):
+                    for transcript_id in block_transcripts:
+                        transcript_order.setdefault(
+                            transcript_id, len(transcript_order)
+                        )
+                    for transcript_id in block_homozygous:
+                        homozygous_variants[transcript_id].extend(
+                            block_homozygous[transcript_id]
+                        )
+                used_homozygous_variants = set()
+                spill_files = []
+                homozygous_spill = None
+                fasta = collections.defaultdict(set)
+                variant_annotations = {}
+                # Homozygous variants not applied to any haplotype are
+                # processed after the last group of blocks
+                block_groups = itertools.chain(
+                    (
+                        (relevant_transcripts, False)
+                        for relevant_transcripts, _ in iterate_haplotype_blocks(
+                            hapcut2_output,
+                            interval_dict,
+                            phase_mutations,
+                            args.stream_blocks,
+                        )
+                    ),
+                    [({}, True)],
                 )
+                for relevant_transcripts, process_homozygous in block_groups:
+                    neoepitopes, group_fasta = get_peptides_from_transcripts(
+                        relevant_transcripts,
+                        homozygous_variants,
+                        vaf_pos,
+                        cds_dict,
+                        info_dict,
+                        only_novel_upstream,
+                        only_downstream,
+                        only_reference,
+                        reference_index,
+                        size_list,
+                        args.nmd,
+                        args.pp,
+                        args.igv,
+                        args.trv,
+                        args.allow_nonstart,
+                        args.allow_nonstop,
+                        args.allow_partial_codons,
+                        include_germline,
+                        include_somatic,
+                        protein_fasta=args.fasta,
+                        processes=args.processes,
+                        used_homozygous_variants=used_homozygous_variants,
+                        process_homozygous=process_homozygous,
+                        reference_proteome=reference_proteome,
+                    )
+                    for transcript_id in group_fasta:
+                        fasta[transcript_id].update(group_fasta[transcript_id])
+                    if len(neoepitopes) > 0:
+                        neoepitopes = gather_binding_scores(
+                            neoepitopes,
+                            tool_dict,
+                            hla_alleles,
+                            size_list,
+                            score_cache,
+                            jobs=args.binding_jobs,
+                            chunk_size=args.binding_chunk_size,
+                            retries=args.binding_retries,
+                        )
+                        # Keep one annotation per variant for expression
+                        for epitope in neoepitopes:
+                            for meta_data in neoepitopes[epitope]:
+                                variant_annotations.setdefault(
+                                    tuple(meta_data[0:5]), [meta_data]
+                                )
+                        if process_homozygous:
+                            homozygous_spill = len(spill_files)
+                        spill_files.append(spill_neoepitopes(neoepitopes))
+            finally:
+                if hapcut2_output != args.merged_hapcut2_output:
+                    os.remove(hapcut2_output)
+            if spill_files:
+                # Order metadata as if all blocks were processed at once:
+                # by transcript, then homozygous variants alone
+                full_neoepitopes = merge_spilled_neoepitopes(
+                    spill_files,
+                    sort_key=lambda i, meta_data: (
+                        (1, 0)
+                        if i == homozygous_spill
+                        else (0, transcript_order[meta_data[8]])
+                    ),
+                )
+                # Find expressed variants if relevant
+                if args.rna_bam:
+                    expressed_variants, covered_variants = get_expressed_variants(
+                        args.rna_bam, reference_index, variant_annotations
+                    )
+                else:
+                    expressed_variants, covered_variants = None, None
             else:
-                expressed_variants, covered_variants = None, None
+                full_neoepitopes = None
+        if score_cache is not None:
+            score_cache.close()
+        # If neoepitopes are found, write results
+        if full_neoepitopes is not None:
             write_results(
                 args.output,
                 hla_alleles,
@@ -0,0 +1,632 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+annotation_server.py
+
+Part of neoepiscope
+Serves transcript annotation and reference sequence from one long-lived
+process over a Unix socket, so that concurrent neoepiscope call jobs on the
+same machine share a single copy of them in memory.
+
+Licensed under the MIT license.
+
+The MIT License (MIT)
+Copyright (c) 2018 Mary A. Wood, Austin Nguyen,
+                   Abhinav Nellore, and Reid Thompson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from __future__ import absolute_import, division, print_function
+from .annotation_store import load_annotation, load_reference_proteome
+from .interval_index import get_transcripts_from_tree_batch
+from .reference import open_reference
+from intervaltree import Interval
+import os
+import pickle
+import signal
+import socket
+import struct
+import sys
+import threading
+import warnings
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Bump when requests or responses change
+_protocol_version = 1
+# Every message is a pickled object preceded by its length
+_message_header = struct.Struct("<Q")
+
+
+def _send_message(stream, message):
+    """Writes a length-prefixed pickled message
+
+    stream: writable binary file object
+    message: picklable object
+
+    No return value.
+    """
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_message_header.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def _receive_message(stream):
+    """Reads a length-prefixed pickled message
+
+    stream: readable binary file object
+
+    Return value: unpickled object, or None if the stream is closed
+    """
+    header = stream.read(_message_header.size)
+    if len(header) < _message_header.size:
+        return None
+    size = _message_header.unpack(header)[0]
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+    return pickle.loads(payload)
+
+
+class AnnotationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves annotation and reference sequence over a Unix socket
+
+    Each client connection is handled on its own thread, and requests are
+        answered in the order they arrive. Requests are tuples of (method name,
+        arguments); responses are tuples of (True, result) or (False, error
+        message). The socket is readable and writable only by its owner.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path,
+        interval_dict,
+        cds_dict,
+        info_dict,
+        feature_length_dict,
+        reference_proteome,
+        reference_index,
+    ):
+        """Binds socket
+
+        socket_path: path to Unix socket
+        interval_dict: dictionary linking contigs to ContigIntervals objects
+        cds_dict: dictionary linking transcript IDs to CDS blocks
+        info_dict: dictionary linking transcript IDs to transcript data
+        feature_length_dict: dictionary linking features to feature lengths
+        reference_proteome: dictionary linking transcript IDs to reference
+            proteins, or None
+        reference_index: BowtieIndexReference or SequenceReference object
+
+        No return value.
+        """
+        self.socket_path = socket_path
+        self.interval_dict = interval_dict
+        self.cds_dict = cds_dict
+        self.info_dict = info_dict
+        self.feature_length_dict = feature_length_dict
+        self.reference_proteome = reference_proteome
+        self.reference_index = reference_index
+        if os.path.exists(socket_path):
+            client = connect_annotation_server(socket_path, warn=False)
+            if client is not None:
+                client.close()
+                raise RuntimeError(
+                    "".join(["An annotation server is already using ", socket_path])
+                )
+            # Remove socket left behind by a server that did not exit cleanly
+            os.remove(socket_path)
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(
+                self, socket_path, _AnnotationRequestHandler
+            )
+        finally:
+            os.umask(old_umask)
+
+    def describe(self):
+        """Describes served annotation
+
+        Return value: dictionary with protocol version, contigs in the
+            interval index, reference path and sequence lengths, and whether
+            reference proteins are available
+        """
+        return {
+            "version": _protocol_version,
+            "contigs": list(self.interval_dict),
+            "idx_prefix": self.reference_index.idx_prefix,
+            "length": dict(self.reference_index.length),
+            "reference_proteome": self.reference_proteome is not None,
+        }
+
+    def transcripts(self, transcript_ids):
+        """Looks up annotation of transcripts
+
+        transcript_ids: list of transcript IDs
+
+        Return value: dictionary linking each transcript ID to a tuple of
+            (CDS blocks, transcript data, reference protein), with None for
+            anything missing
+        """
+        reference_proteome = self.reference_proteome or {}
+        return {
+            transcript_id: (
+                self.cds_dict.get(transcript_id),
+                self.info_dict.get(transcript_id),
+                reference_proteome.get(transcript_id),
+            )
+            for transcript_id in transcript_ids
+        }
+
+    def transcript_ids(self, table):
+        """Lists transcript IDs in one of the served dictionaries
+
+        table: "cds", "info", or "reference_proteome"
+
+        Return value: list of transcript IDs
+        """
+        return list(
+            {
+                "cds": self.cds_dict,
+                "info": self.info_dict,
+                "reference_proteome": self.reference_proteome or {},
+            }[table]
+        )
+
+    def feature_lengths(self):
+        """Obtains all feature lengths
+
+        Return value: dictionary linking features to feature lengths
+        """
+        return dict(self.feature_length_dict.items())
+
+    def overlapping_transcripts(self, queries):
+        """Finds transcripts overlapping genomic ranges
+
+        queries: list of (contig, start, stop) tuples, with stop exclusive
+
+        Return value: list of lists of unique transcript IDs, one per query
+        """
+        return get_transcripts_from_tree_batch(queries, self.interval_dict)
+
+    def overlap(self, chrom, start, stop):
+        """Finds intervals overlapping a genomic range
+
+        chrom: contig
+        start: start of range (inclusive)
+        stop: end of range (exclusive)
+
+        Return value: list of (start, end, transcript ID) tuples
+        """
+        return [
+            (interval.begin, interval.end, interval.data)
+            for interval in self.interval_dict[chrom].overlap(start, stop)
+        ]
+
+    def stretches(self, ref_id, stretches):
+        """Retrieves stretches of reference sequence
+
+        ref_id: name of reference sequence
+        stretches: list of (offset, count) tuples
+
+        Return value: list of strings extracted from reference
+        """
+        return self.reference_index.get_stretches(ref_id, stretches)
+
+    def recs(self, ref_id):
+        """Obtains unambiguous-stretch records of a reference sequence
+
+        ref_id: name of reference sequence
+
+        Return value: list of (offset, length, first-of-chromosome flag)
+            tuples
+        """
+        return list(self.reference_index.recs[ref_id])
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class _AnnotationRequestHandler(socketserver.StreamRequestHandler):
+    """Answers requests from one client until it disconnects"""
+
+    _methods = frozenset(
+        [
+            "describe",
+            "transcripts",
+            "transcript_ids",
+            "feature_lengths",
+            "overlapping_transcripts",
+            "overlap",
+            "stretches",
+            "recs",
+        ]
+    )
+
+    def handle(self):
+        while True:
+            request = _receive_message(self.rfile)
+            if request is None:
+                return
+            method, args = request
+            if method not in self._methods:
+                _send_message(
+                    self.wfile, (False, "".join(["Unknown request ", str(method)]))
+                )
+                continue
+            try:
+                response = (True, getattr(self.server, method)(*args))
+            except Exception as e:
+                response = (False, "".join([type(e).__name__, ": ", str(e)]))
+            _send_message(self.wfile, response)
+
+
+def serve_annotation(socket_path, dict_dir, reference_path):
+    """Loads annotation and reference, then serves them until interrupted
+
+    socket_path: path to Unix socket
+    dict_dir: path to directory containing annotation produced by
+        neoepiscope index
+    reference_path: path to reference; see open_reference()
+
+    No return value.
+    """
+    reference_index = open_reference(reference_path)
+    interval_dict, cds_dict, info_dict, feature_length_dict = load_annotation(dict_dir)
+    server = AnnotationServer(
+        socket_path,
+        interval_dict,
+        cds_dict,
+        info_dict,
+        feature_length_dict,
+        load_reference_proteome(dict_dir),
+        reference_index,
+    )
+    # Exit through finally block on SIGTERM so the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Serving annotation on {}".format(socket_path), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class AnnotationClient(object):
+    """Connection to an annotation server
+
+    The intervals, cds, info, feature_lengths, and reference_proteome
+        attributes behave like the values returned by load_annotation() and
+        load_reference_proteome(), and the reference attribute like a
+        BowtieIndexReference object. Transcript annotation is kept locally once
+        retrieved.
+    """
+
+    def __init__(self, socket_path):
+        """Connects to server and retrieves description of served annotation
+
+        socket_path: path to Unix socket
+
+        No return value.
+        """
+        self.socket_path = socket_path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(socket_path)
+        except socket.error:
+            self.socket.close()
+            raise
+        self.rfile = self.socket.makefile("rb")
+        self.wfile = self.socket.makefile("wb")
+        self.lock = threading.Lock()
+        description = self.request("describe")
+        if description["version"] != _protocol_version:
+            self.close()
+            raise RuntimeError(
+                "".join(
+                    [
+                        "Annotation server at ",
+                        socket_path,
+                        " runs an incompatible version of neoepiscope",
+                    ]
+                )
+            )
+        self.annotation = {}
+        self.intervals = RemoteIntervals(self, description["contigs"])
+        self.cds = _RemoteTranscriptView(self, "cds", 0)
+        self.info = _RemoteTranscriptView(self, "info", 1)
+        self.feature_lengths = _RemoteFeatureLengths(self)
+        if description["reference_proteome"]:
+            self.reference_proteome = _RemoteTranscriptView(
+                self, "reference_proteome", 2
+            )
+        else:
+            self.reference_proteome = None
+        self.reference = RemoteReference(
+            self, description["idx_prefix"], description["length"]
+        )
+
+    def request(self, method, *args):
+        """Sends a request and waits for its response
+
+        method: name of AnnotationServer method
+        args: arguments of method
+
+        Return value: return value of method
+        """
+        with self.lock:
+            _send_message(self.wfile, (method, args))
+            response = _receive_message(self.rfile)
+        if response is None:
+            raise RuntimeError(
+                "".join(["Lost connection to annotation server at ", self.socket_path])
+            )
+        success, result = response
+        if not success:
+            raise RuntimeError(
+                "".join(["Annotation server request ", method, " failed: ", result])
+            )
+        return result
+
+    def transcripts(self, transcript_ids):
+        """Retrieves annotation of transcripts not yet retrieved
+
+        transcript_ids: iterable of transcript IDs
+
+        No return value.
+        """
+        missing = [
+            transcript_id
+            for transcript_id in transcript_ids
+            if transcript_id not in self.annotation
+        ]
+        if missing:
+            self.annotation.update(self.request("transcripts", missing))
+
+    def close(self):
+        """Closes connection
+
+        No return value.
+        """
+        self.rfile.close()
+        self.wfile.close()
+        self.socket.close()
+
+
+class _RemoteTranscriptView(Mapping):
+    """Dictionary-like view of one field of transcript annotation retrieved
+    from an annotation server
+    """
+
+    def __init__(self, client, table, field):
+        self.client = client
+        self.table = table
+        self.field = field
+
+    def prefetch(self, transcript_ids):
+        """Retrieves annotation of many transcripts with one request
+
+        transcript_ids: iterable of transcript IDs
+
+        No return value.
+        """
+        self.client.transcripts(transcript_ids)
+
+    def __getitem__(self, transcript_id):
+        self.client.transcripts([transcript_id])
+        value = self.client.annotation[transcript_id][self.field]
+        if value is None:
+            raise KeyError(transcript_id)
+        return value
+
+    def __iter__(self):
+        return iter(self.client.request("transcript_ids", self.table))
+
+    def __len__(self):
+        return len(self.client.request("transcript_ids", self.table))
+
+
+class _RemoteFeatureLengths(Mapping):
+    """Dictionary-like view of feature lengths, retrieved from an annotation
+    server in full on first use
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._feature_lengths = None
+
+    def _lengths(self):
+        if self._feature_lengths is None:
+            self._feature_lengths = self.client.request("feature_lengths")
+        return self._feature_lengths
+
+    def __getitem__(self, feature):
+        return self._lengths()[feature]
+
+    def __iter__(self):
+        return iter(self._lengths())
+
+    def __len__(self):
+        return len(self._lengths())
+
+
+class RemoteIntervals(Mapping):
+    """Dictionary-like view of per-contig intervals held by an annotation
+    server; get_transcripts_from_tree_batch() resolves all of its queries
+    with one request
+    """
+
+    def __init__(self, client, contigs):
+        self.client = client
+        self.contigs = contigs
+        self._contig_set = frozenset(contigs)
+
+    def transcripts_batch(self, queries):
+        """Finds transcripts overlapping many genomic ranges
+
+        queries: list of (contig, start, stop) tuples, with stop exclusive
+
+        Return value: list of lists of unique transcript IDs, one per query
+        """
+        return self.client.request("overlapping_transcripts", list(queries))
+
+    def __getitem__(self, chrom):
+        if chrom not in self._contig_set:
+            raise KeyError(chrom)
+        return _RemoteContigIntervals(self.client, chrom)
+
+    def __contains__(self, chrom):
+        return chrom in self._contig_set
+
+    def __iter__(self):
+        return iter(self.contigs)
+
+    def __len__(self):
+        return len(self.contigs)
+
+
+class _RemoteContigIntervals(object):
+    """Intervals on one contig held by an annotation server, supporting the
+    overlap queries of an IntervalTree
+    """
+
+    def __init__(self, client, chrom):
+        self.client = client
+        self.chrom = chrom
+
+    def overlap(self, begin, end):
+        return set(
+            Interval(*interval)
+            for interval in self.client.request("overlap", self.chrom, begin, end)
+        )
+
+
+class RemoteReference(object):
+    """Reference sequence retrieved from an annotation server, with the
+    interface of BowtieIndexReference
+    """
+
+    def __init__(self, client, idx_prefix, length):
+        """Stores reference description
+
+        client: AnnotationClient object
+        idx_prefix: path to reference served
+        length: dictionary linking reference names to their lengths
+
+        No return value.
+        """
+        self.client = client
+        self.idx_prefix = idx_prefix
+        self.length = length
+        self.annotation_server = client.socket_path
+        self._recs = {}
+
+    def get_stretch(self, ref_id, ref_off, count):
+        """Retrieves a stretch of reference sequence
+
+        ref_id: name of reference sequence
+        ref_off: offset into reference, 0-based
+        count: number of characters
+
+        Return value: string extracted from reference
+        """
+        return self.client.request("stretches", ref_id, [(ref_off, count)])[0]
+
+    def get_stretches(self, ref_id, stretches, max_gap=32):
+        """Retrieves several stretches of one reference sequence with a single
+        request
+
+        ref_id: name of reference sequence
+        stretches: iterable of (ref_off, count) tuples
+        max_gap: unused; the server batches reads itself
+
+        Return value: list of strings, one per stretch, in the order given
+        """
+        return self.client.request("stretches", ref_id, list(stretches))
+
+    @property
+    def recs(self):
+        """Unambiguous-stretch records of each reference, retrieved on first
+        use of each reference
+        """
+        return _RemoteRecs(self)
+
+
+class _RemoteRecs(Mapping):
+    """Dictionary-like view of unambiguous-stretch records held by an
+    annotation server
+    """
+
+    def __init__(self, reference):
+        self.reference = reference
+
+    def __getitem__(self, ref_id):
+        if ref_id not in self.reference.length:
+            raise KeyError(ref_id)
+        if ref_id not in self.reference._recs:
+            self.reference._recs[ref_id] = self.reference.client.request("recs", ref_id)
+        return self.reference._recs[ref_id]
+
+    def __iter__(self):
+        return iter(self.reference.length)
+
+    def __len__(self):
+        return len(self.reference.length)
+
+
+def connect_annotation_server(socket_path, warn=True):
+    """Connects to an annotation server if one is running
+
+    socket_path: path to Unix socket
+    warn: whether to warn when no server can be reached
+
+    Return value: AnnotationClient object, or None if no server is reachable
+    """
+    try:
+        return AnnotationClient(socket_path)
+    except (socket.error, RuntimeError) as e:
+        if warn:
+            warnings.warn(
+                "".join(
+                    [
+                        "Cannot reach annotation server at ",
+                        socket_path,
+                        " (",
+                        str(e),
+                        "); loading annotation locally",
+                    ]
+                ),
+                Warning,
+            )
+        return None
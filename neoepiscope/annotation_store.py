@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+annotation_store.py
+
+Part of neoepiscope
+Compact, memory-mappable storage of the transcript annotation produced by
+neoepiscope index, as an alternative to pickled dictionaries.
+
+Licensed under the MIT license.
+
+The MIT License (MIT)
+Copyright (c) 2018 Mary A. Wood, Austin Nguyen,
+                   Abhinav Nellore, and Reid Thompson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from __future__ import absolute_import, division, print_function
+from .interval_index import ContigIntervals
+import collections
+import json
+import os
+import pickle
+import numpy as np
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Name of annotation store directory within a neoepiscope index directory
+store_dirname = "annotation_store"
+# Bump when the on-disk layout changes
+_store_version = 1
+# Sentinels for transcript support levels that are not integers
+_tsl_none = -1
+_tsl_na = -2
+_block_dtype = np.dtype(
+    [
+        ("chrom", "<i4"),
+        ("type", "<i4"),
+        ("start", "<i8"),
+        ("end", "<i8"),
+        ("strand", "<i4"),
+        ("tx_type", "<i4"),
+    ]
+)
+_info_dtype = np.dtype(
+    [
+        ("tx_type", "<i4"),
+        ("gene_id", "<i4"),
+        ("gene_name", "<i4"),
+        ("tsl", "<i4"),
+        ("has_info", "u1"),
+    ]
+)
+
+
+def write_annotation_store(cds_dict, tx_data_dict, feature_length_dict, dictdir):
+    """Writes columnar, memory-mappable versions of the dictionaries produced
+        by gtf_to_cds(), cds_to_feature_length(), and cds_to_tree()
+
+    Arrays are written as .npy files to an annotation_store directory within
+        dictdir; a manifest is written last so that an incomplete store is
+        never loaded.
+
+    cds_dict: CDS dictionary produced by gtf_to_cds()
+    tx_data_dict: transcript data dictionary produced by gtf_to_cds()
+    feature_length_dict: feature length dictionary produced by
+        cds_to_feature_length()
+    dictdir: path to directory to store annotation
+
+    Return value: path to annotation store directory
+    """
+    store_dir = os.path.join(dictdir, store_dirname)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    manifest = os.path.join(store_dir, "manifest.json")
+    if os.path.isfile(manifest):
+        os.remove(manifest)
+    transcripts = sorted(set(cds_dict.keys()) | set(tx_data_dict.keys()))
+    transcript_index = {transcript_id: i for i, transcript_id in enumerate(transcripts)}
+    # Pool of unique strings, referenced by position
+    strings = []
+    string_index = {}
+
+    def string_code(string):
+        try:
+            return string_index[string]
+        except KeyError:
+            string_index[string] = len(strings)
+            strings.append(string)
+            return string_index[string]
+
+    # CDS blocks, with offsets into block array for each transcript
+    block_offsets = np.zeros(len(transcripts) + 1, dtype="<i8")
+    blocks = []
+    for i, transcript_id in enumerate(transcripts):
+        for block in cds_dict.get(transcript_id, []):
+            blocks.append(
+                (
+                    string_code(block[0]),
+                    string_code(block[1]),
+                    block[2],
+                    block[3],
+                    string_code(block[4]),
+                    string_code(block[5]),
+                )
+            )
+        block_offsets[i + 1] = len(blocks)
+    blocks = np.array(blocks, dtype=_block_dtype)
+    # Transcript/gene info, with offsets into tag array for each transcript
+    info = np.zeros(len(transcripts), dtype=_info_dtype)
+    tag_offsets = np.zeros(len(transcripts) + 1, dtype="<i8")
+    tags = []
+    for i, transcript_id in enumerate(transcripts):
+        if transcript_id in tx_data_dict:
+            tx_type, gene_id, gene_name, tx_tags, tsl = tx_data_dict[transcript_id]
+            if tsl is None:
+                tsl = _tsl_none
+            elif tsl == "NA":
+                tsl = _tsl_na
+            info[i] = (
+                string_code(tx_type),
+                string_code(gene_id),
+                string_code(gene_name),
+                tsl,
+                1,
+            )
+            tags.extend([string_code(tag) for tag in tx_tags])
+        tag_offsets[i + 1] = len(tags)
+    tags = np.array(tags, dtype="<i4")
+    # Feature lengths; NaN marks transcripts without a stored length
+    feature_lengths = np.full(len(transcripts), np.nan, dtype="<f8")
+    for transcript_id, length in feature_length_dict.items():
+        if transcript_id in transcript_index:
+            feature_lengths[transcript_index[transcript_id]] = length
+    # Intervals, sorted by start within each contig; as in cds_to_tree(),
+    # all blocks of a transcript are placed on the first block's contig
+    contig_intervals = collections.defaultdict(set)
+    for transcript_id in cds_dict:
+        transcript = cds_dict[transcript_id]
+        chrom = transcript[0][0]
+        for cds in transcript:
+            start = cds[2]
+            stop = cds[3] + 1
+            if stop > start:
+                contig_intervals[chrom].add(
+                    (start, stop, transcript_index[transcript_id])
+                )
+    contigs = []
+    interval_records = []
+    for chrom in sorted(contig_intervals):
+        lo = len(interval_records)
+        interval_records.extend(sorted(contig_intervals[chrom]))
+        contigs.append([chrom, lo, len(interval_records)])
+    interval_records = np.array(interval_records, dtype="<i8").reshape(-1, 3)
+    interval_starts = interval_records[:, 0].copy()
+    interval_ends = interval_records[:, 1].copy()
+    interval_transcripts = interval_records[:, 2].astype("<i4")
+    # Running maximum of interval ends within each contig bounds overlap queries
+    interval_max_ends = interval_ends.copy()
+    for chrom, lo, hi in contigs:
+        np.maximum.accumulate(interval_max_ends[lo:hi], out=interval_max_ends[lo:hi])
+    # String pool as a single byte blob plus offsets
+    encoded = [string.encode("utf-8") for string in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    string_offsets[1:] = np.cumsum([len(string) for string in encoded])
+    string_blob = np.frombuffer(b"".join(encoded), dtype="u1")
+    arrays = {
+        "transcripts": np.array(
+            [transcript_id.encode("utf-8") for transcript_id in transcripts],
+            dtype="S{}".format(
+                max([len(x.encode("utf-8")) for x in transcripts] + [1])
+            ),
+        ),
+        "block_offsets": block_offsets,
+        "blocks": blocks,
+        "info": info,
+        "tag_offsets": tag_offsets,
+        "tags": tags,
+        "feature_lengths": feature_lengths,
+        "interval_starts": interval_starts,
+        "interval_ends": interval_ends,
+        "interval_max_ends": interval_max_ends,
+        "interval_transcripts": interval_transcripts,
+        "string_offsets": string_offsets,
+        "strings": string_blob,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(store_dir, "".join([name, ".npy"])), array)
+    with open(manifest, "w") as f:
+        json.dump({"version": _store_version, "contigs": contigs}, f)
+    return store_dir
+
+
+class AnnotationStore(object):
+    """Read-only view of an annotation store written by write_annotation_store()
+
+    Arrays are memory-mapped on first use, so opening a store is nearly free
+        and concurrent processes share the operating system's page cache.
+        The intervals, cds, info, and feature_lengths attributes behave like
+        the dictionaries returned by cds_to_tree(), gtf_to_cds(), and
+        cds_to_feature_length(), respectively.
+    """
+
+    def __init__(self, store_dir):
+        """Reads store manifest
+
+        store_dir: path to annotation store directory
+
+        No return value.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["version"] != _store_version:
+            raise RuntimeError(
+                "".join(
+                    [
+                        "Annotation store ",
+                        store_dir,
+                        " was written by an incompatible version of neoepiscope; ",
+                        "please rerun neoepiscope index",
+                    ]
+                )
+            )
+        self.contigs = collections.OrderedDict(
+            (chrom, (lo, hi)) for chrom, lo, hi in manifest["contigs"]
+        )
+        self._arrays = {}
+        self._strings = {}
+        self._transcript_ids = {}
+        self.intervals = _StoreIntervals(self)
+        self.cds = _StoreCDS(self)
+        self.info = _StoreInfo(self)
+        self.feature_lengths = _StoreFeatureLengths(self)
+
+    def array(self, name):
+        """Memory-maps a stored array, caching it for subsequent calls
+
+        name: name of array
+
+        Return value: read-only numpy array
+        """
+        try:
+            return self._arrays[name]
+        except KeyError:
+            self._arrays[name] = np.load(
+                os.path.join(self.store_dir, "".join([name, ".npy"])), mmap_mode="r"
+            )
+            return self._arrays[name]
+
+    def string(self, code):
+        """Obtains a string from the string pool
+
+        code: position of string in pool
+
+        Return value: string
+        """
+        try:
+            return self._strings[code]
+        except KeyError:
+            offsets = self.array("string_offsets")
+            self._strings[code] = (
+                self.array("strings")[offsets[code] : offsets[code + 1]]
+                .tobytes()
+                .decode("utf-8")
+            )
+            return self._strings[code]
+
+    def transcript_id(self, index):
+        """Obtains transcript ID from its position in the store
+
+        index: position of transcript
+
+        Return value: transcript ID
+        """
+        index = int(index)
+        try:
+            return self._transcript_ids[index]
+        except KeyError:
+            self._transcript_ids[index] = self.array("transcripts")[index].decode(
+                "utf-8"
+            )
+            return self._transcript_ids[index]
+
+    def transcript_index(self, transcript_id):
+        """Finds position of transcript in the store by binary search
+
+        transcript_id: transcript ID
+
+        Return value: position of transcript, or None if it is absent
+        """
+        transcripts = self.array("transcripts")
+        try:
+            key = transcript_id.encode("utf-8")
+        except AttributeError:
+            return None
+        if len(key) > transcripts.dtype.itemsize:
+            return None
+        index = int(np.searchsorted(transcripts, key))
+        if index < len(transcripts) and transcripts[index] == key:
+            return index
+        return None
+
+
+class _StoreView(Mapping):
+    """Base class for dictionary-like views of transcripts in a store"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def _has(self, index):
+        return True
+
+    def _get(self, index):
+        raise NotImplementedError
+
+    def __getitem__(self, transcript_id):
+        index = self.store.transcript_index(transcript_id)
+        if index is None or not self._has(index):
+            raise KeyError(transcript_id)
+        return self._get(index)
+
+    def __contains__(self, transcript_id):
+        index = self.store.transcript_index(transcript_id)
+        return index is not None and self._has(index)
+
+    def __iter__(self):
+        for index in range(len(self.store.array("transcripts"))):
+            if self._has(index):
+                yield self.store.transcript_id(index)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class _StoreCDS(_StoreView):
+    """Dictionary-like view of CDS blocks, as produced by gtf_to_cds()"""
+
+    def _has(self, index):
+        offsets = self.store.array("block_offsets")
+        return offsets[index + 1] > offsets[index]
+
+    def _get(self, index):
+        offsets = self.store.array("block_offsets")
+        string = self.store.string
+        return [
+            [
+                string(block["chrom"]),
+                string(block["type"]),
+                int(block["start"]),
+                int(block["end"]),
+                string(block["strand"]),
+                string(block["tx_type"]),
+            ]
+            for block in self.store.array("blocks")[offsets[index] : offsets[index + 1]]
+        ]
+
+
+class _StoreInfo(_StoreView):
+    """Dictionary-like view of transcript data, as produced by gtf_to_cds()"""
+
+    def _has(self, index):
+        return bool(self.store.array("info")[index]["has_info"])
+
+    def _get(self, index):
+        info = self.store.array("info")[index]
+        offsets = self.store.array("tag_offsets")
+        string = self.store.string
+        tsl = int(info["tsl"])
+        if tsl == _tsl_none:
+            tsl = None
+        elif tsl == _tsl_na:
+            tsl = "NA"
+        return [
+            string(info["tx_type"]),
+            string(info["gene_id"]),
+            string(info["gene_name"]),
+            [
+                string(tag)
+                for tag in self.store.array("tags")[offsets[index] : offsets[index + 1]]
+            ],
+            tsl,
+        ]
+
+
+class _StoreFeatureLengths(_StoreView):
+    """Dictionary-like view of feature lengths, as produced by
+    cds_to_feature_length()
+    """
+
+    def _has(self, index):
+        return not np.isnan(self.store.array("feature_lengths")[index])
+
+    def _get(self, index):
+        return float(self.store.array("feature_lengths")[index])
+
+
+class _StoreIntervals(Mapping):
+    """Dictionary-like view of per-contig intervals, as produced by
+    cds_to_tree()
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.transcript_ids = _StoreTranscriptIDs(store)
+        self._contigs = {}
+
+    def __getitem__(self, chrom):
+        if chrom not in self.store.contigs:
+            raise KeyError(chrom)
+        if chrom not in self._contigs:
+            lo, hi = self.store.contigs[chrom]
+            self._contigs[chrom] = ContigIntervals(
+                self.store.array("interval_starts")[lo:hi],
+                self.store.array("interval_ends")[lo:hi],
+                self.store.array("interval_transcripts")[lo:hi],
+                self.transcript_ids,
+                max_ends=self.store.array("interval_max_ends")[lo:hi],
+            )
+        return self._contigs[chrom]
+
+    def __contains__(self, chrom):
+        return chrom in self.store.contigs
+
+    def __iter__(self):
+        return iter(self.store.contigs)
+
+    def __len__(self):
+        return len(self.store.contigs)
+
+
+class _StoreTranscriptIDs(object):
+    """Sequence-like view of transcript IDs in a store, indexed by position"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, index):
+        return self.store.transcript_id(index)
+
+    def __len__(self):
+        return len(self.store.array("transcripts"))
+
+
+def load_annotation(dictdir):
+    """Loads transcript annotation produced by neoepiscope index
+
+    An annotation store is used if one is present in dictdir; otherwise
+        pickled dictionaries are loaded in full.
+
+    dictdir: path to directory containing annotation
+
+    Return value: tuple of (interval dictionary, CDS dictionary,
+        transcript data dictionary, feature length dictionary)
+    """
+    store_dir = os.path.join(dictdir, store_dirname)
+    if os.path.isfile(os.path.join(store_dir, "manifest.json")):
+        store = AnnotationStore(store_dir)
+        return store.intervals, store.cds, store.info, store.feature_lengths
+    annotation = []
+    for name in [
+        "intervals_to_transcript.pickle",
+        "transcript_to_CDS.pickle",
+        "transcript_to_gene_info.pickle",
+        "feature_to_feature_length.pickle",
+    ]:
+        pickle_path = os.path.join(dictdir, name)
+        if not os.path.isfile(pickle_path):
+            raise RuntimeError(
+                "".join(
+                    [
+                        "Cannot find ",
+                        pickle_path,
+                        "; have you indexed your GTF with neoepiscope index?",
+                    ]
+                )
+            )
+        with open(pickle_path, "rb") as pickle_stream:
+            annotation.append(pickle.load(pickle_stream))
+    return tuple(annotation)
+
+
+def load_reference_proteome(dictdir):
+    """Loads reference proteins precomputed by neoepiscope index
+
+    dictdir: path to directory containing annotation
+
+    Return value: dictionary linking transcript IDs to reference proteins
+        (see cds_to_reference_proteome()), or None if neoepiscope index was
+        run without a bowtie index
+    """
+    pickle_path = os.path.join(dictdir, "transcript_to_reference_protein.pickle")
+    if not os.path.isfile(pickle_path):
+        return None
+    with open(pickle_path, "rb") as pickle_stream:
+        return pickle.load(pickle_stream)
@@ -32,14 +32,167 @@ SOFTWARE.
 from __future__ import absolute_import, division, print_function
 from . import paths
 from .file_processing import which
+import collections
 import os
 import warnings
 import tempfile
 import pickle
 import subprocess
+import functools
+import json
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 from mhcnames import parse_allele_name
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 neoepiscope_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+allele_pickle = os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle")
+allele_index = os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.tsv")
+
+
+def write_allele_index(pickle_file=allele_pickle, index_file=allele_index):
+    """Writes compact, per-tool index of available alleles
+
+    The first line of the index is "#" followed by JSON linking registry
+        keys (e.g. netMHCpan4) to the byte offset and length of their
+        sections in the rest of the file; each section has one
+        tab-separated line per allele giving species, gene, allele family,
+        allele code, and the tool's name for the allele. The index must be
+        rewritten whenever availableAlleles.pickle changes.
+
+    pickle_file: path to pickled dictionary linking registry keys to
+        dictionaries linking parsed allele names to tools' allele names
+    index_file: path to write index
+
+    No return value.
+    """
+    with open(pickle_file, "rb") as allele_stream:
+        avail_alleles = pickle.load(allele_stream)
+    sections = []
+    offsets = {}
+    offset = 0
+    for key in sorted(avail_alleles):
+        section = "".join(
+            [
+                "\t".join(list(allele_format) + [avail_alleles[key][allele_format]])
+                + "\n"
+                for allele_format in sorted(avail_alleles[key])
+            ]
+        ).encode("utf-8")
+        offsets[key] = [offset, len(section)]
+        offset += len(section)
+        sections.append(section)
+    with open(index_file, "wb") as index_stream:
+        index_stream.write(
+            "".join(["#", json.dumps(offsets, sort_keys=True), "\n"]).encode("utf-8")
+        )
+        for section in sections:
+            index_stream.write(section)
+
+
+class AlleleRegistry(Mapping):
+    """Available alleles for each binding prediction tool, loaded lazily
+
+    Behaves like the dictionary in availableAlleles.pickle, linking registry
+        keys (e.g. netMHCpan4) to dictionaries linking parsed allele names to
+        tools' allele names. Each tool's alleles are read from the index
+        written by write_allele_index() the first time they are needed; if
+        there is no index, the pickle is loaded instead.
+    """
+
+    def __init__(self, pickle_file=allele_pickle, index_file=allele_index):
+        """Finds registry keys
+
+        pickle_file: path to pickled dictionary of available alleles
+        index_file: path to index written by write_allele_index()
+
+        No return value.
+        """
+        self.pickle_file = pickle_file
+        self.index_file = index_file
+        self.alleles = {}
+        if os.path.isfile(index_file):
+            with open(index_file, "rb") as index_stream:
+                header = index_stream.readline()
+                self.offsets = json.loads(header[1:].decode("utf-8"))
+                self.base = index_stream.tell()
+        else:
+            with open(pickle_file, "rb") as allele_stream:
+                self.alleles = pickle.load(allele_stream)
+            self.offsets = dict((key, None) for key in self.alleles)
+
+    def __getitem__(self, key):
+        if key not in self.alleles:
+            offset, length = self.offsets[key]
+            with open(self.index_file, "rb") as index_stream:
+                index_stream.seek(self.base + offset)
+                section = index_stream.read(length).decode("utf-8")
+            # Parsed allele names are namedtuples, so they are found in
+            #   dictionaries keyed by plain tuples
+            alleles = {}
+            for line in section.splitlines():
+                tokens = line.split("\t")
+                alleles[tuple(tokens[:4])] = tokens[4]
+            self.alleles[key] = alleles
+        return self.alleles[key]
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+_allele_registry = None
+
+
+def available_alleles():
+    """Loads registry of available alleles once per process
+
+    Return value: AlleleRegistry object
+    """
+    global _allele_registry
+    if _allele_registry is None:
+        _allele_registry = AlleleRegistry()
+    return _allele_registry
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_allele(allele):
+    """Parses allele name, caching results
+
+    allele: allele name (e.g. HLA-A*02:01)
+
+    Return value: AlleleName object; raises an exception if allele cannot be
+        parsed
+    """
+    return parse_allele_name(allele)
+
+
+def resolve_allele(tool, version, allele):
+    """Finds a binding prediction tool's name for an allele
+
+    tool: tool name as used in registry keys (e.g. netMHCpan, mhcflurry,
+        mhcnuggets_mhcI, IEDBtools)
+    version: tool version as used in registry keys (e.g. "4", or "" for
+        tools without versions in their keys; IEDBtools versions include
+        the method, e.g. "2-smm")
+    allele: allele name (e.g. HLA-A*02:01)
+
+    Return value: tool's name for allele, or None if allele cannot be
+        parsed or is not available for tool
+    """
+    try:
+        allele_format = parse_allele(allele)
+    except Exception:
+        return None
+    return available_alleles()["".join([tool, str(version)])].get(allele_format)
 
 
 def get_binding_tools(binding_tool_list):
@@ -694,35 +847,17 @@ def get_affinity_netMHCIIpan(
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(
-                os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle")
-            ),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if allele != "DRB5_0108N":
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for netMHCIIpan"]), Warning
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["netMHCIIpan", str(version)])]:
-                allele = avail_alleles["".join(["netMHCIIpan", str(version)])][
-                    allele_format
-                ]
-            else:
+            tool_allele = resolve_allele("netMHCIIpan", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for netMHCIIpan"]), Warning
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "netmhciipan", version]
@@ -828,64 +963,123 @@ def get_affinity_netMHCIIpan(
                 os.remove(file_to_remove)
 
 
-def get_affinity_mhcflurry(peptides, allele, scores, version, remove_files=True):
-    """Obtains binding affinities from list of peptides
+_mhcflurry_predictor = None
+_mhcflurry_lock = threading.Lock()
+
+
+def load_mhcflurry_predictor():
+    """Loads MHCflurry presentation predictor once per process
+
+    Return value: Class1PresentationPredictor object, or None if MHCflurry
+        cannot be imported or its models cannot be loaded, in which case
+        mhcflurry-predict is used instead
+    """
+    global _mhcflurry_predictor
+    with _mhcflurry_lock:
+        if _mhcflurry_predictor is None:
+            try:
+                from mhcflurry import Class1PresentationPredictor
+
+                _mhcflurry_predictor = Class1PresentationPredictor.load()
+            except Exception as e:
+                warnings.warn(
+                    "".join(
+                        [
+                            "Cannot load MHCflurry models in process (",
+                            str(e),
+                            "); will use mhcflurry-predict",
+                        ]
+                    ),
+                    Warning,
+                )
+                _mhcflurry_predictor = False
+        return _mhcflurry_predictor or None
+
+
+def predict_mhcflurry(predictor, peptides, alleles, scores):
+    """Scores peptides for alleles with an in-process MHCflurry predictor
+
+    All peptides are scored for all alleles in one vectorized call.
+
+    predictor: Class1PresentationPredictor object
+    peptides: list of peptides, each 5-15 amino acids long
+    alleles: list of MHCflurry allele names
+    scores: list of scoring methods
+
+    Return value: dictionary linking alleles to dictionaries linking
+        peptides to tuples of (peptide, score 1, score 2, ...), with scores
+        in sorted order of scoring methods, as strings formatted as by
+        mhcflurry-predict
+    """
+    score_dicts = dict((allele, {}) for allele in alleles)
+    if not peptides:
+        return score_dicts
+    # Each allele is its own sample, so presentation scores are per allele
+    with _mhcflurry_lock:
+        predictions = predictor.predict(
+            peptides=peptides,
+            alleles=dict((allele, [allele]) for allele in alleles),
+            include_affinity_percentile=True,
+            verbose=0,
+        )
+    columns = {
+        "affinity": "affinity",
+        "affinity_percentile": "affinity_percentile",
+        "presentation_score": "presentation_score",
+        "presentation_score_percentile": "presentation_percentile",
+        "processing_score": "processing_score",
+    }
+    score_columns = [predictions[columns[value]].tolist() for value in sorted(scores)]
+    for i, (peptide, allele) in enumerate(
+        zip(predictions["peptide"].tolist(), predictions["sample_name"].tolist())
+    ):
+        score_dicts[allele][peptide] = (peptide,) + tuple(
+            str(float(column[i])) for column in score_columns
+        )
+    return score_dicts
+
+
+def get_affinity_mhcflurry_alleles(
+    peptides, alleles, scores, version, remove_files=True
+):
+    """Obtains binding affinities from list of peptides for several alleles
+
+    All peptides are scored for all valid alleles at once: in one vectorized
+        call if MHCflurry's models can be loaded in process, otherwise in one
+        run of mhcflurry-predict.
 
     peptides: peptides of interest (list of strings)
-    allele: Allele to use for binding affinity (string)
+    alleles: alleles to use for binding affinity (list of strings)
     scores: list of scoring methods
     version: version of mhc-flurry
     remove_files: option to remove intermediate files
 
-    Return value: affinities (a list of binding affinities
-                    as strings)
+    Return value: dictionary linking alleles to affinities (lists of
+        tuples of (peptide, score 1, score 2, ...) in order of input
+        peptides, with scores as strings)
     """
     files_to_remove = []
     try:
-        # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
-        # Parse allele format
-        try:
-            allele_format = parse_allele_name(allele)
-        except:
-            warnings.warn(
-                " ".join([allele, "is not a valid allele for mhcflurry"]), Warning
-            )
-            score_form = tuple(["NA" for i in range(0, len(scores))])
-            return [(peptides[i],) + score_form for i in range(0, len(peptides))]
-        # Store valid allele format if available
-        if allele_format in avail_alleles["mhcflurry"]:
-            allele = avail_alleles["mhcflurry"][allele_format]
-        else:
-            warnings.warn(
-                " ".join([allele, "is not a valid allele for mhcflurry"]), Warning
-            )
-            score_form = tuple(["NA" for i in range(0, len(scores))])
-            return [(peptides[i],) + score_form for i in range(0, len(peptides))]
-        # Establish return list and sample id
-        sample_id = ".".join(
-            [peptides[0], str(len(peptides)), allele, "mhcflurry", version]
-        )
-        affinities = []
-        # Write one peptide per line to a temporary file for
-        #   input if peptide length is at least 9
-        # Count instances of smaller peptides
-        # Establish temporary file to hold output
-        peptide_file = tempfile.mkstemp(
-            suffix=".csv", prefix="".join([sample_id, "."]), text=True
-        )[1]
-        na_count = 0
-        with open(peptide_file, "w") as f:
-            f.write("allele,peptide\n")
-            for sequence in peptides:
-                if len(sequence) < 5 or len(sequence) > 15:
-                    na_count += 1
-                else:
-                    print("".join([allele, ",", sequence, "\n"]), file=f)
+        score_form = tuple(["NA" for i in range(0, len(scores))])
+        affinities = {}
+        # Check that alleles are valid for method
+        tool_alleles = {}
+        for allele in alleles:
+            tool_allele = resolve_allele("mhcflurry", "", allele)
+            if tool_allele is None:
+                warnings.warn(
+                    " ".join([allele, "is not a valid allele for mhcflurry"]), Warning
+                )
+                affinities[allele] = [
+                    (peptides[i],) + score_form for i in range(0, len(peptides))
+                ]
+            else:
+                tool_alleles[allele] = tool_allele
+        if not tool_alleles:
+            return affinities
+        # Count instances of peptides with incompatible lengths
+        valid_peptides = [sequence for sequence in peptides if 5 <= len(sequence) <= 15]
+        na_count = len(peptides) - len(valid_peptides)
         if na_count > 0:
             warnings.warn(
                 " ".join(
@@ -897,41 +1091,50 @@ def get_affinity_mhcflurry(peptides, allele, scores, version, remove_files=True)
                 ),
                 Warning,
             )
-        # Establish temporary file to hold output
-        mhc_out = tempfile.mkstemp(
-            suffix=".mhcflurry.out", prefix="".join([sample_id, "."]), text=True
-        )[1]
-        files_to_remove.append(mhc_out)
-        # Run netMHCIIpan
-        command = ["mhcflurry-predict", "--out", mhc_out, peptide_file]
-        subprocess.check_call(command)
-        # Retrieve scores for valid peptides
-        score_dict = {}
-        with open(mhc_out, "r") as f:
-            # Skip headers
-            f.readline()
-            for line in f:
-                # tokens[2] is affinity; tokens[5] is rank, tokens[4] is high, tokens[3] is low
-                tokens = line.strip("\n").split(",")
-                result_dict = {
-                    "affinity": tokens[2],
-                    "affinity_percentile": tokens[3],
-                    "presentation_score": tokens[5],
-                    "presentation_score_percentile": tokens[6],
-                    "processing_score": tokens[4],
-                }
-                stored_results = [tokens[1]]
-                for value in sorted(scores):
-                    stored_results.append(result_dict[value])
-                score_dict[tokens[1]] = tuple(stored_results)
+        unique_alleles = sorted(set(tool_alleles.values()))
+        predictor = load_mhcflurry_predictor()
+        if predictor is not None:
+            score_dicts = predict_mhcflurry(
+                predictor, valid_peptides, unique_alleles, scores
+            )
+        else:
+            # Establish sample id
+            sample_id = ".".join(
+                [
+                    peptides[0],
+                    str(len(peptides)),
+                    str(len(unique_alleles)),
+                    "mhcflurry",
+                    version,
+                ]
+            )
+            # Write one allele and peptide per line to a temporary file for input
+            peptide_file = tempfile.mkstemp(
+                suffix=".csv", prefix="".join([sample_id, "."]), text=True
+            )[1]
+            files_to_remove.append(peptide_file)
+            with open(peptide_file, "w") as f:
+                f.write("allele,peptide\n")
+                for allele in unique_alleles:
+                    for sequence in valid_peptides:
+                        print("".join([allele, ",", sequence, "\n"]), file=f)
+            # Establish temporary file to hold output
+            mhc_out = tempfile.mkstemp(
+                suffix=".mhcflurry.out", prefix="".join([sample_id, "."]), text=True
+            )[1]
+            files_to_remove.append(mhc_out)
+            # Run mhcflurry
+            command = ["mhcflurry-predict", "--out", mhc_out, peptide_file]
+            subprocess.check_call(command)
+            score_dicts = read_mhcflurry_output(mhc_out, unique_alleles, scores)
         # Produce list of scores for valid peptides
         # Invalid peptides receive "NA" score
-        for sequence in peptides:
-            if sequence in score_dict:
-                nM = score_dict[sequence]
-            else:
-                nM = (sequence,) + tuple(["NA" for i in range(len(scores))])
-            affinities.append(nM)
+        for allele, tool_allele in tool_alleles.items():
+            score_dict = score_dicts[tool_allele]
+            affinities[allele] = [
+                score_dict.get(sequence, (sequence,) + score_form)
+                for sequence in peptides
+            ]
         return affinities
     finally:
         if remove_files:
@@ -939,6 +1142,61 @@ def get_affinity_mhcflurry(peptides, allele, scores, version, remove_files=True)
                 os.remove(file_to_remove)
 
 
+def read_mhcflurry_output(mhc_out, alleles, scores):
+    """Reads scores from mhcflurry-predict output
+
+    mhc_out: path to CSV written by mhcflurry-predict
+    alleles: list of MHCflurry allele names in input
+    scores: list of scoring methods
+
+    Return value: dictionary linking alleles to dictionaries linking
+        peptides to tuples of (peptide, score 1, score 2, ...), with scores
+        in sorted order of scoring methods
+    """
+    score_dicts = dict((allele, {}) for allele in alleles)
+    with open(mhc_out, "r") as f:
+        # Skip headers
+        f.readline()
+        for line in f:
+            # tokens[0] is allele; tokens[2] is affinity; tokens[3] is
+            #   affinity percentile, tokens[4] is processing score,
+            #   tokens[5] is presentation score, tokens[6] is presentation
+            #   percentile
+            tokens = line.strip("\n").split(",")
+            result_dict = {
+                "affinity": tokens[2],
+                "affinity_percentile": tokens[3],
+                "presentation_score": tokens[5],
+                "presentation_score_percentile": tokens[6],
+                "processing_score": tokens[4],
+            }
+            stored_results = [tokens[1]]
+            for value in sorted(scores):
+                stored_results.append(result_dict[value])
+            score_dicts[tokens[0]][tokens[1]] = tuple(stored_results)
+    return score_dicts
+
+
+def get_affinity_mhcflurry(peptides, allele, scores, version, remove_files=True):
+    """Obtains binding affinities from list of peptides
+
+    Peptides are scored in process if MHCflurry's models can be loaded,
+        otherwise with mhcflurry-predict.
+
+    peptides: peptides of interest (list of strings)
+    allele: Allele to use for binding affinity (string)
+    scores: list of scoring methods
+    version: version of mhc-flurry
+    remove_files: option to remove intermediate files
+
+    Return value: affinities (a list of binding affinities
+                    as strings)
+    """
+    return get_affinity_mhcflurry_alleles(
+        peptides, [allele], scores, version, remove_files=remove_files
+    )[allele]
+
+
 def get_affinity_netMHC(peptides, allele, netmhc, version, scores, remove_files=True):
     """Obtains binding affinities from list of peptides
 
@@ -956,11 +1214,6 @@ def get_affinity_netMHC(peptides, allele, netmhc, version, scores, remove_files=
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if allele not in [
             "BoLA-D18.4",
@@ -969,24 +1222,15 @@ def get_affinity_netMHC(peptides, allele, netmhc, version, scores, remove_files=
             "BoLA-T2a",
             "BoLA-T2b",
         ]:
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for netMHC"]), Warning
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["netMHC", str(version)])]:
-                allele = avail_alleles["".join(["netMHC", str(version)])][allele_format]
-            else:
+            tool_allele = resolve_allele("netMHC", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for netMHC"]), Warning
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "netmhc", version]
@@ -1064,11 +1308,6 @@ def get_affinity_netMHCstabpan(
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if allele not in [
             "BoLA-D18.4",
@@ -1080,28 +1319,16 @@ def get_affinity_netMHCstabpan(
             "H-2-Qa2",
             "H-2-Qa1",
         ]:
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for netMHCstabpan"]),
-                    Warning,
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["netMHCstabpan", str(version)])]:
-                allele = avail_alleles["".join(["netMHCstabpan", str(version)])][
-                    allele_format
-                ]
-            else:
+            tool_allele = resolve_allele("netMHCstabpan", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for netMHCstabpan"]),
                     Warning,
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         score_dict = {}
         affinities = []
         for i in range(size_list[0], size_list[-1] + 1):
@@ -1206,11 +1433,6 @@ def get_affinity_pickpocket(
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if allele not in [
             "BoLA-D18.4",
@@ -1220,26 +1442,15 @@ def get_affinity_pickpocket(
             "BoLA-T2b",
             "Mamu-AG:01",
         ]:
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for PickPocket"]), Warning
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["pickpocket", str(version)])]:
-                allele = avail_alleles["".join(["pickpocket", str(version)])][
-                    allele_format
-                ]
-            else:
+            tool_allele = resolve_allele("pickpocket", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for PickPocket"]), Warning
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "pickpocket", version]
@@ -1311,30 +1522,15 @@ def get_affinity_netMHCII(
     """
     files_to_remove = []
     try:
-        # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
-        # Parse allele format
-        try:
-            allele_format = parse_allele_name(allele)
-        except:
-            warnings.warn(
-                " ".join([allele, "is not a valid allele for netMHCII"]), Warning
-            )
-            score_form = tuple(["NA" for i in range(0, len(scores))])
-            return [(peptides[i],) + score_form for i in range(0, len(peptides))]
         # Store valid allele format if available
-        if allele_format in avail_alleles["".join(["netMHCII", str(version)])]:
-            allele = avail_alleles["".join(["netMHCII", str(version)])][allele_format]
-        else:
+        tool_allele = resolve_allele("netMHCII", version, allele)
+        if tool_allele is None:
             warnings.warn(
                 " ".join([allele, "is not a valid allele for netMHCII"]), Warning
             )
             score_form = tuple(["NA" for i in range(0, len(scores))])
             return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+        allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "netMHCII", version]
@@ -1422,11 +1618,6 @@ def get_affinity_netMHCcons(
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if allele not in [
             "BoLA-D18.4",
@@ -1437,26 +1628,15 @@ def get_affinity_netMHCcons(
             "BoLA-T2b",
             "Mamu-AG:01",
         ]:
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for netMHCcons"]), Warning
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["netMHCcons", str(version)])]:
-                allele = avail_alleles["".join(["netMHCcons", str(version)])][
-                    allele_format
-                ]
-            else:
+            tool_allele = resolve_allele("netMHCcons", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for netMHCcons"]), Warning
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         # Establish score dict and return list
         score_dict = {}
         affinities = []
@@ -1548,11 +1728,6 @@ def get_affinity_netMHCpan(
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
         # Homogenize format if needed
         if version == "3" and allele in [
             "BoLA-D18.4",
@@ -1664,26 +1839,15 @@ def get_affinity_netMHCpan(
         ]:
             pass
         else:
-            # Parse allele format
-            try:
-                allele_format = parse_allele_name(allele)
-            except:
-                warnings.warn(
-                    " ".join([allele, "is not a valid allele for netMHCpan"]), Warning
-                )
-                score_form = tuple(["NA" for i in range(0, len(scores))])
-                return [(peptides[i],) + score_form for i in range(0, len(peptides))]
             # Store valid allele format if available
-            if allele_format in avail_alleles["".join(["netMHCpan", str(version)])]:
-                allele = avail_alleles["".join(["netMHCpan", str(version)])][
-                    allele_format
-                ]
-            else:
+            tool_allele = resolve_allele("netMHCpan", version, allele)
+            if tool_allele is None:
                 warnings.warn(
                     " ".join([allele, "is not a valid allele for netMHCpan"]), Warning
                 )
                 score_form = tuple(["NA" for i in range(0, len(scores))])
                 return [(peptides[i],) + score_form for i in range(0, len(peptides))]
+            allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "netmhcpan", version]
@@ -1764,9 +1928,130 @@ def get_affinity_netMHCpan(
                 os.remove(file_to_remove)
 
 
+class MHCnuggetsModel(object):
+    """MHCnuggets model for one allele, built once and reused across calls
+
+    Follows mhcnuggets.src.predict.predict(): peptides are masked to a fixed
+        length and one-hot encoded, and the closest allele's weights are
+        loaded, preferring models trained on binding affinity followed by
+        HLA ligand data.
+    """
+
+    def __init__(self, allele, allele_class):
+        """Builds model and loads weights
+
+        allele: MHCnuggets allele name
+        allele_class: MHC class of allele ("I" or "II")
+
+        No return value.
+        """
+        from mhcnuggets.src.aa_embeddings import (
+            NUM_AAS,
+            MHCI_MASK_LEN,
+            MHCII_MASK_LEN,
+        )
+        from mhcnuggets.src.models import mhcnuggets_lstm
+        import mhcnuggets.src.predict as mhcnuggets_predict
+
+        mhcnuggets_home = mhcnuggets_predict.MHCNUGGETS_HOME
+        examples_file = os.path.join(
+            mhcnuggets_home, "data", "production", "examples_per_allele.pkl"
+        )
+        if allele_class == "I":
+            from mhcnuggets.src.find_closest_mhcI import closest_allele
+
+            self.mask_length = MHCI_MASK_LEN
+        else:
+            from mhcnuggets.src.find_closest_mhcII import closest_allele
+
+            self.mask_length = MHCII_MASK_LEN
+        predictor_allele = closest_allele(allele, examples_file)
+        weights_file = os.path.join(
+            mhcnuggets_home,
+            "saves",
+            "production",
+            "".join([predictor_allele, "_BA_to_HLAp.h5"]),
+        )
+        if not os.path.isfile(weights_file):
+            weights_file = os.path.join(
+                mhcnuggets_home,
+                "saves",
+                "production",
+                "".join([predictor_allele, "_BA.h5"]),
+            )
+        self.model = mhcnuggets_lstm((self.mask_length, NUM_AAS))
+        self.model.load_weights(weights_file)
+        self.lock = threading.Lock()
+
+    def predict(self, peptides):
+        """Predicts IC50s for a batch of peptides
+
+        peptides: list of peptides no longer than the model's mask length
+
+        Return value: dictionary linking peptides to IC50s, as strings
+            formatted as by mhcnuggets.src.predict.predict()
+        """
+        from mhcnuggets.src.dataset import (
+            mask_peptides,
+            tensorize_keras,
+            map_proba_to_ic50,
+        )
+
+        if not peptides:
+            return {}
+        masked_peptides, original_peptides = mask_peptides(
+            peptides, max_len=self.mask_length
+        )
+        peptide_tensor = tensorize_keras(masked_peptides, embed_type="softhot")
+        with self.lock:
+            predictions = self.model.predict(peptide_tensor, batch_size=1024)
+        return dict(
+            (peptide, str(round(map_proba_to_ic50(prediction[0]), 2)))
+            for peptide, prediction in zip(original_peptides, predictions)
+        )
+
+
+_mhcnuggets_models = {}
+_mhcnuggets_lock = threading.Lock()
+
+
+def load_mhcnuggets_model(allele, allele_class):
+    """Loads MHCnuggets model for an allele once per process
+
+    allele: MHCnuggets allele name
+    allele_class: MHC class of allele ("I" or "II")
+
+    Return value: MHCnuggetsModel object, or None if the model cannot be
+        built in process, in which case mhcnuggets' predict() is used instead
+    """
+    with _mhcnuggets_lock:
+        if allele not in _mhcnuggets_models:
+            try:
+                _mhcnuggets_models[allele] = MHCnuggetsModel(allele, allele_class)
+            except Exception as e:
+                warnings.warn(
+                    "".join(
+                        [
+                            "Cannot load MHCnuggets model for ",
+                            allele,
+                            " in process (",
+                            str(e),
+                            "); will use mhcnuggets predict()",
+                        ]
+                    ),
+                    Warning,
+                )
+                _mhcnuggets_models[allele] = None
+        return _mhcnuggets_models[allele]
+
+
 def get_affinity_mhcnuggets(peptides, allele, version, remove_files=True):
     """Obtains binding affinities from list of peptides
 
+    Peptides are scored in one batch by a model kept loaded for the rest of
+        the run if possible, otherwise with mhcnuggets' predict(), which is
+        also used for the rest of the run if the loaded model fails.
+
     peptides: peptides of interest (list of strings)
     allele: Allele to use for binding affinity (string)
     scores: list of scoring methods
@@ -1776,59 +2061,33 @@ def get_affinity_mhcnuggets(peptides, allele, version, remove_files=True):
     Return value: affinities (a list of binding affinities
                     as strings)
     """
-    from mhcnuggets.src.predict import predict
-
     files_to_remove = []
     try:
         # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
-        # Parse allele format
-        try:
-            allele_format = parse_allele_name(allele)
-        except:
-            warnings.warn(
-                " ".join([allele, "is not a valid allele for mhcnuggets"]), Warning
-            )
-            score_form = tuple(["NA" for i in range(0, len(scores))])
-            return [(peptides[i],) + score_form for i in range(0, len(peptides))]
-        # Check that allele is valid for method
-        if allele_format in avail_alleles["mhcnuggets_mhcI"]:
-            allele = avail_alleles["mhcnuggets_mhcI"][allele_format]
+        tool_allele = resolve_allele("mhcnuggets_mhcI", "", allele)
+        if tool_allele is not None:
             allele_class = "I"
             max_length = 15
-        elif allele_format in avail_alleles["mhcnuggets_mhcII"]:
-            allele = avail_alleles["mhcnuggets_mhcII"][allele_format]
+        else:
+            tool_allele = resolve_allele("mhcnuggets_mhcII", "", allele)
             allele_class = "II"
             max_length = 30
-        else:
+        if tool_allele is None:
             warnings.warn(
                 " ".join([allele, "is not a valid allele for mhcnuggets"]), Warning
             )
             return [(peptides[i], "NA") for i in range(0, len(peptides))]
+        allele = tool_allele
         # Establish return list and sample id
         sample_id = ".".join(
             [peptides[0], str(len(peptides)), allele, "mhcnuggets", version]
         )
         affinities = []
-        # Write one peptide per line to a temporary file for
-        #   input if peptide length is at least 9
-        # Count instances of smaller peptides
-        # Establish temporary file to hold output
-        peptide_file = tempfile.mkstemp(
-            suffix=".txt", prefix="".join([sample_id, "."]), text=True
-        )[1]
-        files_to_remove.append(peptide_file)
-        na_count = 0
-        with open(peptide_file, "w") as f:
-            for sequence in peptides:
-                if len(sequence) > max_length:
-                    na_count += 1
-                else:
-                    print(sequence, file=f)
+        # Count instances of peptides that are too long
+        valid_peptides = [
+            sequence for sequence in peptides if len(sequence) <= max_length
+        ]
+        na_count = len(peptides) - len(valid_peptides)
         if na_count > 0:
             warnings.warn(
                 " ".join(
@@ -1840,23 +2099,58 @@ def get_affinity_mhcnuggets(peptides, allele, version, remove_files=True):
                 ),
                 Warning,
             )
-        # Establish temporary file to hold output
-        mhc_out = tempfile.mkstemp(
-            suffix=".mhcnuggets.out", prefix="".join([sample_id, "."]), text=True
-        )[1]
-        files_to_remove.append(mhc_out)
-        # Run mhcnuggets
-        predict(
-            class_=allele_class, peptides_path=peptide_file, mhc=allele, output=mhc_out
-        )
-        # Retrieve scores for valid peptides
-        score_dict = {}
-        with open(mhc_out, "r") as f:
-            # Skip headers
-            f.readline()
-            for line in f:
-                tokens = line.strip("\n").split(",")
-                score_dict[tokens[0]] = tokens[1]
+        model = load_mhcnuggets_model(allele, allele_class)
+        score_dict = None
+        if model is not None:
+            try:
+                score_dict = model.predict(valid_peptides)
+            except Exception as e:
+                # Stop using the in-process model for this allele
+                with _mhcnuggets_lock:
+                    _mhcnuggets_models[allele] = None
+                warnings.warn(
+                    "".join(
+                        [
+                            "Cannot score peptides with MHCnuggets model for ",
+                            allele,
+                            " in process (",
+                            str(e),
+                            "); will use mhcnuggets predict()",
+                        ]
+                    ),
+                    Warning,
+                )
+        if score_dict is None:
+            from mhcnuggets.src.predict import predict
+
+            # Write one peptide per line to a temporary file for input
+            peptide_file = tempfile.mkstemp(
+                suffix=".txt", prefix="".join([sample_id, "."]), text=True
+            )[1]
+            files_to_remove.append(peptide_file)
+            with open(peptide_file, "w") as f:
+                for sequence in valid_peptides:
+                    print(sequence, file=f)
+            # Establish temporary file to hold output
+            mhc_out = tempfile.mkstemp(
+                suffix=".mhcnuggets.out", prefix="".join([sample_id, "."]), text=True
+            )[1]
+            files_to_remove.append(mhc_out)
+            # Run mhcnuggets
+            predict(
+                class_=allele_class,
+                peptides_path=peptide_file,
+                mhc=allele,
+                output=mhc_out,
+            )
+            # Retrieve scores for valid peptides
+            score_dict = {}
+            with open(mhc_out, "r") as f:
+                # Skip headers
+                f.readline()
+                for line in f:
+                    tokens = line.strip("\n").split(",")
+                    score_dict[tokens[0]] = tokens[1]
         # Produce list of scores for valid peptides
         # Invalid peptides receive "NA" score
         for sequence in peptides:
@@ -1892,29 +2186,15 @@ def get_affinity_PSSMHCpan(
     pssm_file = os.path.join(paths.PSSMHCpan1, "database", "PSSM", "pssm_file.list")
     files_to_remove = []
     try:
-        # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
-        # Parse allele format
-        try:
-            allele_format = parse_allele_name(allele)
-        except:
+        # Store valid allele format if available
+        tool_allele = resolve_allele("PSSMHCpan", version, allele)
+        if tool_allele is None:
             warnings.warn(
                 " ".join([allele, "is not a valid allele for PSSMHCpan"]), Warning
             )
             score_form = tuple(["NA" for i in range(0, len(scores))])
             return [(peptides[i],) + score_form for i in range(0, len(peptides))]
-        # Check that allele is valid for method
-        if allele_format in avail_alleles["".join(["PSSMHCpan", str(version)])]:
-            allele = avail_alleles["".join(["PSSMHCpan", str(version)])][allele_format]
-        else:
-            warnings.warn(
-                " ".join([allele, "is not a valid allele for PSSMHCpan"]), Warning
-            )
-            return [(peptides[i], "NA") for i in range(0, len(peptides))]
+        allele = tool_allele
         # Get valid sizes
         with open(
             os.path.join(neoepiscope_dir, "neoepiscope", "PSSMHCpan1Sizes.pickle"),
@@ -1953,18 +2233,17 @@ def get_affinity_PSSMHCpan(
                 suffix=".PSSMHCpan.err", prefix="".join([sample_id, "."]), text=True
             )[1]
             files_to_remove.append(err_file)
-            # Change to appropriate directory for command
-            wd = os.getcwd()
-            os.chdir(paths.PSSMHCpan1)
             with open(err_file, "w") as e:
                 with open(mhc_out, "w") as o:
-                    # Run PSSMHCpan
+                    # Run PSSMHCpan from its directory; the working directory
+                    #   of the process is left alone so that jobs can run
+                    #   concurrently
                     subprocess.check_call(
                         ["perl", pssmhcpan, peptide_file, str(i), allele, pssm_file],
                         stderr=e,
                         stdout=o,
+                        cwd=paths.PSSMHCpan1,
                     )
-            os.chdir(wd)
             with open(mhc_out, "r") as f:
                 f.readline()
                 for i in range(0, len(sized_peps)):
@@ -2014,36 +2293,18 @@ def get_affinity_IEDBtools(
     """
     files_to_remove = []
     try:
-        # Check that allele is valid for method
-        with open(
-            os.path.join(neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"),
-            "rb",
-        ) as allele_stream:
-            avail_alleles = pickle.load(allele_stream)
-        # Parse allele format
-        try:
-            allele_format = parse_allele_name(allele)
-        except:
+        # Store valid allele format if available
+        tool_allele = resolve_allele(
+            "IEDBtools", "".join([str(version), "-", method]), allele
+        )
+        if tool_allele is None:
             warnings.warn(
                 "".join([allele, " is not a valid allele for IEDBtools-", method]),
                 Warning,
             )
             score_form = tuple(["NA" for i in range(0, len(scores))])
             return [(peptides[i],) + score_form for i in range(0, len(peptides))]
-        # Check that allele is valid for method
-        if (
-            allele_format
-            in avail_alleles["".join(["IEDBtools", str(version), "-", method])]
-        ):
-            allele = avail_alleles["".join(["IEDBtools", str(version), "-", method])][
-                allele_format
-            ]
-        else:
-            warnings.warn(
-                "".join([allele, " is not a valid allele for IEDBtools-", method]),
-                Warning,
-            )
-            return [(peptides[i], "NA") for i in range(0, len(peptides))]
+        allele = tool_allele
         affinities = []
         score_dict = {}
         na_count = 0
@@ -2084,18 +2345,18 @@ def get_affinity_IEDBtools(
                 suffix=".IEDBtools.err", prefix="".join([sample_id, "."]), text=True
             )[1]
             files_to_remove.append(err_file)
-            # Change to appropriate directory for command
-            wd = os.getcwd()
-            os.chdir(os.path.realpath(iedbtools))
             with open(err_file, "w") as e:
                 with open(mhc_out, "w") as o:
-                    # Run IEDBtools
+                    # Run IEDBtools from its directory; the working directory
+                    #   of the process is left alone so that jobs can run
+                    #   concurrently
+                    iedbtools = os.path.realpath(iedbtools)
                     subprocess.check_call(
                         ["python", iedbtools, method, allele, str(i), peptide_file],
                         stderr=e,
                         stdout=o,
+                        cwd=os.path.dirname(iedbtools),
                     )
-            os.chdir(wd)
             with open(mhc_out, "r") as f:
                 f.readline()
                 for i in range(0, len(sized_peps)):
@@ -2127,159 +2388,422 @@ def get_affinity_IEDBtools(
                 os.remove(file_to_remove)
 
 
-def gather_binding_scores(neoepitopes, tool_dict, hla_alleles, size_list):
+def _run_binding_tool(tool, allele, peptides, tool_dict, size_list):
+    """Runs one binding prediction tool for one allele
+
+    tool: tool ID from tool dictionary (e.g. netMHCpan4)
+    allele: allele used for binding predictions
+    peptides: list of peptides to score
+    tool_dict: dictionary storing prediction tool data
+    size_list: list of [min size, ..., max size] of peptide sizes
+
+    Return value: list of tuples of (peptide, score 1, score 2, ...)
+    """
+    binding_scores = []
+    if tool == "mhcflurry2":
+        binding_scores = get_affinity_mhcflurry(
+            peptides,
+            allele,
+            tool_dict[tool][1],
+            "2",
+            remove_files=True,
+        )
+    elif tool == "mhcnuggets2":
+        binding_scores = get_affinity_mhcnuggets(
+            peptides, allele, "2", remove_files=True
+        )
+    elif tool == "netMHCIIpan3":
+        binding_scores = get_affinity_netMHCIIpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "3",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCIIpan4":
+        binding_scores = get_affinity_netMHCIIpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "4",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCpan3":
+        binding_scores = get_affinity_netMHCpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "3",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCpan4":
+        binding_scores = get_affinity_netMHCpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "4",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCpan4_1":
+        binding_scores = get_affinity_netMHCpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "4_1",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHC4":
+        binding_scores = get_affinity_netMHC(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "4",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "pickpocket1":
+        binding_scores = get_affinity_pickpocket(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "1",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCcons1":
+        binding_scores = get_affinity_netMHCcons(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "1",
+            tool_dict[tool][1],
+            size_list,
+            remove_files=True,
+        )
+    elif tool == "netMHCII2":
+        binding_scores = get_affinity_netMHCII(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "2",
+            tool_dict[tool][1],
+            remove_files=True,
+        )
+    elif tool == "netMHCstabpan1":
+        binding_scores = get_affinity_netMHCstabpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "1",
+            tool_dict[tool][1],
+            size_list,
+            remove_files=True,
+        )
+    elif tool == "PSSMHCpan1":
+        binding_scores = get_affinity_PSSMHCpan(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            "1",
+            tool_dict[tool][1],
+            size_list,
+            remove_files=True,
+        )
+    elif "iedbtools-mhcii" in tool.lower():
+        method = tool.split("-")[2]
+        binding_scores = get_affinity_IEDBtools(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            method,
+            "2",
+            tool_dict[tool][1],
+            size_list,
+            remove_files=True,
+        )
+    elif "iedbtools-mhci" in tool.lower():
+        method = tool.split("-")[2]
+        binding_scores = get_affinity_IEDBtools(
+            peptides,
+            allele,
+            tool_dict[tool][0],
+            method,
+            "2",
+            tool_dict[tool][1],
+            size_list,
+            remove_files=True,
+        )
+    return binding_scores
+
+
+# Tools that score peptides for several alleles in one run
+_multi_allele_tools = frozenset(["mhcflurry2"])
+
+
+def _run_multi_allele_tool(tool, alleles, peptides, tool_dict, size_list):
+    """Runs one binding prediction tool for several alleles at once
+
+    tool: tool ID from tool dictionary in _multi_allele_tools
+    alleles: list of alleles used for binding predictions
+    peptides: list of peptides to score
+    tool_dict: dictionary storing prediction tool data
+    size_list: list of [min size, ..., max size] of peptide sizes
+
+    Return value: list of tuples of (peptide, scores for first allele,
+        scores for second allele, ...), where scores for each allele are a
+        tuple of (peptide, score 1, score 2, ...)
+    """
+    if tool == "mhcflurry2":
+        affinities = get_affinity_mhcflurry_alleles(
+            peptides, alleles, tool_dict[tool][1], "2", remove_files=True
+        )
+    return [
+        (peptide,) + tuple(affinities[allele][i] for allele in alleles)
+        for i, peptide in enumerate(peptides)
+    ]
+
+
+def chunk_peptides(peptides, chunk_size=None):
+    """Splits peptides into chunks for separate prediction tool runs
+
+    peptides: list of peptides
+    chunk_size: maximum number of peptides per chunk, or None for a single
+        chunk
+
+    Return value: list of lists of peptides
+    """
+    if not chunk_size or chunk_size >= len(peptides):
+        return [peptides]
+    return [peptides[i : i + chunk_size] for i in range(0, len(peptides), chunk_size)]
+
+
+def _score_chunk(chunk_task):
+    """Runs a scoring function on a chunk of peptides, retrying on failure
+
+    chunk_task: tuple of (index of task, scoring function, list of peptides,
+        number of retries)
+
+    Return value: tuple of (index of task, list of tuples of (peptide,
+        score 1, score 2, ...), start time, end time)
+    """
+    task_index, score_function, peptides, retries = chunk_task
+    start_time = time.time()
+    for attempt in range(retries + 1):
+        try:
+            binding_scores = score_function(peptides)
+            break
+        except (subprocess.CalledProcessError, EnvironmentError) as e:
+            if attempt == retries:
+                raise
+            warnings.warn(
+                " ".join(
+                    [
+                        "Retrying binding prediction for",
+                        str(len(peptides)),
+                        "peptides after error:",
+                        str(e),
+                    ]
+                ),
+                Warning,
+            )
+    return task_index, binding_scores, start_time, time.time()
+
+
+def score_in_chunks(score_tasks, chunk_size=None, jobs=1, retries=1):
+    """Runs binding prediction tasks on chunks of peptides
+
+    Every task's peptides are split into chunks, and up to jobs chunks
+        (from any task) are scored at once. A chunk whose scoring function
+        fails with a subprocess or I/O error is rerun up to retries times,
+        so that a single failure does not discard scores for other chunks.
+
+    score_tasks: list of tuples of (scoring function, list of peptides),
+        where the scoring function takes a list of peptides and returns a
+        list of tuples of (peptide, score 1, score 2, ...)
+    chunk_size: maximum number of peptides per chunk, or None to score each
+        task's peptides at once
+    jobs: maximum number of chunks to score concurrently
+    retries: number of times to rerun a failed chunk
+
+    Return value: list of tuples of (list of tuples of (peptide, score 1,
+        score 2, ...) in order of input peptides, wall time of task in
+        seconds), one per task
+    """
+    chunk_tasks = [
+        (task_index, score_function, chunk, retries)
+        for task_index, (score_function, peptides) in enumerate(score_tasks)
+        for chunk in chunk_peptides(peptides, chunk_size)
+    ]
+    if jobs > 1 and len(chunk_tasks) > 1:
+        # Tools run as external processes, so threads suffice
+        pool = ThreadPool(min(jobs, len(chunk_tasks)))
+        try:
+            chunk_results = pool.map(_score_chunk, chunk_tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunk_results = [_score_chunk(chunk_task) for chunk_task in chunk_tasks]
+    # Reassemble scores for each task in order of its input peptides
+    score_dicts = [{} for _ in score_tasks]
+    start_times = [None for _ in score_tasks]
+    end_times = [None for _ in score_tasks]
+    for task_index, binding_scores, start_time, end_time in chunk_results:
+        for score in binding_scores:
+            score_dicts[task_index][score[0]] = score
+        if start_times[task_index] is None or start_time < start_times[task_index]:
+            start_times[task_index] = start_time
+        if end_times[task_index] is None or end_time > end_times[task_index]:
+            end_times[task_index] = end_time
+    return [
+        (
+            [
+                score_dicts[task_index][peptide]
+                for peptide in peptides
+                if peptide in score_dicts[task_index]
+            ],
+            end_times[task_index] - start_times[task_index],
+        )
+        for task_index, (_, peptides) in enumerate(score_tasks)
+    ]
+
+
+def gather_binding_scores(
+    neoepitopes,
+    tool_dict,
+    hla_alleles,
+    size_list,
+    score_cache=None,
+    jobs=1,
+    chunk_size=None,
+    retries=1,
+):
     """Adds binding scores from desired programs to neoepitope metadata
 
+    Each combination of allele and tool is run as a separate job, except
+        that tools which score several alleles at once (MHCflurry) run one
+        job covering every allele; jobs are split into chunks of peptides by
+        score_in_chunks(), up to jobs chunks run at once, and scores are
+        added to metadata in allele order, then tool order, regardless of
+        which job finishes first.
+
     neoepitopes: dictionary linking neoepitopes to their metadata
     tool_dict: dictionary storing prediction tool data
     hla_alleles: list of HLA alleles used for binding predictions
     size_list: list of [min size, ..., max size] of peptide sizes
+    score_cache: BindingScoreCache object consulted before running tools,
+        or None to score all neoepitopes
+    jobs: maximum number of prediction tool runs to make concurrently
+    chunk_size: maximum number of peptides per prediction tool run, or None
+        to score all peptides for an allele and tool in one run
+    retries: number of times to rerun a failed prediction tool run
 
     Return value: dictionary linking neoepitopes to their metadata,
         which now includes binding scores
     """
+    binding_jobs = []
     for allele in hla_alleles:
         for tool in sorted(tool_dict.keys()):
-            if tool == "mhcflurry2":
-                binding_scores = get_affinity_mhcflurry(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][1],
-                    "2",
-                    remove_files=True,
-                )
-            elif tool == "mhcnuggets2":
-                binding_scores = get_affinity_mhcnuggets(
-                    list(neoepitopes.keys()), allele, "2", remove_files=True
-                )
-            elif tool == "netMHCIIpan3":
-                binding_scores = get_affinity_netMHCIIpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "3",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCIIpan4":
-                binding_scores = get_affinity_netMHCIIpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "4",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCpan3":
-                binding_scores = get_affinity_netMHCpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "3",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCpan4":
-                binding_scores = get_affinity_netMHCpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "4",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCpan4_1":
-                binding_scores = get_affinity_netMHCpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "4_1",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHC4":
-                binding_scores = get_affinity_netMHC(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "4",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "pickpocket1":
-                binding_scores = get_affinity_pickpocket(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "1",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCcons1":
-                binding_scores = get_affinity_netMHCcons(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "1",
-                    tool_dict[tool][1],
-                    size_list,
-                    remove_files=True,
-                )
-            elif tool == "netMHCII2":
-                binding_scores = get_affinity_netMHCII(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "2",
-                    tool_dict[tool][1],
-                    remove_files=True,
-                )
-            elif tool == "netMHCstabpan1":
-                binding_scores = get_affinity_netMHCstabpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "1",
-                    tool_dict[tool][1],
-                    size_list,
-                    remove_files=True,
-                )
-            elif tool == "PSSMHCpan1":
-                binding_scores = get_affinity_PSSMHCpan(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    "1",
-                    tool_dict[tool][1],
-                    size_list,
-                    remove_files=True,
+            peptides = list(neoepitopes.keys())
+            # Only send peptides without cached scores to the tool
+            if score_cache is not None:
+                cached_scores = score_cache.lookup(
+                    tool, allele, tool_dict[tool][1], peptides
                 )
-            elif "iedbtools-mhcii" in tool.lower():
-                method = tool.split("-")[2]
-                binding_scores = get_affinity_IEDBtools(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    method,
-                    "2",
-                    tool_dict[tool][1],
-                    size_list,
-                    remove_files=True,
-                )
-            elif "iedbtools-mhci" in tool.lower():
-                method = tool.split("-")[2]
-                binding_scores = get_affinity_IEDBtools(
-                    list(neoepitopes.keys()),
-                    allele,
-                    tool_dict[tool][0],
-                    method,
-                    "2",
-                    tool_dict[tool][1],
-                    size_list,
-                    remove_files=True,
-                )
-            for score in binding_scores:
-                meta_data = neoepitopes[score[0]]
-                for i in range(0, len(meta_data)):
-                    neoepitopes[score[0]][i] = meta_data[i] + score[1:]
+                peptides = [
+                    peptide for peptide in peptides if peptide not in cached_scores
+                ]
+            else:
+                cached_scores = {}
+            binding_jobs.append((tool, allele, peptides, cached_scores))
+    # Tools that score several alleles at once get one job for all alleles
+    #   with uncached peptides, scoring the union of those peptides
+    multi_allele_jobs = collections.OrderedDict()
+    for tool, allele, peptides, _ in binding_jobs:
+        if tool in _multi_allele_tools and peptides:
+            if tool not in multi_allele_jobs:
+                multi_allele_jobs[tool] = ([], collections.OrderedDict())
+            if allele not in multi_allele_jobs[tool][0]:
+                multi_allele_jobs[tool][0].append(allele)
+            multi_allele_jobs[tool][1].update((peptide, None) for peptide in peptides)
+    score_tasks = [
+        (
+            functools.partial(
+                _run_binding_tool,
+                tool,
+                allele,
+                tool_dict=tool_dict,
+                size_list=size_list,
+            ),
+            peptides,
+        )
+        for tool, allele, peptides, _ in binding_jobs
+        if peptides and tool not in _multi_allele_tools
+    ] + [
+        (
+            functools.partial(
+                _run_multi_allele_tool,
+                tool,
+                alleles,
+                tool_dict=tool_dict,
+                size_list=size_list,
+            ),
+            list(peptides),
+        )
+        for tool, (alleles, peptides) in multi_allele_jobs.items()
+    ]
+    job_results = score_in_chunks(
+        score_tasks, chunk_size=chunk_size, jobs=jobs, retries=retries
+    )
+    single_allele_results = iter(job_results)
+    multi_allele_results = dict(
+        zip(
+            multi_allele_jobs,
+            job_results[len(job_results) - len(multi_allele_jobs) :],
+        )
+    )
+    for tool, allele, peptides, cached_scores in binding_jobs:
+        if peptides:
+            if tool in _multi_allele_tools:
+                allele_scores, wall_time = multi_allele_results[tool]
+                # Pick out this allele's scores for its uncached peptides
+                allele_index = multi_allele_jobs[tool][0].index(allele) + 1
+                uncached = set(peptides)
+                binding_scores = [
+                    score[allele_index]
+                    for score in allele_scores
+                    if score[0] in uncached
+                ]
+            else:
+                binding_scores, wall_time = next(single_allele_results)
+            print(
+                "".join(
+                    [
+                        "Scored ",
+                        str(len(peptides)),
+                        " peptides with ",
+                        tool,
+                        " for ",
+                        allele,
+                        " in ",
+                        "{:.1f}".format(wall_time),
+                        " s",
+                    ]
+                ),
+                file=sys.stderr,
+            )
+        else:
+            binding_scores = []
+        if score_cache is not None:
+            score_cache.store(tool, allele, tool_dict[tool][1], binding_scores)
+            binding_scores = binding_scores + list(cached_scores.values())
+        for score in binding_scores:
+            meta_data = neoepitopes[score[0]]
+            for i in range(0, len(meta_data)):
+                neoepitopes[score[0]][i] = meta_data[i] + score[1:]
     return neoepitopes
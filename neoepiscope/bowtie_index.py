@@ -37,9 +37,10 @@ import os
 import struct
 import mmap
 from operator import itemgetter
-from collections import defaultdict
 from bisect import bisect_right
+import array
 import sys
+import numpy as np
 
 # Python 2-3 compatibility
 try:
@@ -68,6 +69,28 @@ else:
         return ord(chr)
 
 
+# Fixed-size fields at the start of the .1.ebwt file for a small index
+_header_struct = struct.Struct("<iIiiiii")
+# Records of unambiguous stretches in the .3.ebwt file
+_record_dtype = np.dtype([("off", "<u4"), ("len", "<u4"), ("first", "u1")])
+
+
+def _int_array(values):
+    """
+    Convert a numpy array of integers into a compact array.array of
+    64-bit integers, which is faster to bisect.
+    """
+    return array.array("q", values.astype(np.int64).tobytes())
+
+
+# Each byte of the .4.ebwt file packs four characters, two bits apiece,
+# starting from the least significant bits
+_byte_to_bases = [
+    "".join("ACGT"[(byte >> shift) & 3] for shift in (0, 2, 4, 6)).encode("ascii")
+    for byte in xrange(256)
+]
+
+
 class BowtieIndexReference(object):
     """
     Given prefix of a Bowtie index, parses the reference names, parses the
@@ -79,6 +102,8 @@ class BowtieIndexReference(object):
 
     def __init__(self, idx_prefix):
 
+        # Keep prefix so that the index can be reopened (e.g. by worker processes)
+        self.idx_prefix = idx_prefix
         # Open file handles
         if os.path.exists(idx_prefix + ".3.ebwt"):
             # Small index (32-bit offsets)
@@ -92,21 +117,14 @@ class BowtieIndexReference(object):
         #
         # Parse .1.bt2 file
         #
-        one = struct.unpack("<i", fh1.read(4))[0]
+        one, ln, line_rate, lines_per_side, _, ftab_chars, _ = _header_struct.unpack(
+            fh1.read(_header_struct.size)
+        )
         assert one == 1
 
-        ln = struct_unsigned.unpack(fh1.read(sz))[0]
-        line_rate = struct.unpack("<i", fh1.read(4))[0]
-        lines_per_side = struct.unpack("<i", fh1.read(4))[0]
-        _ = struct.unpack("<i", fh1.read(4))[0]
-        ftab_chars = struct.unpack("<i", fh1.read(4))[0]
-        _ = struct.unpack("<i", fh1.read(4))[0]
-
         nref = struct_unsigned.unpack(fh1.read(sz))[0]
-        # get ref lengths
-        reference_length_list = []
-        for i in xrange(nref):
-            reference_length_list.append(struct.unpack("<i", fh1.read(sz))[0])
+        # skip ref lengths; these are recomputed from the .3.bt2 file
+        fh1.seek(nref * sz, 1)
 
         nfrag = struct_unsigned.unpack(fh1.read(sz))[0]
         # skip rstarts
@@ -150,33 +168,39 @@ class BowtieIndexReference(object):
         assert one == 1
 
         nrecs = struct_unsigned.unpack(fh3.read(sz))[0]
-
-        running_unambig, running_length = 0, 0
-        self.recs = defaultdict(list)
-        self.offset_in_ref = defaultdict(list)
-        self.unambig_preceding = defaultdict(list)
+        # Read all records at once: offset from end of previous unambiguous
+        # stretch, length of unambiguous stretch, and first-of-chromosome flag
+        records = np.frombuffer(fh3.read(nrecs * _record_dtype.itemsize), _record_dtype)
+        assert len(records) == nrecs
+        offs = records["off"].astype(np.int64)
+        lens = records["len"].astype(np.int64)
+        # Reference coordinate at end of each unambiguous stretch, counted
+        # from the start of the first reference
+        running_ends = np.cumsum(offs + lens)
+        running_unambig = np.cumsum(lens)
+        firsts = np.flatnonzero(records["first"]).tolist()
+        assert not nrecs or firsts[0] == 0
+
+        self.offset_in_ref = {}
+        self.unambig_preceding = {}
+        # Reference coordinates spanned by each unambiguous stretch
+        self.stretch_starts = {}
+        self.stretch_ends = {}
         length = {}
-
-        ref_id, ref_namenrecs_added = 0, None
-        for i in xrange(nrecs):
-            off = struct_unsigned.unpack(fh3.read(sz))[0]
-            ln = struct_unsigned.unpack(fh3.read(sz))[0]
-            first_of_chromosome = ord(fh3.read(1)) != 0
-            if first_of_chromosome:
-                if i > 0:
-                    length[ref_name] = running_length
-                ref_name = refnames[ref_id]
-                ref_id += 1
-                running_length = 0
-            assert ref_name is not None
-            self.recs[ref_name].append((off, ln, first_of_chromosome))
-            self.offset_in_ref[ref_name].append(running_length)
-            self.unambig_preceding[ref_name].append(running_unambig)
-            running_length += off + ln
-            running_unambig += ln
-
-        length[ref_name] = running_length
-        assert nrecs == sum(map(len, self.recs.values()))
+        for ref_id, (first, last) in enumerate(zip(firsts, firsts[1:] + [nrecs])):
+            ref_name = refnames[ref_id]
+            ends = running_ends[first:last]
+            if first:
+                ends = ends - running_ends[first - 1]
+            starts = ends - lens[first:last]
+            self.offset_in_ref[ref_name] = _int_array(starts - offs[first:last])
+            self.unambig_preceding[ref_name] = _int_array(
+                running_unambig[first:last] - lens[first:last]
+            )
+            self.stretch_starts[ref_name] = _int_array(starts)
+            self.stretch_ends[ref_name] = _int_array(ends)
+            length[ref_name] = int(ends[-1])
+        running_unambig = int(running_unambig[-1]) if nrecs else 0
 
         #
         # Memory-map the .4.bt2 file
@@ -190,6 +214,36 @@ class BowtieIndexReference(object):
         self.length = length
         self.refnames = refnames
 
+        # For compatibility
+        self.rname_lengths = self.length
+        fh1.close()
+        fh3.close()
+        fh4.close()
+
+    @property
+    def recs(self):
+        """
+        (offset, length, first-of-chromosome flag) records of unambiguous
+        stretches, as stored in the .3.bt2 file, for each reference; built
+        on first use.
+        """
+        if not hasattr(self, "_recs"):
+            self._recs = {}
+            for ref_name in self.length:
+                starts = self.stretch_starts[ref_name]
+                ends = self.stretch_ends[ref_name]
+                offsets = self.offset_in_ref[ref_name]
+                self._recs[ref_name] = [
+                    (starts[i] - offsets[i], ends[i] - starts[i], i == 0)
+                    for i in xrange(len(starts))
+                ]
+        return self._recs
+
+    def _build_rname_tables(self):
+        """
+        Build tables linking reference names to zero-padded strings that
+        sort in order of descending reference length or lexicographically.
+        """
         # To facilitate sorting reference names in order of descending length
         sorted_rnames = sorted(
             self.length.items(), key=lambda x: itemgetter(1)(x), reverse=True
@@ -200,26 +254,44 @@ class BowtieIndexReference(object):
         lexicographically_sorted_rnames = sorted(
             self.length.items(), key=lambda x: itemgetter(0)(x)
         )
-        self.rname_to_string, self.l_rname_to_string = {}, {}
-        self.string_to_rname, self.l_string_to_rname = {}, {}
+        self._rname_to_string, self._l_rname_to_string = {}, {}
+        self._string_to_rname, self._l_string_to_rname = {}, {}
         for i, (rname, _) in enumerate(sorted_rnames):
             rname_string = "%012d" % i
-            self.rname_to_string[rname] = rname_string
-            self.string_to_rname[rname_string] = rname
+            self._rname_to_string[rname] = rname_string
+            self._string_to_rname[rname_string] = rname
         for i, (rname, _) in enumerate(lexicographically_sorted_rnames):
             rname_string = "%012d" % i
-            self.l_rname_to_string[rname] = rname_string
-            self.l_string_to_rname[rname_string] = rname
+            self._l_rname_to_string[rname] = rname_string
+            self._l_string_to_rname[rname_string] = rname
         # Handle unmapped reads
         unmapped_string = "%012d" % len(sorted_rnames)
-        self.rname_to_string["*"] = unmapped_string
-        self.string_to_rname[unmapped_string] = "*"
-
-        # For compatibility
-        self.rname_lengths = self.length
-        fh1.close()
-        fh3.close()
-        fh4.close()
+        self._rname_to_string["*"] = unmapped_string
+        self._string_to_rname[unmapped_string] = "*"
+
+    @property
+    def rname_to_string(self):
+        if not hasattr(self, "_rname_to_string"):
+            self._build_rname_tables()
+        return self._rname_to_string
+
+    @property
+    def string_to_rname(self):
+        if not hasattr(self, "_string_to_rname"):
+            self._build_rname_tables()
+        return self._string_to_rname
+
+    @property
+    def l_rname_to_string(self):
+        if not hasattr(self, "_l_rname_to_string"):
+            self._build_rname_tables()
+        return self._l_rname_to_string
+
+    @property
+    def l_string_to_rname(self):
+        if not hasattr(self, "_l_string_to_rname"):
+            self._build_rname_tables()
+        return self._l_string_to_rname
 
     def get_stretch(self, ref_id, ref_off, count):
         """
@@ -231,48 +303,91 @@ class BowtieIndexReference(object):
         @param count: # of characters
         @return: string extracted from reference
         """
-        assert ref_id in self.recs
-        # Account for negative reference offsets by padding with Ns
-        N_count = min(abs(min(ref_off, 0)), count)
-        stretch = ["N"] * N_count
-        count -= N_count
-        if not count:
-            return "".join(stretch)
-        ref_off = max(ref_off, 0)
-        starting_rec = bisect_right(self.offset_in_ref[ref_id], ref_off) - 1
-        assert starting_rec >= 0
-        off = self.offset_in_ref[ref_id][starting_rec]
-        buf_off = self.unambig_preceding[ref_id][starting_rec]
-        # Naive to scan these records linearly; obvious speedup is binary search
-        for rec in self.recs[ref_id][starting_rec:]:
-            off += rec[0]
-            while ref_off < off and count > 0:
-                stretch.append("N")
-                count -= 1
-                ref_off += 1
-            if count == 0:
-                break
-            if ref_off < off + rec[1]:
-                # stretch extends through part of the unambiguous stretch
-                buf_off += ref_off - off
-            else:
-                buf_off += rec[1]
-            off += rec[1]
-            while ref_off < off and count > 0:
-                buf_elt = buf_off >> 2
-                shift_amt = (buf_off & 3) << 1
-                stretch.append("ACGT"[(ord2or3(self.fh4mm[buf_elt]) >> shift_amt) & 3])
-                buf_off += 1
-                count -= 1
-                ref_off += 1
-            if count == 0:
-                break
-        # If the requested stretch went past the last unambiguous
-        # character in the chromosome, pad with Ns
-        while count > 0:
-            count -= 1
-            stretch.append("N")
-        return "".join(stretch)
+        assert ref_id in self.length
+        if count <= 0:
+            return ""
+        end_off = ref_off + count
+        starts = self.stretch_starts[ref_id]
+        ends = self.stretch_ends[ref_id]
+        unambig_preceding = self.unambig_preceding[ref_id]
+        # First unambiguous stretch ending after the requested offset
+        rec = bisect_right(ends, ref_off)
+        if rec < len(starts) and starts[rec] <= ref_off and end_off <= ends[rec]:
+            # Stretch lies within a single unambiguous stretch
+            return self._decode(
+                unambig_preceding[rec] + ref_off - starts[rec], count
+            ).decode("ascii")
+        # Characters outside unambiguous stretches, including those at
+        # negative offsets or past the end of the reference, are Ns
+        stretch = bytearray(b"N" * count)
+        while rec < len(starts) and starts[rec] < end_off:
+            start = max(starts[rec], ref_off)
+            end = min(ends[rec], end_off)
+            if start < end:
+                buf_off = unambig_preceding[rec] + start - starts[rec]
+                stretch[start - ref_off : end - ref_off] = self._decode(
+                    buf_off, end - start
+                )
+            rec += 1
+        return stretch.decode("ascii")
+
+    def get_stretches(self, ref_id, stretches, max_gap=32):
+        """
+        Return many stretches of characters from the same reference,
+        decoding each region of the Bowtie index at most once.
+
+        Requests are sorted by offset and coalesced when they overlap or are
+        separated by at most max_gap characters; each coalesced span is
+        retrieved with a single call to get_stretch.
+
+        @param ref_id: name of ref seq, up to & excluding whitespace
+        @param stretches: list of (ref_off, count) tuples, with ref_off
+            0-based
+        @param max_gap: largest # of unrequested characters between two
+            requests that are still retrieved together
+        @return: list of strings extracted from reference, in the order of
+            stretches
+        """
+        assert ref_id in self.length
+        pieces = [""] * len(stretches)
+        order = sorted(
+            (i for i in range(len(stretches)) if stretches[i][1] > 0),
+            key=lambda i: stretches[i][0],
+        )
+        j = 0
+        while j < len(order):
+            # Extend the span while the next request begins close enough
+            span_start = stretches[order[j]][0]
+            span_end = span_start + stretches[order[j]][1]
+            k = j + 1
+            while k < len(order) and stretches[order[k]][0] <= span_end + max_gap:
+                span_end = max(span_end, sum(stretches[order[k]]))
+                k += 1
+            span = self.get_stretch(ref_id, span_start, span_end - span_start)
+            for i in order[j:k]:
+                ref_off, count = stretches[i]
+                pieces[i] = span[ref_off - span_start : ref_off - span_start + count]
+            j = k
+        return pieces
+
+    def _decode(self, buf_off, count):
+        """
+        Decode characters from the unambiguous-stretch sequences.
+
+        @param buf_off: offset of first character among all unambiguous
+            characters
+        @param count: # of characters
+        @return: bytes of characters
+        """
+        first_byte = buf_off >> 2
+        last_byte = (buf_off + count - 1) >> 2
+        decoded = b"".join(
+            [
+                _byte_to_bases[byte]
+                for byte in bytearray(self.fh4mm[first_byte : last_byte + 1])
+            ]
+        )
+        return decoded[buf_off & 3 : (buf_off & 3) + count]
 
 
 def which(program):
@@ -384,6 +499,34 @@ CA
                     ref.get_stretch("short_name4", 240, 42),
                 )
 
+            def test_multiple_stretches(self):
+                ref = BowtieIndexReference(self.fa_fn_1)
+                self.assertEqual(
+                    "".join(["N" * 10, "A" * 40, "N" * 40, "C" * 10]),
+                    ref.get_stretch("short_name4", 30, 100),
+                )
+                self.assertEqual(
+                    "".join(["G" * 5, "N" * 40, "TT", "N" * 3]),
+                    ref.get_stretch("short_name4", 235, 50),
+                )
+                self.assertEqual("", ref.get_stretch("short_name4", 10, 0))
+
+            def test_get_stretches(self):
+                ref = BowtieIndexReference(self.fa_fn_1)
+                stretches = [(235, 50), (30, 100), (41, 4), (10, 0), (-3, 6), (275, 9)]
+                self.assertEqual(
+                    [
+                        ref.get_stretch("short_name4", off, count)
+                        for off, count in stretches
+                    ],
+                    ref.get_stretches("short_name4", stretches),
+                )
+                self.assertEqual(
+                    ["NNNACG", "CGT"],
+                    ref.get_stretches("short_name1", [(-3, 6), (1, 3)], max_gap=0),
+                )
+                self.assertEqual([], ref.get_stretches("short_name1", []))
+
             def test4(self):
                 ref = BowtieIndexReference(self.fa_fn_1)
                 # Test that all refname lengths are accurate
@@ -49,6 +49,7 @@ import sys
 import os
 import subprocess
 from .transcript import gtf_to_cds, cds_to_feature_length, cds_to_tree
+from .annotation_store import write_annotation_store
 from distutils.core import Command
 
 download = {
@@ -547,6 +548,9 @@ class NeoepiscopeDownloader(object):
                 cds_dict, tx_data_dict, gencode_v35_temp
             )
             cds_to_tree(cds_dict, gencode_v35_temp)
+            write_annotation_store(
+                cds_dict, tx_data_dict, feature_lengths, gencode_v35_temp
+            )
         else:
             gencode_v35 = None
         if self._yes_no_query("Download GENCODE v19 gtf annotation file?"):
@@ -579,6 +583,9 @@ class NeoepiscopeDownloader(object):
                 cds_dict, tx_data_dict, gencode_v19_temp
             )
             cds_to_tree(cds_dict, gencode_v19_temp)
+            write_annotation_store(
+                cds_dict, tx_data_dict, feature_lengths, gencode_v19_temp
+            )
         else:
             gencode_v19 = None
         if self._yes_no_query("Download GENCODE vM25 gtf annotation file?"):
@@ -611,6 +618,9 @@ class NeoepiscopeDownloader(object):
                 cds_dict, tx_data_dict, gencode_vM25_temp
             )
             cds_to_tree(cds_dict, gencode_vM25_temp)
+            write_annotation_store(
+                cds_dict, tx_data_dict, feature_lengths, gencode_vM25_temp
+            )
         else:
             gencode_vM25 = None
         if self._yes_no_query("Download GENCODE vM1 gtf annotation file?"):
@@ -643,6 +653,9 @@ class NeoepiscopeDownloader(object):
                 cds_dict, tx_data_dict, gencode_vM1_temp
             )
             cds_to_tree(cds_dict, gencode_vM1_temp)
+            write_annotation_store(
+                cds_dict, tx_data_dict, feature_lengths, gencode_vM1_temp
+            )
         else:
             gencode_vM1 = None
         if self._yes_no_query("Download Bowtie GRCh38 index?"):
@@ -47,8 +47,12 @@ import os
 import re
 import pickle
 import datetime
+import heapq
+import itertools
+import tempfile
 from .version import version_number
 from intervaltree import Interval, IntervalTree
+from operator import itemgetter
 
 neoepiscope_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -663,6 +667,84 @@ def get_vaf_pos(VCF):
     return (vaf_pos, field)
 
 
+def spill_neoepitopes(neoepitopes, spill_dir=None):
+    """Writes neoepitopes, sorted by sequence, to a temporary file so they
+        can be merged with other groups of neoepitopes by
+        merge_spilled_neoepitopes()
+
+    neoepitopes: dictionary linking neoepitopes to their metadata
+    spill_dir: directory in which to write temporary file, or None for the
+        system default
+
+    Return value: path to temporary file
+    """
+    spill_handle, spill_file = tempfile.mkstemp(suffix=".neoepitopes", dir=spill_dir)
+    with os.fdopen(spill_handle, "wb") as spill_stream:
+        for epitope in sorted(neoepitopes.keys()):
+            pickle.dump(
+                (epitope, neoepitopes[epitope]),
+                spill_stream,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+    return spill_file
+
+
+def _read_spilled_neoepitopes(spill_file, group):
+    """Yields neoepitopes from a file written by spill_neoepitopes()
+
+    spill_file: path to file
+    group: index of file among files being merged
+
+    Yield value: tuple of (neoepitope, group, list of metadata)
+    """
+    with open(spill_file, "rb") as spill_stream:
+        while True:
+            try:
+                epitope, metadata = pickle.load(spill_stream)
+            except EOFError:
+                break
+            yield epitope, group, metadata
+
+
+def merge_spilled_neoepitopes(spill_files, sort_key=None, remove_files=True):
+    """Merges groups of neoepitopes written by spill_neoepitopes(), holding
+        only one neoepitope per group in memory at a time
+
+    spill_files: list of paths to files, in the order their groups were
+        enumerated
+    sort_key: function of (index of file in spill_files, metadata) used to
+        order a neoepitope's metadata from different groups, or None to
+        keep them in group order; ties are kept in group order
+    remove_files: whether to remove files once they have been merged
+
+    Yield value: tuple of (neoepitope, list of metadata), in order of
+        neoepitope sequence; metadata of a neoepitope found in multiple
+        groups are combined without duplicates
+    """
+    try:
+        merged = heapq.merge(
+            *[
+                _read_spilled_neoepitopes(spill_file, i)
+                for i, spill_file in enumerate(spill_files)
+            ]
+        )
+        for epitope, records in itertools.groupby(merged, key=itemgetter(0)):
+            records = [
+                (i, meta_data) for _, i, metadata in records for meta_data in metadata
+            ]
+            if sort_key is not None:
+                records.sort(key=lambda record: sort_key(*record))
+            combined = []
+            for _, meta_data in records:
+                if meta_data not in combined:
+                    combined.append(meta_data)
+            yield epitope, combined
+    finally:
+        if remove_files:
+            for spill_file in spill_files:
+                os.remove(spill_file)
+
+
 def write_results(
     output_file,
     hla_alleles,
@@ -678,7 +760,9 @@ def write_results(
 
     output_file: path to output file
     hla_alleles: list of HLA alleles used for binding predictions
-    neoepitopes: dictionary linking neoepitopes to their metadata
+    neoepitopes: dictionary linking neoepitopes to their metadata, or
+        iterable of (neoepitope, metadata) tuples sorted by neoepitope
+        (e.g. from merge_spilled_neoepitopes())
     tool_dict: dictionary storing prediction tool data
     tx_dict: dictionary linking transcript ID to list of
                 [transcript type, gene ID, gene name]
@@ -747,7 +831,13 @@ def write_results(
                     headers.append("_".join([tool, allele, score_method]))
         print("\t".join(headers), file=output_stream)
         # Write output for all epitopes
-        for epitope in sorted(neoepitopes.keys()):
+        if isinstance(neoepitopes, dict):
+            epitope_items = [
+                (epitope, neoepitopes[epitope]) for epitope in sorted(neoepitopes)
+            ]
+        else:
+            epitope_items = neoepitopes
+        for epitope, epitope_data in epitope_items:
             # Find relevant IEDB IDs for epitope
             if epitope in epitope_to_iedb:
                 iedb_id = ",".join(list(epitope_to_iedb[epitope]))
@@ -760,9 +850,9 @@ def write_results(
                     iedb_id = ",".join(list(possible_ids))
                 else:
                     iedb_id = "NA"
-            if len(neoepitopes[epitope]) == 1:
+            if len(epitope_data) == 1:
                 # Epitope only results from 1 transcript - get variant info
-                mutation = neoepitopes[epitope][0]
+                mutation = epitope_data[0]
                 if mutation[2] == "":
                     ref = "*"
                 else:
@@ -835,10 +925,10 @@ def write_results(
                 mutation_dict = collections.defaultdict(list)
                 # Get binding score info
                 ep_scores = []
-                for i in range(9, len(neoepitopes[epitope][0])):
-                    ep_scores.append(neoepitopes[epitope][0][i])
+                for i in range(9, len(epitope_data[0])):
+                    ep_scores.append(epitope_data[0][i])
                 # Get variant info
-                for mut in neoepitopes[epitope]:
+                for mut in epitope_data:
                     if mut[2] == "":
                         ref = "*"
                     else:
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+interval_index.py
+
+Part of neoepiscope
+Array-backed index of genomic intervals linked to transcripts, supporting
+single and vectorized batch overlap queries.
+
+Licensed under the MIT license.
+
+The MIT License (MIT)
+Copyright (c) 2018 Mary A. Wood, Austin Nguyen,
+                   Abhinav Nellore, and Reid Thompson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from __future__ import absolute_import, division, print_function
+from intervaltree import Interval
+import collections
+import numpy as np
+
+
+class ContigIntervals(object):
+    """Intervals on one contig, stored as arrays sorted by start position
+
+    Alongside starts, ends, and transcript indexes, a running maximum of
+        interval ends is kept; every interval before the first position at
+        which it exceeds a query's start ends at or before that start, so
+        each overlap query is two binary searches plus a scan of candidates.
+        Supports the subset of the IntervalTree interface used by
+        neoepiscope.
+    """
+
+    def __init__(self, starts, ends, transcripts, transcript_ids, max_ends=None):
+        """Stores interval arrays
+
+        starts: array of interval starts (inclusive), sorted
+        ends: array of interval ends (exclusive)
+        transcripts: array of indexes into transcript_ids, one per interval
+        transcript_ids: sequence of transcript IDs
+        max_ends: running maximum of ends, computed if not provided
+
+        No return value.
+        """
+        self.starts = starts
+        self.ends = ends
+        self.transcripts = transcripts
+        self.transcript_ids = transcript_ids
+        if max_ends is None:
+            max_ends = np.maximum.accumulate(ends) if len(ends) else ends.copy()
+        self.max_ends = max_ends
+
+    @classmethod
+    def from_intervals(cls, intervals, transcript_index, transcript_ids):
+        """Builds index from interval tuples
+
+        intervals: iterable of (start, end, transcript ID) tuples; duplicates
+            are collapsed, as in an IntervalTree
+        transcript_index: dictionary linking transcript IDs to their
+            positions in transcript_ids
+        transcript_ids: sequence of transcript IDs
+
+        Return value: ContigIntervals object
+        """
+        records = np.array(
+            sorted(
+                set(
+                    (start, end, transcript_index[transcript_id])
+                    for start, end, transcript_id in intervals
+                )
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        return cls(
+            records[:, 0].copy(),
+            records[:, 1].copy(),
+            records[:, 2].astype(np.int32),
+            transcript_ids,
+        )
+
+    def _interval(self, i):
+        return Interval(
+            int(self.starts[i]),
+            int(self.ends[i]),
+            self.transcript_ids[self.transcripts[i]],
+        )
+
+    def overlap(self, begin, end):
+        """Finds intervals overlapping a half-open range
+
+        begin: start of range (inclusive)
+        end: end of range (exclusive)
+
+        Return value: set of Interval objects with transcript IDs as data
+        """
+        if begin >= end:
+            return set()
+        first = int(np.searchsorted(self.max_ends, begin, side="right"))
+        last = int(np.searchsorted(self.starts, end, side="left"))
+        if first >= last:
+            return set()
+        hits = np.nonzero(self.ends[first:last] > begin)[0] + first
+        return set(self._interval(i) for i in hits)
+
+    def overlapping_transcripts(self, begin, end):
+        """Finds transcripts with intervals overlapping a half-open range
+
+        begin: start of range (inclusive)
+        end: end of range (exclusive)
+
+        Return value: list of unique transcript IDs, ordered by their
+            positions in transcript_ids
+        """
+        if begin >= end:
+            return []
+        first = self.max_ends.searchsorted(begin, side="right")
+        last = self.starts.searchsorted(end, side="left")
+        if first >= last:
+            return []
+        hits = self.transcripts[first:last][self.ends[first:last] > begin]
+        return [self.transcript_ids[i] for i in sorted(set(hits.tolist()))]
+
+    def overlap_batch(self, begins, ends):
+        """Finds intervals overlapping many half-open ranges at once
+
+        begins: array of range starts (inclusive)
+        ends: array of range ends (exclusive)
+
+        Return value: tuple of (array of query indexes, array of transcript
+            indexes), one entry per overlapping interval, ordered by query
+        """
+        begins = np.asarray(begins, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        first = np.searchsorted(self.max_ends, begins, side="right")
+        last = np.searchsorted(self.starts, ends, side="left")
+        # Empty candidate ranges for empty queries
+        last = np.where(begins < ends, np.maximum(last, first), first)
+        counts = last - first
+        total = int(counts.sum())
+        if not total:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        # Position of every candidate interval, grouped by query
+        queries = np.repeat(np.arange(len(begins)), counts)
+        group_starts = np.cumsum(counts) - counts
+        candidates = np.arange(total) - np.repeat(group_starts - first, counts)
+        keep = self.ends[candidates] > begins[queries]
+        return queries[keep], self.transcripts[candidates[keep]].astype(np.int64)
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self._interval(i)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def build_interval_index(contig_intervals):
+    """Builds an interval index for each contig
+
+    contig_intervals: dictionary linking contigs to iterables of
+        (start, end, transcript ID) tuples, with ends exclusive
+
+    Return value: dictionary linking contigs to ContigIntervals objects
+    """
+    transcript_ids = sorted(
+        set(
+            transcript_id
+            for intervals in contig_intervals.values()
+            for _, _, transcript_id in intervals
+        )
+    )
+    transcript_index = {
+        transcript_id: i for i, transcript_id in enumerate(transcript_ids)
+    }
+    return {
+        contig: ContigIntervals.from_intervals(
+            intervals, transcript_index, transcript_ids
+        )
+        for contig, intervals in contig_intervals.items()
+    }
+
+
+def update_interval_index(interval_index, contig_intervals, stale_transcript_ids):
+    """Updates an interval index after some transcripts change
+
+    Intervals of unchanged transcripts are carried over from the existing
+        index, so only intervals of new or changed transcripts are collected
+        in Python; the result is the index build_interval_index() would
+        return for the full set of intervals.
+
+    interval_index: dictionary linking contigs to ContigIntervals objects,
+        from build_interval_index()
+    contig_intervals: dictionary linking contigs to iterables of
+        (start, end, transcript ID) tuples of new or changed transcripts,
+        with ends exclusive
+    stale_transcript_ids: set of IDs of transcripts whose intervals are
+        dropped from interval_index (i.e., changed and removed transcripts)
+
+    Return value: dictionary linking contigs to ContigIntervals objects
+    """
+    transcript_ids = set(
+        transcript_id
+        for intervals in contig_intervals.values()
+        for _, _, transcript_id in intervals
+    )
+    previous_transcript_ids = {}
+    for contig_index in interval_index.values():
+        previous_transcript_ids[id(contig_index.transcript_ids)] = (
+            contig_index.transcript_ids
+        )
+    for previous_ids in previous_transcript_ids.values():
+        transcript_ids.update(
+            transcript_id
+            for transcript_id in previous_ids
+            if transcript_id not in stale_transcript_ids
+        )
+    transcript_ids = sorted(transcript_ids)
+    transcript_index = {
+        transcript_id: i for i, transcript_id in enumerate(transcript_ids)
+    }
+    # Map positions in previous transcript IDs to new positions; -1 is stale
+    index_maps = {}
+    for key, previous_ids in previous_transcript_ids.items():
+        index_maps[key] = np.array(
+            [
+                (
+                    -1
+                    if transcript_id in stale_transcript_ids
+                    else transcript_index[transcript_id]
+                )
+                for transcript_id in previous_ids
+            ],
+            dtype=np.int64,
+        )
+    updated_index = {}
+    for contig in set(interval_index.keys()) | set(contig_intervals.keys()):
+        records = np.array(
+            sorted(
+                set(
+                    (start, end, transcript_index[transcript_id])
+                    for start, end, transcript_id in contig_intervals.get(contig, [])
+                )
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        if contig in interval_index:
+            contig_index = interval_index[contig]
+            transcripts = index_maps[id(contig_index.transcript_ids)][
+                contig_index.transcripts
+            ]
+            kept = transcripts >= 0
+            records = np.concatenate(
+                [
+                    np.stack(
+                        [
+                            contig_index.starts[kept],
+                            contig_index.ends[kept],
+                            transcripts[kept],
+                        ],
+                        axis=1,
+                    ).astype(np.int64),
+                    records,
+                ]
+            )
+            # Both sets of intervals are sorted, but must be interleaved
+            records = records[np.lexsort((records[:, 2], records[:, 1], records[:, 0]))]
+        if not len(records):
+            continue
+        updated_index[contig] = ContigIntervals(
+            records[:, 0].copy(),
+            records[:, 1].copy(),
+            records[:, 2].astype(np.int32),
+            transcript_ids,
+        )
+    return updated_index
+
+
+def get_transcripts_from_tree_batch(queries, cds_tree):
+    """Finds transcripts overlapping many genomic ranges
+
+    Queries on contigs indexed with ContigIntervals objects are resolved in
+        one vectorized pass per contig; other trees (e.g. IntervalTree objects
+        from older pickled indexes) are queried one range at a time.
+
+    queries: list of (contig, start, stop) tuples, with stop exclusive
+    cds_tree: dictionary linking contigs to ContigIntervals or IntervalTree
+        objects
+
+    Return value: list of lists of unique transcript IDs, one per query
+    """
+    if hasattr(cds_tree, "transcripts_batch"):
+        # Intervals held by an annotation server are queried in one request
+        return cds_tree.transcripts_batch(queries)
+    results = [[] for _ in queries]
+    by_contig = collections.defaultdict(list)
+    for i, (contig, start, stop) in enumerate(queries):
+        if contig in cds_tree:
+            by_contig[contig].append(i)
+    for contig, query_indexes in by_contig.items():
+        tree = cds_tree[contig]
+        if not isinstance(tree, ContigIntervals):
+            for i in query_indexes:
+                results[i] = list(
+                    set(
+                        interval.data
+                        for interval in tree.overlap(queries[i][1], queries[i][2])
+                    )
+                )
+            continue
+        query_indexes = np.array(query_indexes, dtype=np.int64)
+        hit_queries, hit_transcripts = tree.overlap_batch(
+            [queries[i][1] for i in query_indexes],
+            [queries[i][2] for i in query_indexes],
+        )
+        if not len(hit_queries):
+            continue
+        # Deduplicate transcripts per query, ordering them by transcript index
+        order = np.lexsort((hit_transcripts, hit_queries))
+        hit_queries = hit_queries[order]
+        hit_transcripts = hit_transcripts[order]
+        unique = np.ones(len(hit_queries), dtype=bool)
+        unique[1:] = (hit_queries[1:] != hit_queries[:-1]) | (
+            hit_transcripts[1:] != hit_transcripts[:-1]
+        )
+        for query, transcript in zip(
+            query_indexes[hit_queries[unique]].tolist(),
+            hit_transcripts[unique].tolist(),
+        ):
+            results[query].append(tree.transcript_ids[transcript])
+    return results
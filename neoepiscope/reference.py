@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+reference.py
+
+Part of neoepiscope
+Retrieves genome sequence from 2bit files and indexed FASTA files, with the
+same interface as bowtie_index.BowtieIndexReference, and opens whichever
+kind of reference a path points to.
+
+Licensed under the MIT license.
+
+The MIT License (MIT)
+Copyright (c) 2018 Mary A. Wood, Austin Nguyen,
+                   Abhinav Nellore, and Reid Thompson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from __future__ import absolute_import, division, print_function
+from .bowtie_index import BowtieIndexReference
+from bisect import bisect_right
+import mmap
+import os
+import re
+import struct
+import numpy as np
+
+# Maps bytes of FASTA sequence to the characters a Bowtie index would hold:
+# soft-masked bases are uppercased, and ambiguous characters become N
+_fasta_translation_table = bytes(
+    bytearray(
+        ord(chr(byte).upper()) if chr(byte).upper() in "ACGT" else ord("N")
+        for byte in range(256)
+    )
+)
+# Each byte of 2bit sequence packs four bases, two bits apiece, starting
+# from the most significant bits
+_twobit_byte_to_bases = [
+    "".join("TCAG"[(byte >> shift) & 3] for shift in (6, 4, 2, 0)).encode("ascii")
+    for byte in range(256)
+]
+_twobit_signature = 0x1A412743
+
+
+class SequenceReference(object):
+    """Base class for references read from sequence files
+
+    Subclasses set length, a dictionary linking reference names to their
+        lengths, and implement _fetch(). Characters outside of a reference
+        are returned as Ns, as by BowtieIndexReference.
+    """
+
+    # Requests are batched the same way as for Bowtie indexes
+    get_stretches = BowtieIndexReference.get_stretches
+
+    def get_stretch(self, ref_id, ref_off, count):
+        """Retrieves a stretch of reference sequence
+
+        ref_id: name of reference sequence
+        ref_off: offset into reference, 0-based
+        count: number of characters
+
+        Return value: string extracted from reference
+        """
+        assert ref_id in self.length
+        if count <= 0:
+            return ""
+        start = max(ref_off, 0)
+        end = min(ref_off + count, self.length[ref_id])
+        if start >= end:
+            return "N" * count
+        return "".join(
+            [
+                "N" * (start - ref_off),
+                self._fetch(ref_id, start, end).decode("ascii"),
+                "N" * (ref_off + count - end),
+            ]
+        )
+
+    def _fetch(self, ref_id, start, end):
+        """Retrieves reference sequence lying within a reference
+
+        ref_id: name of reference sequence
+        start: start offset, 0-based, inclusive
+        end: end offset, 0-based, exclusive
+
+        Return value: bytes of uppercase A, C, G, T, and N characters
+        """
+        raise NotImplementedError
+
+    @property
+    def recs(self):
+        """(offset, length, first-of-chromosome flag) records of unambiguous
+        stretches for each reference, as held by BowtieIndexReference; built
+        on first use by scanning each reference for Ns
+        """
+        if not hasattr(self, "_recs"):
+            self._recs = {}
+            for ref_id in self.length:
+                recs, last_end = [], 0
+                sequence = self.get_stretch(ref_id, 0, self.length[ref_id])
+                for match in re.finditer("[ACGT]+", sequence):
+                    recs.append(
+                        (
+                            match.start() - last_end,
+                            match.end() - match.start(),
+                            not recs,
+                        )
+                    )
+                    last_end = match.end()
+                self._recs[ref_id] = recs
+        return self._recs
+
+
+class TwoBitReference(SequenceReference):
+    """Retrieves reference sequence from a memory-mapped 2bit file"""
+
+    def __init__(self, twobit):
+        """Reads sequence names and lengths from a 2bit file
+
+        twobit: path to 2bit file
+
+        No return value.
+        """
+        self.idx_prefix = twobit
+        with open(twobit, "rb") as twobit_stream:
+            self.mm = mmap.mmap(twobit_stream.fileno(), 0, access=mmap.ACCESS_READ)
+        signature = struct.unpack("<I", self.mm[0:4])[0]
+        if signature == _twobit_signature:
+            self.byte_order = "<"
+        elif struct.unpack(">I", self.mm[0:4])[0] == _twobit_signature:
+            self.byte_order = ">"
+        else:
+            raise RuntimeError("".join([twobit, " is not a 2bit file"]))
+        version, sequence_count = struct.unpack(self.byte_order + "II", self.mm[4:12])
+        # Version 1 files have 64-bit offsets
+        offset_format = self.byte_order + ("Q" if version == 1 else "I")
+        offset_size = struct.calcsize(offset_format)
+        self.refnames = []
+        self.record_offsets = {}
+        self.length = {}
+        position = 16
+        for _ in range(sequence_count):
+            name_size = self.mm[position]
+            name = self.mm[position + 1 : position + 1 + name_size].decode("ascii")
+            position += 1 + name_size
+            record_offset = struct.unpack(
+                offset_format, self.mm[position : position + offset_size]
+            )[0]
+            position += offset_size
+            self.refnames.append(name)
+            self.record_offsets[name] = record_offset
+            self.length[name] = struct.unpack(
+                self.byte_order + "I", self.mm[record_offset : record_offset + 4]
+            )[0]
+        # Sequence offsets and N blocks, parsed on first fetch from a reference
+        self.records = {}
+
+    def _record(self, ref_id):
+        """Parses the record of one sequence
+
+        ref_id: name of reference sequence
+
+        Return value: tuple of (offset of packed sequence, list of N block
+            starts, list of N block ends), with block ends exclusive
+        """
+        try:
+            return self.records[ref_id]
+        except KeyError:
+            pass
+        position = self.record_offsets[ref_id] + 4
+        uint32 = np.dtype(self.byte_order + "u4")
+        n_count = struct.unpack(
+            self.byte_order + "I", self.mm[position : position + 4]
+        )[0]
+        n_blocks = np.frombuffer(
+            self.mm, dtype=uint32, count=2 * n_count, offset=position + 4
+        ).astype(np.int64)
+        position += 4 + 8 * n_count
+        mask_count = struct.unpack(
+            self.byte_order + "I", self.mm[position : position + 4]
+        )[0]
+        # Skip soft-masking blocks and reserved word
+        position += 4 + 8 * mask_count + 4
+        n_starts = n_blocks[:n_count]
+        self.records[ref_id] = (
+            position,
+            n_starts.tolist(),
+            (n_starts + n_blocks[n_count:]).tolist(),
+        )
+        return self.records[ref_id]
+
+    def _fetch(self, ref_id, start, end):
+        """Retrieves reference sequence lying within a reference
+
+        ref_id: name of reference sequence
+        start: start offset, 0-based, inclusive
+        end: end offset, 0-based, exclusive
+
+        Return value: bytes of uppercase A, C, G, T, and N characters
+        """
+        sequence_offset, n_starts, n_ends = self._record(ref_id)
+        decoded = b"".join(
+            [
+                _twobit_byte_to_bases[byte]
+                for byte in bytearray(
+                    self.mm[
+                        sequence_offset
+                        + (start >> 2) : sequence_offset
+                        + ((end - 1) >> 2)
+                        + 1
+                    ]
+                )
+            ]
+        )[start & 3 : (start & 3) + end - start]
+        block = bisect_right(n_ends, start)
+        if block == len(n_starts) or n_starts[block] >= end:
+            return decoded
+        # Mask N blocks overlapping the stretch
+        stretch = bytearray(decoded)
+        while block < len(n_starts) and n_starts[block] < end:
+            block_start = max(n_starts[block], start)
+            block_end = min(n_ends[block], end)
+            stretch[block_start - start : block_end - start] = b"N" * (
+                block_end - block_start
+            )
+            block += 1
+        return bytes(stretch)
+
+
+class FastaReference(SequenceReference):
+    """Retrieves reference sequence from a FASTA file indexed with samtools
+    faidx; uncompressed files are memory-mapped, and bgzip-compressed files
+    are read with pysam
+    """
+
+    def __init__(self, fasta):
+        """Reads sequence names, lengths, and offsets from a FASTA index
+
+        fasta: path to FASTA file; fasta + ".fai" must exist
+
+        No return value.
+        """
+        self.idx_prefix = fasta
+        fai = "".join([fasta, ".fai"])
+        if not os.path.isfile(fai):
+            raise RuntimeError(
+                "".join(
+                    [
+                        "Cannot find FASTA index ",
+                        fai,
+                        "; index ",
+                        fasta,
+                        " with samtools faidx",
+                    ]
+                )
+            )
+        self.refnames = []
+        self.length = {}
+        self.line_layout = {}
+        with open(fai) as fai_stream:
+            for line in fai_stream:
+                tokens = line.strip().split("\t")
+                self.refnames.append(tokens[0])
+                self.length[tokens[0]] = int(tokens[1])
+                # Offset of first base, bases per line, and bytes per line
+                self.line_layout[tokens[0]] = tuple(int(x) for x in tokens[2:5])
+        if fasta.endswith(".gz"):
+            try:
+                import pysam
+            except ImportError:
+                raise RuntimeError(
+                    "pysam is required to read bgzip-compressed FASTA files"
+                )
+            self.fasta_file = pysam.FastaFile(fasta)
+            self.mm = None
+        else:
+            self.fasta_file = None
+            with open(fasta, "rb") as fasta_stream:
+                self.mm = mmap.mmap(fasta_stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _fetch(self, ref_id, start, end):
+        """Retrieves reference sequence lying within a reference
+
+        ref_id: name of reference sequence
+        start: start offset, 0-based, inclusive
+        end: end offset, 0-based, exclusive
+
+        Return value: bytes of uppercase A, C, G, T, and N characters
+        """
+        if self.mm is None:
+            return (
+                self.fasta_file.fetch(ref_id, start, end)
+                .encode("ascii")
+                .translate(_fasta_translation_table)
+            )
+        offset, line_bases, line_bytes = self.line_layout[ref_id]
+        first_byte = offset + (start // line_bases) * line_bytes + start % line_bases
+        last_byte = (
+            offset + ((end - 1) // line_bases) * line_bytes + (end - 1) % line_bases
+        )
+        return self.mm[first_byte : last_byte + 1].translate(
+            _fasta_translation_table, b"\r\n"
+        )
+
+
+def open_reference(path):
+    """Opens a reference for retrieving genome sequence
+
+    path: path to 2bit file (ending in .2bit), FASTA file indexed with
+        samtools faidx (optionally bgzip-compressed), or Bowtie index
+        basename
+
+    Return value: TwoBitReference, FastaReference, or BowtieIndexReference
+        object
+    """
+    if path.endswith(".2bit"):
+        return TwoBitReference(path)
+    if os.path.isfile("".join([path, ".fai"])):
+        return FastaReference(path)
+    if os.path.isfile("".join([path, ".3.ebwt"])):
+        return BowtieIndexReference(path)
+    raise RuntimeError(
+        "".join(
+            [
+                "Cannot find reference ",
+                path,
+                "; expected a 2bit file, a FASTA file with a .fai index, ",
+                "or a Bowtie index basename",
+            ]
+        )
+    )
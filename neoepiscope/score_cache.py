@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+score_cache.py
+
+Part of neoepiscope
+Persistent on-disk cache of binding scores, so that peptides scored in
+previous runs need not be sent to prediction tools again.
+
+Licensed under the MIT license.
+
+The MIT License (MIT)
+Copyright (c) 2018 Mary A. Wood, Austin Nguyen,
+                   Abhinav Nellore, and Reid Thompson
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from __future__ import absolute_import, division, print_function
+import json
+import os
+import sqlite3
+import time
+import warnings
+
+# SQLite limits the number of parameters in a single statement
+_QUERY_CHUNK = 500
+
+
+def default_score_cache():
+    """Finds default location of binding score cache
+
+    Return value: path to cache file in the user's cache directory
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_dir, "neoepiscope", "binding_scores.sqlite")
+
+
+class BindingScoreCache(object):
+    """Stores binding scores in an SQLite database
+
+    Scores are keyed by tool ID (which includes the tool version, e.g.
+        netMHCpan4), allele, scoring methods, and peptide, and are stored as
+        JSON text, so that a cache shared between users cannot smuggle code
+        into runs that read it. Each entry records when it was last used;
+        once the database exceeds its maximum size, least recently used
+        entries are evicted.
+    """
+
+    def __init__(self, cache_file, max_size=None):
+        """Opens or creates cache
+
+        cache_file: path to cache file
+        max_size: maximum size of cache in bytes, or None for no limit
+
+        No return value.
+        """
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_file = cache_file
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(cache_file, timeout=60)
+        with self.connection:
+            # Free pages must be reclaimable after eviction; this only takes
+            #   effect when the database is created
+            self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "tool TEXT NOT NULL, allele TEXT NOT NULL, "
+                "scoring TEXT NOT NULL, peptide TEXT NOT NULL, "
+                "result TEXT NOT NULL, last_used REAL NOT NULL, "
+                "UNIQUE (tool, allele, scoring, peptide))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+            )
+
+    def lookup(self, tool, allele, scoring, peptides):
+        """Retrieves cached binding scores
+
+        tool: tool ID from tool dictionary (e.g. netMHCpan4)
+        allele: allele used for binding predictions
+        scoring: list of scoring methods
+        peptides: list of peptides
+
+        Return value: dictionary linking cached peptides to tuples of
+            (peptide, score 1, score 2, ...) as returned by the tool
+        """
+        scoring = ",".join(scoring)
+        cached = {}
+        now = time.time()
+        with self.connection:
+            for i in range(0, len(peptides), _QUERY_CHUNK):
+                chunk = peptides[i : i + _QUERY_CHUNK]
+                placeholders = ",".join(["?"] * len(chunk))
+                parameters = [tool, allele, scoring] + chunk
+                for peptide, result in self.connection.execute(
+                    "".join(
+                        [
+                            "SELECT peptide, result FROM scores WHERE tool = ? ",
+                            "AND allele = ? AND scoring = ? AND peptide IN (",
+                            placeholders,
+                            ")",
+                        ]
+                    ),
+                    parameters,
+                ):
+                    try:
+                        score = json.loads(result)
+                    except ValueError:
+                        # Not written by this version; score peptide again
+                        continue
+                    if isinstance(score, list) and score and score[0] == peptide:
+                        cached[peptide] = tuple(score)
+                self.connection.execute(
+                    "".join(
+                        [
+                            "UPDATE scores SET last_used = ? WHERE tool = ? ",
+                            "AND allele = ? AND scoring = ? AND peptide IN (",
+                            placeholders,
+                            ")",
+                        ]
+                    ),
+                    [now] + parameters,
+                )
+        self.hits += len(cached)
+        self.misses += len(set(peptides)) - len(cached)
+        return cached
+
+    def store(self, tool, allele, scoring, binding_scores):
+        """Adds binding scores to cache, evicting old entries if necessary
+
+        tool: tool ID from tool dictionary (e.g. netMHCpan4)
+        allele: allele used for binding predictions
+        scoring: list of scoring methods
+        binding_scores: list of tuples of (peptide, score 1, score 2, ...)
+            as returned by the tool
+
+        No return value.
+        """
+        scoring = ",".join(scoring)
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        tool,
+                        allele,
+                        scoring,
+                        score[0],
+                        json.dumps(list(score)),
+                        now,
+                    )
+                    for score in binding_scores
+                ),
+            )
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def size(self):
+        """Measures space used by cache entries
+
+        Return value: size of used database pages in bytes
+        """
+        page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        free_count = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return page_size * (page_count - free_count)
+
+    def evict(self, max_size):
+        """Removes least recently used entries until cache fits in max_size
+
+        max_size: maximum size of cache in bytes
+
+        No return value.
+        """
+        size = self.size()
+        while size > max_size:
+            (entries,) = self.connection.execute(
+                "SELECT COUNT(*) FROM scores"
+            ).fetchone()
+            if not entries:
+                break
+            # Assume entries are of similar size, and leave some headroom so
+            #   that eviction is not needed again after every store; repeat
+            #   if fixed overhead keeps the cache too large
+            keep = min(int(entries * max_size * 0.9 / size), entries - 1)
+            with self.connection:
+                self.connection.execute(
+                    "DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores "
+                    "ORDER BY last_used LIMIT ?)",
+                    (entries - keep,),
+                )
+            # Return freed pages to the file system; executescript() steps the
+            #   pragma to completion rather than freeing a single page
+            self.connection.executescript("PRAGMA incremental_vacuum;")
+            size = self.size()
+
+    def close(self):
+        """Closes connection to cache
+
+        No return value.
+        """
+        self.connection.close()
+
+
+def open_score_cache(cache_file, max_size=None):
+    """Opens binding score cache, warning rather than failing if it cannot
+        be used
+
+    cache_file: path to cache file
+    max_size: maximum size of cache in bytes, or None for no limit
+
+    Return value: BindingScoreCache object, or None if cache is unusable
+    """
+    try:
+        return BindingScoreCache(cache_file, max_size=max_size)
+    except (OSError, IOError, sqlite3.Error) as e:
+        warnings.warn(
+            "".join(
+                [
+                    "Cannot use binding score cache ",
+                    cache_file,
+                    " (",
+                    str(e),
+                    "); will proceed without caching binding scores",
+                ]
+            ),
+            Warning,
+        )
+        return None
@@ -39,22 +39,40 @@ SOFTWARE.
 """
 
 from __future__ import absolute_import, division, print_function
-from . import bowtie_index
+from .reference import open_reference
+from .annotation_server import connect_annotation_server
 import collections
 import copy
 import bisect
+import functools
+import hashlib
 import string
 import re
 import os
 import pickle
 from intervaltree import IntervalTree
+from .interval_index import (
+    ContigIntervals,
+    build_interval_index,
+    get_transcripts_from_tree_batch,
+    update_interval_index,
+)
 from operator import itemgetter
 from numpy import median
+import numpy as np
 import sys
 import warnings
 import contextlib
+import io
+import itertools
+import multiprocessing
 import networkx as nx
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 revcomp_translation_table = str.maketrans("ATCG", "TAGC")
 
 
@@ -173,6 +191,60 @@ def kmerize_peptide(peptide, min_size=8, max_size=11):
     ]
 
 
+class _KmerIndex(object):
+    """Tests whether peptides occur in a protein by hashing their prefixes.
+    One index answers for peptides of every size from its anchor size up,
+    in place of a set of subsequences per size.
+    """
+
+    def __init__(self, protein, anchor_size):
+        """
+        protein: protein seq
+        anchor_size: size of prefixes hashed; peptides looked up must be at
+            least this long
+        """
+        self.protein = protein
+        self.anchor_size = anchor_size
+        anchors = [
+            protein[i : i + anchor_size] for i in range(len(protein) - anchor_size + 1)
+        ]
+        # Map each prefix to its first and last positions
+        self.last = dict(zip(anchors, itertools.count()))
+        self.first = dict(zip(reversed(anchors), range(len(anchors) - 1, -1, -1)))
+
+    def __contains__(self, peptide):
+        first = self.first.get(peptide[: self.anchor_size])
+        if first is None:
+            return False
+        if self.protein.startswith(peptide, first):
+            return True
+        last = self.last[peptide[: self.anchor_size]]
+        if last == first:
+            return False
+        # Prefix repeats, so search between its first and last positions
+        return self.protein.find(peptide, first + 1, last + len(peptide)) >= 0
+
+
+@functools.lru_cache(maxsize=1024)
+def reference_kmer_index(protein, size):
+    """Indexes subsequences of a reference protein.
+    Indexes are cached, so cliques on the same transcript share them.
+    protein: reference protein seq
+    size: minimum size of subsequences looked up
+    Return value: _KmerIndex supporting "in" for subsequences of at least
+        given size
+    """
+    return _KmerIndex(protein, size)
+
+
+def reference_digest(sequence):
+    """Computes digest identifying a reference coding sequence.
+    sequence: nucleotide sequence
+    Return value: 16-byte digest
+    """
+    return hashlib.blake2b(sequence.encode("ascii"), digest_size=16).digest()
+
+
 # X below denotes a stop codon
 _codon_table = {
     "TTT": "F",
@@ -309,6 +381,66 @@ _mitochondrial_codon_table = {
 }
 
 
+def _codon_residue(codon, codon_table):
+    """Translates one codon, resolving an N in its wobble position when all
+    bases there give the same amino acid.
+    codon: 3-nucleotide string
+    codon_table: dictionary mapping codons to amino acids
+    Return value: amino acid, or ? if it cannot be determined
+    """
+    if "N" not in codon:
+        return codon_table[codon]
+    if codon.count("N") == 1 and codon[2] == "N":
+        # Only 1 N in the wobble position
+        return _partial_codon_residue(codon[:2], codon_table)
+    # More than 1 N or N not in wobble position
+    return "?"
+
+
+def _partial_codon_residue(bases, codon_table):
+    """Translates the first 2 nucleotides of a codon if all bases in its
+    wobble position give the same amino acid.
+    bases: 2-nucleotide string
+    codon_table: dictionary mapping codons to amino acids
+    Return value: amino acid, or ? if it cannot be determined
+    """
+    codon_options = set([codon_table[bases + x] for x in ["A", "C", "G", "T"]])
+    if len(codon_options) == 1:
+        return list(codon_options)[0]
+    return "?"
+
+
+# Codons over ACGTN, ordered so codon's index is 25 * first base's index in
+# ACGTN + 5 * second base's + third base's, with their translations
+_coded_codons = [a + b + c for a in "ACGTN" for b in "ACGTN" for c in "ACGTN"]
+_codon_residues = {
+    mitochondrial: {
+        codon: _codon_residue(
+            codon, _mitochondrial_codon_table if mitochondrial else _codon_table
+        )
+        for codon in _coded_codons
+    }
+    for mitochondrial in [False, True]
+}
+_coded_residues = {
+    mitochondrial: np.frombuffer(
+        "".join(
+            [_codon_residues[mitochondrial][codon] for codon in _coded_codons]
+        ).encode("ascii"),
+        dtype=np.uint8,
+    )
+    for mitochondrial in [False, True]
+}
+
+# Index in ACGTN of each byte, or 5 if byte is not in ACGTN
+_base_codes = np.full(256, 5, dtype=np.intp)
+_base_codes[np.frombuffer(b"ACGTN", dtype=np.uint8)] = np.arange(5)
+
+# Length of sequence from which codons are indexed with numpy rather than
+# looked up one at a time
+_vectorized_translation_size = 120
+
+
 def seq_to_peptide(
     seq,
     reverse_strand=False,
@@ -336,70 +468,317 @@ def seq_to_peptide(
         else:
             return ""
     seq_size = len(seq)
-    peptide = []
+    whole_size = seq_size - seq_size % 3
+    peptide = None
+    if whole_size >= _vectorized_translation_size:
+        codes = _base_codes[
+            np.frombuffer(seq[:whole_size].encode("ascii", "replace"), dtype=np.uint8)
+        ]
+        if codes.max() < 5:
+            codes = codes.reshape(-1, 3)
+            peptide = (
+                _coded_residues[mitochondrial][
+                    25 * codes[:, 0] + 5 * codes[:, 1] + codes[:, 2]
+                ]
+                .tobytes()
+                .decode("ascii")
+            )
+    if peptide is None:
+        codon_residues = _codon_residues[mitochondrial]
+        try:
+            peptide = "".join(
+                [codon_residues[seq[i : i + 3]] for i in range(0, whole_size, 3)]
+            )
+        except KeyError:
+            # Bases other than ACGTN raise KeyError unless N is also present
+            codon_table = _mitochondrial_codon_table if mitochondrial else _codon_table
+            peptide = "".join(
+                [
+                    _codon_residue(seq[i : i + 3], codon_table)
+                    for i in range(0, whole_size, 3)
+                ]
+            )
     peptide_warnings = []
-    for i in range(0, seq_size - seq_size % 3, 3):
-        chunk = seq[i : i + 3]
-        if "N" not in chunk:
-            if not mitochondrial:
-                codon = _codon_table[chunk]
-            else:
-                codon = _mitochondrial_codon_table[chunk]
-        elif chunk.count("N") == 1 and seq[i + 2] == "N":
-            # Only 1 N in the wobble position
-            if not mitochondrial:
-                codon_options = set(
-                    [
-                        _codon_table["".join([seq[i : i + 2], x])]
-                        for x in ["A", "C", "G", "T"]
-                    ]
-                )
-            else:
-                codon_options = set(
-                    [
-                        _mitochondrial_codon_table["".join([seq[i : i + 2], x])]
-                        for x in ["A", "C", "G", "T"]
-                    ]
-                )
-            if len(codon_options) == 1:
-                codon = list(codon_options)[0]
-            else:
-                codon = "?"
-        else:
-            # More than 1 N or N not in wobble position
-            codon = "?"
-        peptide.append(codon)
     if seq_size % 3:
         peptide_warnings.append("incomplete_CDS")
         if allow_partial_codons:
             # 1-2 nucleotides remaining
             if seq_size % 3 == 2:
                 # 2 nucleotides remaining - check if amino acid can be determined
-                if not mitochondrial:
-                    codon_options = set(
-                        [
-                            _codon_table["".join([seq[-2:], x])]
-                            for x in ["A", "C", "G", "T"]
-                        ]
-                    )
-                else:
-                    codon_options = set(
-                        [
-                            _mitochondrial_codon_table["".join([seq[-2:], x])]
-                            for x in ["A", "C", "G", "T"]
-                        ]
-                    )
-                if len(codon_options) == 1:
-                    codon = list(codon_options)[0]
-                else:
-                    codon = "?"
+                peptide += _partial_codon_residue(
+                    seq[-2:],
+                    _mitochondrial_codon_table if mitochondrial else _codon_table,
+                )
             else:
                 # Only 1 amino acid left - can't determine amino acid
-                codon = "?"
-            peptide.append(codon)
+                peptide += "?"
     if mitochondrial and peptide[0] != "M":
-        peptide[0] = "M"
-    return "".join(peptide), peptide_warnings
+        peptide = "M" + peptide[1:]
+    return peptide, peptide_warnings
+
+
+# Number of codons below which blocks that differ from a previous
+# translation are translated rather than split further
+_translation_block_size = 16
+
+
+def _common_prefix_length(first, second):
+    """Finds length of longest common prefix of two strings
+
+    first: string
+    second: string
+
+    Return value: length of common prefix
+    """
+    # Slices are compared in C, so search for the first mismatch by halving
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix_length(first, second, max_length):
+    """Finds length of longest common suffix of two strings
+
+    first: string
+    second: string
+    max_length: maximum length to return
+
+    Return value: length of common suffix, at most max_length
+    """
+    low, high = 0, min(len(first), len(second), max_length)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if (
+            first[len(first) - middle : len(first) - low]
+            == second[len(second) - middle : len(second) - low]
+        ):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class ReferenceSequenceCache(object):
+    """Bounded LRU cache of spliced reference transcript sequences
+
+    Each entry holds the reference sequence of a transcript's exonic blocks
+        concatenated in genome order, along with the genomic start, end, and
+        offset into that sequence of every block, so stretches falling
+        within a block are sliced out rather than decoded from the reference
+        index again. Entries are keyed by reference index prefix and
+        transcript ID and shared by all Transcript objects in a process.
+    """
+
+    def __init__(self, max_transcripts=4096):
+        """Creates empty cache
+
+        max_transcripts: maximum number of transcripts to hold; 0 disables
+            caching
+
+        No return value.
+        """
+        self.max_transcripts = max_transcripts
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Removes all entries and resets hit/miss counters
+
+        No return value.
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, reference_index, transcript_id, chrom, intervals):
+        """Retrieves or builds a transcript's spliced reference sequence
+
+        reference_index: BowtieIndexReference object for retrieving
+            reference genome sequence
+        transcript_id: transcript ID
+        chrom: chromosome of transcript
+        intervals: sorted list of exonic block bounds, alternating
+            exclusive starts and inclusive ends (0-based), as stored by
+            Transcript objects
+
+        Return value: tuple (spliced sequence, list of block starts, list of
+            block ends, list of block offsets into spliced sequence), with
+            starts inclusive and ends exclusive (0-based); None if caching
+            is disabled
+        """
+        if self.max_transcripts <= 0:
+            return None
+        key = (getattr(reference_index, "idx_prefix", None), transcript_id)
+        entry = self.entries.get(key)
+        if (
+            entry is not None
+            and entry[0] == chrom
+            and len(entry[1]) == len(intervals)
+            and all(a == b for a, b in zip(entry[1], intervals))
+        ):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[2]
+        self.misses += 1
+        starts = [intervals[i] + 1 for i in range(0, len(intervals), 2)]
+        ends = [intervals[i + 1] + 1 for i in range(0, len(intervals), 2)]
+        offsets, offset = [], 0
+        for start, end in zip(starts, ends):
+            offsets.append(offset)
+            offset += max(end - start, 0)
+        spliced = (
+            "".join(
+                reference_index.get_stretches(
+                    chrom, [(start, end - start) for start, end in zip(starts, ends)]
+                )
+            ),
+            starts,
+            ends,
+            offsets,
+        )
+        self.entries[key] = (chrom, tuple(intervals), spliced)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_transcripts:
+            self.entries.popitem(last=False)
+        return spliced
+
+
+# Spliced reference sequences shared by all Transcript objects in a process
+reference_sequence_cache = ReferenceSequenceCache()
+
+
+class _CoordinateMap(Mapping):
+    """Links coordinates to coordinates like a dictionary, but stores runs
+        of consecutive keys rather than one entry per key
+
+    Each run links keys key_start, key_start + key_step, ... to values
+        value_start, value_start + value_step, ...; keys are looked up by
+        binary search over runs sorted by key. A key in more than one run
+        takes its value from the run added last, as it would if each run
+        were assigned to a dictionary in turn.
+    """
+
+    def __init__(self):
+        """Creates empty map
+
+        No return value.
+        """
+        # Runs in order added, as [key_start, key_step, value_start,
+        # value_step, length]
+        self.runs = []
+        # Built on first lookup: first and last keys of segments of runs,
+        # sorted by key, and whether any runs overlap
+        self._firsts, self._lasts, self._segment_runs = None, None, None
+        self._overlapping = False
+
+    def add_run(self, key_start, key_step, value_start, value_step, length):
+        """Adds a run of keys
+
+        key_start: first key
+        key_step: 1 if keys increase, -1 if they decrease
+        value_start: value linked to first key
+        value_step: difference between values linked to successive keys
+        length: number of keys
+
+        No return value.
+        """
+        if length <= 0:
+            return
+        self._firsts = None
+        if self.runs:
+            last_run = self.runs[-1]
+            if (
+                last_run[1] == key_step
+                and last_run[3] == value_step
+                and last_run[0] + last_run[4] * key_step == key_start
+                and last_run[2] + last_run[4] * value_step == value_start
+            ):
+                # Run continues the last one
+                last_run[4] += length
+                return
+        self.runs.append([key_start, key_step, value_start, value_step, length])
+
+    def _index(self):
+        """Sorts runs by key for lookups, splitting runs that overlap
+
+        No return value.
+        """
+        spans = sorted(
+            (
+                min(run[0], run[0] + (run[4] - 1) * run[1]),
+                max(run[0], run[0] + (run[4] - 1) * run[1]),
+                run,
+            )
+            for run in self.runs
+        )
+        self._overlapping = any(
+            spans[i + 1][0] <= spans[i][1] for i in range(len(spans) - 1)
+        )
+        if not self._overlapping:
+            self._firsts = [span[0] for span in spans]
+            self._lasts = [span[1] for span in spans]
+            self._segment_runs = [span[2] for span in spans]
+            return
+        # Lay runs down in order added, so later runs cover earlier ones
+        firsts, lasts, segment_runs = [], [], []
+        for run in self.runs:
+            first = min(run[0], run[0] + (run[4] - 1) * run[1])
+            last = max(run[0], run[0] + (run[4] - 1) * run[1])
+            i = max(bisect.bisect_right(firsts, first) - 1, 0)
+            j = bisect.bisect_right(firsts, last)
+            before, after = [], []
+            for k in range(i, j):
+                if lasts[k] < first:
+                    before.append((firsts[k], lasts[k], segment_runs[k]))
+                    continue
+                if firsts[k] < first:
+                    before.append((firsts[k], first - 1, segment_runs[k]))
+                if lasts[k] > last:
+                    after.append((last + 1, lasts[k], segment_runs[k]))
+            segments = before + [(first, last, run)] + after
+            firsts[i:j] = [segment[0] for segment in segments]
+            lasts[i:j] = [segment[1] for segment in segments]
+            segment_runs[i:j] = [segment[2] for segment in segments]
+        self._firsts, self._lasts, self._segment_runs = firsts, lasts, segment_runs
+
+    def __getitem__(self, key):
+        if self._firsts is None:
+            self._index()
+        try:
+            i = bisect.bisect_right(self._firsts, key) - 1
+        except TypeError:
+            raise KeyError(key)
+        if i < 0 or key > self._lasts[i] or key != int(key):
+            raise KeyError(key)
+        key_start, key_step, value_start, value_step, _ = self._segment_runs[i]
+        return value_start + (key - key_start) * key_step * value_step
+
+    def __iter__(self):
+        if self._firsts is None:
+            self._index()
+        # Keys are yielded in the order a dictionary would hold them
+        seen = set()
+        for key_start, key_step, _, _, length in self.runs:
+            keys = range(key_start, key_start + length * key_step, key_step)
+            if not self._overlapping:
+                for key in keys:
+                    yield key
+                continue
+            for key in keys:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        if self._firsts is None:
+            self._index()
+        return sum(last - first + 1 for first, last in zip(self._firsts, self._lasts))
 
 
 class Transcript(object):
@@ -478,6 +857,10 @@ class Transcript(object):
         # Flag to indicate if there is a deletion that spans intron-exon boundary
         self.boundary_spanning_deletion = False
         self.rev_strand = True if last_strand == "-" else False
+        # Last sequence translated by _translate() for each purpose, along with
+        # its translation; kept across resets so that cliques sharing most
+        # edits only translate codons that differ
+        self.translations = {}
         """Assume intervals are nonoverlapping! Uncomment following lines to
         check (slower)."""
         # for i in range(1, len(self.intervals)):
@@ -523,9 +906,7 @@ class Transcript(object):
                         self.intervals, self._start_codon
                     )
                 # Entire start codon contained within same exon
-                self.start_codon_seq = self.bowtie_reference_index.get_stretch(
-                    self.chrom, self._start_codon, 3
-                )
+                start_stretches = [(self._start_codon, 3)]
                 self.start_coordinates = [
                     x for x in range(self.start_codon, self.start_codon + 3)
                 ]
@@ -536,12 +917,10 @@ class Transcript(object):
                     == self.start_codon_index
                 ):
                     # Only need to grab 1 nucleotide from next exon
-                    self.start_codon_seq = self.bowtie_reference_index.get_stretch(
-                        self.chrom, self._start_codon, 2
-                    )
-                    self.start_codon_seq += self.bowtie_reference_index.get_stretch(
-                        self.chrom, self.intervals[self.start_codon_index + 1] + 1, 1
-                    )
+                    start_stretches = [
+                        (self._start_codon, 2),
+                        (self.intervals[self.start_codon_index + 1] + 1, 1),
+                    ]
                     self.start_coordinates = [
                         self.start_codon,
                         self.start_codon + 1,
@@ -549,9 +928,7 @@ class Transcript(object):
                     ]
                 else:
                     # Need to grab two nucleotides from following exon(s)
-                    self.start_codon_seq = self.bowtie_reference_index.get_stretch(
-                        self.chrom, self._start_codon, 1
-                    )
+                    start_stretches = [(self._start_codon, 1)]
                     self.start_coordinates = [self.start_codon]
                     if (
                         self.intervals[self.start_codon_index + 2]
@@ -559,10 +936,8 @@ class Transcript(object):
                         >= 2
                     ):
                         # The remainder of the start codon is within the next exon
-                        self.start_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom,
-                            self.intervals[self.start_codon_index + 1] + 1,
-                            2,
+                        start_stretches.append(
+                            (self.intervals[self.start_codon_index + 1] + 1, 2)
                         )
                         self.start_coordinates.extend(
                             [
@@ -572,15 +947,11 @@ class Transcript(object):
                         )
                     else:
                         # The start codon is split across three exons
-                        self.start_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom,
-                            self.intervals[self.start_codon_index + 1] + 1,
-                            1,
+                        start_stretches.append(
+                            (self.intervals[self.start_codon_index + 1] + 1, 1)
                         )
-                        self.start_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom,
-                            self.intervals[self.start_codon_index + 3] + 1,
-                            1,
+                        start_stretches.append(
+                            (self.intervals[self.start_codon_index + 3] + 1, 1)
                         )
                         self.start_coordinates.extend(
                             [
@@ -588,14 +959,9 @@ class Transcript(object):
                                 self.intervals[self.start_codon_index + 3] + 2,
                             ]
                         )
-            if self.rev_strand:
-                # Reverse strand transcript - reverse complement the sequence
-                self.start_codon_seq = self.start_codon_seq[::-1].translate(
-                    revcomp_translation_table
-                )
         else:
             # There is no start codon sequence
-            self.start_codon_seq = None
+            start_stretches = []
             self.start_coordinates = []
         # Get stop codon index
         if self.stop_codon:
@@ -610,9 +976,7 @@ class Transcript(object):
                 == self.stop_codon_index
             ):
                 # Entire stop codon contained within same exon
-                self.stop_codon_seq = self.bowtie_reference_index.get_stretch(
-                    self.chrom, self._stop_codon, 3
-                )
+                stop_stretches = [(self._stop_codon, 3)]
                 self.stop_coordinates = [
                     x for x in range(self.stop_codon, self.stop_codon + 3)
                 ]
@@ -623,12 +987,10 @@ class Transcript(object):
                     == self.stop_codon_index
                 ):
                     # Only need to grab 1 nucleotide from following exon
-                    self.stop_codon_seq = self.bowtie_reference_index.get_stretch(
-                        self.chrom, self._stop_codon, 2
-                    )
-                    self.stop_codon_seq += self.bowtie_reference_index.get_stretch(
-                        self.chrom, self.intervals[self.stop_codon_index + 1] + 1, 1
-                    )
+                    stop_stretches = [
+                        (self._stop_codon, 2),
+                        (self.intervals[self.stop_codon_index + 1] + 1, 1),
+                    ]
                     self.stop_coordinates = [
                         self.stop_codon,
                         self.stop_codon + 1,
@@ -636,9 +998,7 @@ class Transcript(object):
                     ]
                 else:
                     # Need to grab two nucleotides from following exon(s)
-                    self.stop_codon_seq = self.bowtie_reference_index.get_stretch(
-                        self.chrom, self._stop_codon, 1
-                    )
+                    stop_stretches = [(self._stop_codon, 1)]
                     self.stop_coordinates = [self.stop_codon]
                     if (
                         self.intervals[self.stop_codon_index + 2]
@@ -646,8 +1006,8 @@ class Transcript(object):
                         >= 2
                     ):
                         # The remainder of the stop codon is within the next exon
-                        self.stop_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom, self.intervals[self.stop_codon_index + 1] + 1, 2
+                        stop_stretches.append(
+                            (self.intervals[self.stop_codon_index + 1] + 1, 2)
                         )
                         self.stop_coordinates.extend(
                             [
@@ -657,11 +1017,11 @@ class Transcript(object):
                         )
                     else:
                         # The stop codon is split across three exons
-                        self.stop_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom, self.intervals[self.stop_codon_index + 1] + 1, 1
+                        stop_stretches.append(
+                            (self.intervals[self.stop_codon_index + 1] + 1, 1)
                         )
-                        self.stop_codon_seq += self.bowtie_reference_index.get_stretch(
-                            self.chrom, self.intervals[self.stop_codon_index + 3] + 1, 1
+                        stop_stretches.append(
+                            (self.intervals[self.stop_codon_index + 3] + 1, 1)
                         )
                         self.stop_coordinates.extend(
                             [
@@ -669,15 +1029,73 @@ class Transcript(object):
                                 self.intervals[self.stop_codon_index + 3] + 2,
                             ]
                         )
-            if self.rev_strand:
-                # Reverse strand transcript - reverse complement the sequence
-                self.stop_codon_seq = self.stop_codon_seq[::-1].translate(
-                    revcomp_translation_table
-                )
         else:
             # There is no stop codon sequence
-            self.stop_codon_seq = None
+            stop_stretches = []
             self.stop_coordinates = []
+        # Retrieve start and stop codon sequences together
+        codon_seqs = self._reference_stretches(start_stretches + stop_stretches)
+        self.start_codon_seq, self.stop_codon_seq = None, None
+        if self.start_codon is not None:
+            self.start_codon_seq = "".join(codon_seqs[: len(start_stretches)])
+        if self.stop_codon is not None:
+            self.stop_codon_seq = "".join(codon_seqs[len(start_stretches) :])
+        if self.rev_strand:
+            # Reverse strand transcript - reverse complement the sequences
+            if self.start_codon_seq is not None:
+                self.start_codon_seq = self.start_codon_seq[::-1].translate(
+                    revcomp_translation_table
+                )
+            if self.stop_codon_seq is not None:
+                self.stop_codon_seq = self.stop_codon_seq[::-1].translate(
+                    revcomp_translation_table
+                )
+
+    def _reference_stretches(self, stretches):
+        """Retrieves stretches of reference sequence on transcript's chromosome
+
+        Stretches within a single exonic block are sliced from the cached
+            spliced reference sequence; the rest are retrieved from the
+            reference index in one batch.
+
+        stretches: list of (offset, count) tuples, with offset 0-based
+
+        Return value: list of reference sequences, in the order of stretches
+        """
+        try:
+            spliced = self._spliced_reference
+        except AttributeError:
+            # Intervals do not change once the transcript is built
+            spliced = self._spliced_reference = reference_sequence_cache.lookup(
+                self.bowtie_reference_index,
+                self.transcript_id,
+                self.chrom,
+                self.intervals,
+            )
+        if spliced is None:
+            return self.bowtie_reference_index.get_stretches(self.chrom, stretches)
+        sequence, starts, ends, offsets = spliced
+        pieces, missing = [], []
+        for i, (ref_off, count) in enumerate(stretches):
+            block = bisect.bisect_right(starts, ref_off) - 1
+            if count <= 0:
+                pieces.append("")
+            elif block >= 0 and ref_off + count <= ends[block]:
+                offset = offsets[block] + ref_off - starts[block]
+                pieces.append(sequence[offset : offset + count])
+            else:
+                # Stretch extends outside of exonic blocks
+                pieces.append(None)
+                missing.append(i)
+        if missing:
+            for i, piece in zip(
+                missing,
+                self.bowtie_reference_index.get_stretches(
+                    self.chrom, [stretches[i] for i in missing]
+                ),
+            ):
+                pieces[i] = piece
+        return pieces
 
     def reset(self, reference=False):
         """Resets to last save point or reference (i.e., removes all edits).
@@ -717,9 +1135,9 @@ class Transcript(object):
                 deletion_size = int(seq)
             except ValueError:
                 deletion_size = len(seq)
-                ref_deletion = self.bowtie_reference_index.get_stretch(
-                    self.chrom, pos - 1, pos + deletion_size + 1 - pos - 1
-                )
+                ref_deletion = self._reference_stretches(
+                    [(pos - 1, pos + deletion_size + 1 - pos - 1)]
+                )[0]
                 if (bisect.bisect_left(self.intervals, pos - 2) % 2) and (
                     bisect.bisect_left(self.intervals, pos + deletion_size - 2) % 2
                 ):
@@ -791,9 +1209,9 @@ class Transcript(object):
                     (
                         self.chrom,
                         pos,
-                        self.bowtie_reference_index.get_stretch(
-                            self.chrom, pos - 1, pos + deletion_size + 1 - pos - 1
-                        ),
+                        self._reference_stretches(
+                            [(pos - 1, pos + deletion_size + 1 - pos - 1)]
+                        )[0],
                         "",
                         mutation_type,
                         vaf,
@@ -852,9 +1270,7 @@ class Transcript(object):
                     )
                 )
         elif mutation_type == "V":
-            reference_seq = self.bowtie_reference_index.get_stretch(
-                self.chrom, pos - 1, len(seq)
-            )
+            reference_seq = self._reference_stretches([(pos - 1, len(seq))])[0]
             other_snvs = [edit for edit in self.edits[pos - 1] if edit[1] == "V"]
             if mutation_class not in [snv[2] for snv in other_snvs]:
                 self.edits[pos - 1].append(
@@ -1537,18 +1953,20 @@ class Transcript(object):
                         del new_edits[intervals[i][0]]"""
                 i += 2
             # Grab reference sequence to pull from
-            seqs = []
-            for i in range(0, len(intervals), 2):
-                seqs.append(
-                    (
-                        self.bowtie_reference_index.get_stretch(
-                            self.chrom,
-                            intervals[i][0] + 1,
-                            intervals[i + 1][0] - intervals[i][0],
-                        ),
-                        (intervals[i][0] + 2, intervals[i + 1][0] + 1),
-                    )
+            seqs = list(
+                zip(
+                    self._reference_stretches(
+                        [
+                            (intervals[i][0] + 1, intervals[i + 1][0] - intervals[i][0])
+                            for i in range(0, len(intervals), 2)
+                        ]
+                    ),
+                    [
+                        (intervals[i][0] + 2, intervals[i + 1][0] + 1)
+                        for i in range(0, len(intervals), 2)
+                    ],
                 )
+            )
             # Now build sequence in order of increasing edit position
             i = 1
             pos_group, final_seq = [], []
@@ -1615,9 +2033,9 @@ class Transcript(object):
                                 ):
                                     # More reference sequence is needed to fill in - use snv for this
                                     snv = (
-                                        self.bowtie_reference_index.get_stretch(
-                                            self.chrom, edit[3][1] - 1, 1
-                                        ),
+                                        self._reference_stretches(
+                                            [(edit[3][1] - 1, 1)]
+                                        )[0],
                                         "R",
                                         tuple(),
                                         edit[3][1],
@@ -1942,26 +2360,27 @@ class Transcript(object):
     def _build_sequences(
         self, annotated_sequence, strand, include_somatic, include_germline
     ):
-        """Builds alternative and reference sequences and dictionaries linking their
+        """Builds alternative and reference sequences and maps linking their
         transcript-level coordinates to genomic coordinates
 
         annotated_seq: output of the annotated_seq() method, above
         strand: -1 for reverse strand transcript, 1 for forward strand
 
         Return value: alternative transcript sequence, reference transcript sequence,
-            dictionary linking genomic coordinates (1-based) to reference
-            transcript coordinates (0-based), dictionary linking genomic coordinates
+            mapping linking genomic coordinates (1-based) to reference
+            transcript coordinates (0-based), mapping linking genomic coordinates
             (1-based) to alternative transcript coordinates (0-based),
-            dictionary linking reference transcript coordinates (0-based), to
-            genomic coordinates (1-based), dictionary linking alternative transcript
-            coordinates (0-based), to genomic coordinates (1-based)
+            mapping linking reference transcript coordinates (0-based), to
+            genomic coordinates (1-based), mapping linking alternative transcript
+            coordinates (0-based), to genomic coordinates (1-based); mappings
+            are _CoordinateMap objects
         """
         counter, ref_counter = 0, 0  # hold edited transcript level coordinates
         genome_to_alt, genome_to_ref, alt_to_genome, ref_to_genome = (
-            {},
-            {},
-            {},
-            {},
+            _CoordinateMap(),
+            _CoordinateMap(),
+            _CoordinateMap(),
+            _CoordinateMap(),
         )  # hold coordinate linkers
         mut_to_ref_counter, mut_to_alt_counter = (
             {},
@@ -1977,19 +2396,10 @@ class Transcript(object):
                 sequence += seq[0]
                 ref_sequence += seq[0]
                 # Link coordinates
-                genomic_positions = [seq[3] + (i * strand) for i in range(len(seq[0]))]
-                transcriptomic_positions = [counter + i for i in range(len(seq[0]))]
-                ref_transcriptomic_positions = [
-                    ref_counter + i for i in range(len(seq[0]))
-                ]
-                multiassign(
-                    genome_to_ref, genomic_positions, ref_transcriptomic_positions
-                )
-                multiassign(genome_to_alt, genomic_positions, transcriptomic_positions)
-                multiassign(
-                    ref_to_genome, ref_transcriptomic_positions, genomic_positions
-                )
-                multiassign(alt_to_genome, transcriptomic_positions, genomic_positions)
+                genome_to_ref.add_run(seq[3], strand, ref_counter, 1, len(seq[0]))
+                genome_to_alt.add_run(seq[3], strand, counter, 1, len(seq[0]))
+                ref_to_genome.add_run(ref_counter, 1, seq[3], strand, len(seq[0]))
+                alt_to_genome.add_run(counter, 1, seq[3], strand, len(seq[0]))
                 # Update counters
                 counter += len(seq[0])
                 ref_counter += len(seq[0])
@@ -2004,27 +2414,23 @@ class Transcript(object):
                     ref_sequence += seq[2][1][3]
                 # Link ref and genomic coordinates
                 deleted_length = len("".join([x[2] for x in seq[2][1][4]]))
-                genomic_positions = [
-                    (seq[3] + ((deleted_length - 1) * self.rev_strand)) + (i * strand)
-                    for i in range(deleted_length)
-                ]
-                multiassign(
-                    genome_to_ref,
-                    genomic_positions,
-                    [ref_counter for i in range(deleted_length)],
+                genome_to_ref.add_run(
+                    seq[3] + ((deleted_length - 1) * self.rev_strand),
+                    strand,
+                    ref_counter,
+                    0,
+                    deleted_length,
                 )
                 # Add variants to ref tree
                 ref_tree[seq[3] : seq[3] + deleted_length] = seq[2][1][4]
                 # Link alt and genomic coordinates
                 deleted_length = len(seq[2][0][2])
-                genomic_positions = [
-                    (seq[3] + ((deleted_length - 1) * self.rev_strand)) + (i * strand)
-                    for i in range(deleted_length)
-                ]
-                multiassign(
-                    genome_to_alt,
-                    genomic_positions,
-                    [counter for i in range(deleted_length)],
+                genome_to_alt.add_run(
+                    seq[3] + ((deleted_length - 1) * self.rev_strand),
+                    strand,
+                    counter,
+                    0,
+                    deleted_length,
                 )
                 # Add variants to alt tree
                 alt_tree[seq[3] : seq[3] + deleted_length] = seq[2][0][4]
@@ -2056,33 +2462,22 @@ class Transcript(object):
                         else:
                             ref_sequence += var[2]
                         # Link coordinates
-                        # genomic_positions = [var[1] + (i*strand) for i in range(len(var[2]))]
-                        genomic_positions = [
-                            (var[1] + ((len(var[2]) - 1) * self.rev_strand))
-                            + (i * strand)
-                            for i in range(len(var[2]))
-                        ]
-                        transcriptomic_positions = [
-                            ref_counter + i for i in range(len(var[2]))
-                        ]
-                        multiassign(
-                            genome_to_ref, genomic_positions, transcriptomic_positions
+                        genomic_start = var[1] + ((len(var[2]) - 1) * self.rev_strand)
+                        genome_to_ref.add_run(
+                            genomic_start, strand, ref_counter, 1, len(var[2])
                         )
-                        multiassign(
-                            ref_to_genome, transcriptomic_positions, genomic_positions
+                        ref_to_genome.add_run(
+                            ref_counter, 1, genomic_start, strand, len(var[2])
                         )
                         # Update counter
                         ref_counter += len(var[2])
                     # Update alternative coordinates
-                    genomic_positions = [
-                        (seq[3] + ((deleted_length - 1) * self.rev_strand))
-                        + (i * strand)
-                        for i in range(deleted_length)
-                    ]
-                    multiassign(
-                        genome_to_alt,
-                        genomic_positions,
-                        [counter for i in range(deleted_length)],
+                    genome_to_alt.add_run(
+                        seq[3] + ((deleted_length - 1) * self.rev_strand),
+                        strand,
+                        counter,
+                        0,
+                        deleted_length,
                     )
                     # Update alt tree
                     alt_tree[seq[3] : seq[3] + deleted_length] = seq[2]
@@ -2094,19 +2489,12 @@ class Transcript(object):
                     )
                 else:
                     # Update ref coordinates only
-                    genomic_positions = [
-                        seq[3] + ((deleted_length - 1) * self.rev_strand) + (i * strand)
-                        for i in range(deleted_length)
-                    ]
-                    multiassign(
-                        genome_to_ref,
-                        genomic_positions,
-                        [ref_counter for i in range(deleted_length)],
+                    genomic_start = seq[3] + ((deleted_length - 1) * self.rev_strand)
+                    genome_to_ref.add_run(
+                        genomic_start, strand, ref_counter, 0, deleted_length
                     )
-                    multiassign(
-                        genome_to_alt,
-                        genomic_positions,
-                        [counter for i in range(deleted_length)],
+                    genome_to_alt.add_run(
+                        genomic_start, strand, counter, 0, deleted_length
                     )
                     # Update ref tree
                     ref_tree[seq[3] : seq[3] + deleted_length] = seq[2]
@@ -2114,12 +2502,7 @@ class Transcript(object):
                 # Add sequence to new transcript
                 sequence += seq[0]
                 # Link coordinates
-                transcriptomic_positions = [counter + i for i in range(len(seq[0]))]
-                multiassign(
-                    alt_to_genome,
-                    transcriptomic_positions,
-                    [seq[3] for i in range(len(seq[0]))],
-                )
+                alt_to_genome.add_run(counter, 1, seq[3], 0, len(seq[0]))
                 # Update alt tree
                 alt_tree[seq[3] : seq[3] + 1] = seq[2]
                 # Update alt counter info
@@ -2136,14 +2519,7 @@ class Transcript(object):
                     # Add sequence to reference transcript
                     ref_sequence += seq[0]
                     # Link coordinates
-                    transcriptomic_positions = [
-                        ref_counter + i for i in range(len(seq[0]))
-                    ]
-                    multiassign(
-                        ref_to_genome,
-                        transcriptomic_positions,
-                        [seq[3] for i in range(len(seq[0]))],
-                    )
+                    ref_to_genome.add_run(ref_counter, 1, seq[3], 0, len(seq[0]))
                     # Update ref tree
                     ref_tree[seq[3] : seq[3] + 1] = seq[2]
                     # Update counter
@@ -2169,19 +2545,10 @@ class Transcript(object):
                         for i in seq[2]:
                             ref_sequence += i[2]
                 # Link coordinates
-                genomic_positions = [seq[3] + (i * strand) for i in range(len(seq[0]))]
-                transcriptomic_positions = [counter + i for i in range(len(seq[0]))]
-                ref_transcriptomic_positions = [
-                    ref_counter + i for i in range(len(seq[0]))
-                ]
-                multiassign(
-                    genome_to_ref, genomic_positions, ref_transcriptomic_positions
-                )
-                multiassign(genome_to_alt, genomic_positions, transcriptomic_positions)
-                multiassign(
-                    ref_to_genome, ref_transcriptomic_positions, genomic_positions
-                )
-                multiassign(alt_to_genome, transcriptomic_positions, genomic_positions)
+                genome_to_ref.add_run(seq[3], strand, ref_counter, 1, len(seq[0]))
+                genome_to_alt.add_run(seq[3], strand, counter, 1, len(seq[0]))
+                ref_to_genome.add_run(ref_counter, 1, seq[3], strand, len(seq[0]))
+                alt_to_genome.add_run(counter, 1, seq[3], strand, len(seq[0]))
                 # Update alt trees
                 if self.rev_strand:
                     alt_tree[seq[3] - len(seq[0]) : seq[3]] = seq[2]
@@ -2214,6 +2581,180 @@ class Transcript(object):
             mut_to_alt_counter,
         )
 
+    def reference_protein(self):
+        """Translates reference sequence between annotated start and stop codons.
+        Edits are ignored.
+        Return value: tuple (digest of reference coding sequence from
+            reference_digest(), protein), or None if transcript lacks an
+            annotated start or stop codon
+        """
+        if self.start_codon is None or self.stop_codon is None:
+            return None
+        strand = 1 - self.rev_strand * 2
+        ref_sequence, genome_to_ref = itemgetter(1, 2)(
+            self._build_sequences(
+                self.annotated_seq(include_somatic=0, include_germline=0),
+                strand=strand,
+                include_somatic=0,
+                include_germline=0,
+            )
+        )
+        try:
+            ref_tx_start = genome_to_ref[self.start_codon] - 2 * self.rev_strand
+            ref_tx_stop = genome_to_ref[self.stop_codon] - 2 * self.rev_strand
+        except KeyError:
+            return None
+        ref_cds = ref_sequence[ref_tx_start:ref_tx_stop]
+        protein, _ = seq_to_peptide(
+            ref_cds, reverse_strand=False, mitochondrial=self.mitochondrial
+        )
+        return reference_digest(ref_cds), protein
+
+    def _translate_codons(self, seq, first, last, allow_partial_codons=False):
+        """Translates a run of codons of a sequence as seq_to_peptide() would
+        translate them as part of the whole sequence
+        seq: nucleotide sequence
+        first: index of first codon
+        last: index of codon after last codon; the last codon may be partial
+        allow_partial_codons: attempt to translate partial codons at ends of
+            transcripts
+        Return value: peptide string
+        """
+        if last <= first:
+            return ""
+        if first:
+            # Translate one more codon so that it, rather than the first
+            # codon of the run, is the one recoded as M for mitochondria
+            return seq_to_peptide(
+                seq[first * 3 - 3 : last * 3],
+                mitochondrial=self.mitochondrial,
+                allow_partial_codons=allow_partial_codons,
+            )[0][1:]
+        return seq_to_peptide(
+            seq[: last * 3],
+            mitochondrial=self.mitochondrial,
+            allow_partial_codons=allow_partial_codons,
+        )[0]
+
+    def _translate(self, seq, allow_partial_codons=False, purpose="alt", fallback=None):
+        """Translates sequence as seq_to_peptide() does, reusing the
+        translation of the last sequence translated for the same purpose (or
+        for the fallback purpose, if none was or if only the fallback
+        sequence has the same length).
+        If the two sequences have the same length, e.g. when they differ only
+        by SNVs, only blocks of codons that differ are translated; otherwise,
+        only codons between their longest common prefix and (if both are made
+        of whole codons) suffix are translated, so frameshifts and edits to
+        start codons fall back to translating most of the sequence.
+        seq: nucleotide sequence
+        allow_partial_codons: attempt to translate partial codons at ends of
+            transcripts
+        purpose: name of slot in which translation is kept, e.g. "alt" or
+            "reference"
+        fallback: name of slot to reuse if purpose's is less similar, or None
+        Return value: peptide string, list of peptide warnings
+        """
+        candidates = [
+            previous
+            for previous in [
+                self.translations.get(purpose),
+                self.translations.get(fallback),
+            ]
+            if previous is not None and previous[0] == allow_partial_codons
+        ]
+        if not candidates or not seq:
+            protein, protein_warnings = seq_to_peptide(
+                seq,
+                reverse_strand=False,
+                mitochondrial=self.mitochondrial,
+                allow_partial_codons=allow_partial_codons,
+            )
+            self.translations[purpose] = (allow_partial_codons, seq, protein)
+            return protein, protein_warnings
+        previous_seq, previous_protein = candidates[0][1], candidates[0][2]
+        for candidate in candidates[1:]:
+            if len(previous_seq) != len(seq) and len(candidate[1]) == len(seq):
+                previous_seq, previous_protein = candidate[1], candidate[2]
+        protein_warnings = ["incomplete_CDS"] if len(seq) % 3 else []
+        if seq == previous_seq:
+            self.translations[purpose] = (allow_partial_codons, seq, previous_protein)
+            return previous_protein, protein_warnings
+        if len(seq) == len(previous_seq):
+            # Search for blocks of codons that differ by halving, since
+            # slices are compared in C
+            pieces, reused = [], 0
+            blocks = [(0, (len(seq) + 2) // 3)]
+            while blocks:
+                first, last = blocks.pop()
+                if seq[first * 3 : last * 3] == previous_seq[first * 3 : last * 3]:
+                    continue
+                if last - first > _translation_block_size:
+                    middle = (first + last) // 2
+                    blocks.extend([(middle, last), (first, middle)])
+                    continue
+                pieces.append(previous_protein[reused:first])
+                pieces.append(
+                    self._translate_codons(seq, first, last, allow_partial_codons)
+                )
+                reused = last
+            pieces.append(previous_protein[reused:])
+            protein = "".join(pieces)
+        else:
+            prefix = _common_prefix_length(seq, previous_seq) // 3
+            suffix = 0
+            if not len(seq) % 3 and not len(previous_seq) % 3:
+                # Codons are only shared in the same frame; the previous first
+                # codon is excluded, since it may have been recoded as M
+                max_suffix = min(len(seq) // 3 - prefix, len(previous_seq) // 3 - 1)
+                suffix = _common_suffix_length(seq, previous_seq, max_suffix * 3) // 3
+            protein = "".join(
+                [
+                    previous_protein[:prefix],
+                    self._translate_codons(
+                        seq,
+                        prefix,
+                        (len(seq) + 2) // 3 - suffix,
+                        allow_partial_codons,
+                    ),
+                    previous_protein[len(previous_protein) - suffix :],
+                ]
+            )
+        if self.mitochondrial and protein[0] != "M":
+            protein = "M" + protein[1:]
+        self.translations[purpose] = (allow_partial_codons, seq, protein)
+        return protein, protein_warnings
+
+    def _translate_reference(
+        self, ref_cds, reference_protein=None, allow_partial_codons=False
+    ):
+        """Translates reference sequence used for comparison with edited
+        transcript, reusing a precomputed protein if it was translated from
+        the same sequence.
+        ref_cds: reference coding sequence
+        reference_protein: output of the reference_protein() method, above,
+            or None
+        allow_partial_codons: attempt to translate partial codons at ends of
+            transcripts
+        Return value: protein
+        """
+        if (
+            reference_protein is not None
+            and (not allow_partial_codons or not len(ref_cds) % 3)
+            and reference_protein[0] == reference_digest(ref_cds)
+        ):
+            if len(ref_cds) % 3 == 0 and len(ref_cds) // 3 == len(reference_protein[1]):
+                # Edited transcripts are translated from this protein
+                self.translations["reference"] = (
+                    allow_partial_codons,
+                    ref_cds,
+                    reference_protein[1],
+                )
+            return reference_protein[1]
+        protein, _ = self._translate(
+            ref_cds, allow_partial_codons=allow_partial_codons, purpose="reference"
+        )
+        return protein
+
     def neopeptides(
         self,
         min_size=8,
@@ -2226,6 +2767,7 @@ class Transcript(object):
         return_protein=False,
         allow_no_edits=False,
         allow_partial_codons=False,
+        reference_protein=None,
     ):
         """Retrieves dict of predicted peptide fragments from transcript that
         arise from one or more variants.
@@ -2239,6 +2781,9 @@ class Transcript(object):
             1 = exclude germline mutations from reference comparison,
             2 = include germline mutations in both annotated sequence and
             reference comparison
+        reference_protein: precomputed output of the reference_protein()
+            method, above, used in place of translating the reference
+            sequence when it is unchanged; None to always translate
         Return value: dict of peptides of desired length(s) [KEYS] with
             values equivalent to a list of causal variants [VALUES].
         """
@@ -2412,10 +2957,7 @@ class Transcript(object):
                     ref_to_genome[atg + 2],
                 ]
                 ref_genome_seq = "".join(
-                    [
-                        self.bowtie_reference_index.get_stretch(self.chrom, x - 1, 1)
-                        for x in genome_pos
-                    ]
+                    self._reference_stretches([(x - 1, 1) for x in genome_pos])
                 )
                 if self.rev_strand:
                     ref_genome_seq = ref_genome_seq[::-1].translate(
@@ -2752,10 +3294,7 @@ class Transcript(object):
                 ]
                 # Check novelty
                 ref_genome_seq = "".join(
-                    [
-                        self.bowtie_reference_index.get_stretch(self.chrom, x - 1, 1)
-                        for x in genome_pos
-                    ]
+                    self._reference_stretches([(x - 1, 1) for x in genome_pos])
                 )
                 if self.rev_strand:
                     ref_genome_seq = ref_genome_seq[::-1].translate(
@@ -3243,36 +3782,34 @@ class Transcript(object):
                 else:
                     break
         try:
-            protein, protein_warnings = seq_to_peptide(
-                sequence[start_codon[0] : stop_codon[0]],
-                reverse_strand=False,
-                mitochondrial=self.mitochondrial,
-                allow_partial_codons=allow_partial_codons,
-            )
-        except TypeError:
-            protein, protein_warnings = seq_to_peptide(
-                sequence[start_codon[0] :],
-                reverse_strand=False,
-                mitochondrial=self.mitochondrial,
-                allow_partial_codons=allow_partial_codons,
-            )
-        try:
-            protein_ref, ref_warnings = seq_to_peptide(
+            protein_ref = self._translate_reference(
                 ref_sequence[ref_atg[1] : ref_stop[1]],
-                reverse_strand=False,
-                mitochondrial=self.mitochondrial,
+                reference_protein=reference_protein,
                 allow_partial_codons=allow_partial_codons,
             )
         except TypeError:
             try:
-                protein_ref, ref_warnings = seq_to_peptide(
+                protein_ref = self._translate_reference(
                     ref_sequence[ref_atg[1] :],
-                    reverse_strand=False,
-                    mitochondrial=self.mitochondrial,
+                    reference_protein=reference_protein,
                     allow_partial_codons=allow_partial_codons,
                 )
             except TypeError:
                 protein_ref = ""
+        # Translate edited sequence from reference protein, so that only
+        # codons changed by in-frame edits are translated
+        try:
+            protein, protein_warnings = self._translate(
+                sequence[start_codon[0] : stop_codon[0]],
+                allow_partial_codons=allow_partial_codons,
+                fallback="reference",
+            )
+        except TypeError:
+            protein, protein_warnings = self._translate(
+                sequence[start_codon[0] :],
+                allow_partial_codons=allow_partial_codons,
+                fallback="reference",
+            )
         # Check for unknown amino acids
         if "?" in protein or "?" in protein_ref or "X" in protein or "X" in protein_ref:
             unknown_aa = True
@@ -3282,12 +3819,12 @@ class Transcript(object):
         else:
             transcript_warnings.extend(protein_warnings)
             transcript_warnings = (";".join(transcript_warnings),)
-        # Enumerate peptides
-        peptide_seqs = collections.defaultdict(list)
+        # Enumerate peptides, collecting mutation data in sets
+        peptide_seqs = collections.defaultdict(set)
+        peptides_ref = reference_kmer_index(protein_ref, min_size)
         # get amino acid ranges for kmerization
         for size in range(min_size, max_size + 1):
             epitope_coords = []
-            peptides_ref = kmerize_peptide(protein_ref, min_size=size, max_size=size)
             for coords in coordinates:
                 if coords[4] != "NA" and same_start_frame:
                     # Get coordinates of paired normal peptide
@@ -3325,21 +3862,20 @@ class Transcript(object):
                     ]
                 )
             for coords in epitope_coords:
-                peptides = kmerize_peptide(
-                    protein[coords[0] : coords[1]], min_size=size, max_size=size
-                )
+                window = protein[coords[0] : coords[1]]
+                peptides = (window[i : i + size] for i in range(len(window) - size + 1))
                 if coords[2] != "NA":
-                    paired_peptides = kmerize_peptide(
-                        protein_ref[coords[2] : coords[3]], min_size=size, max_size=size
-                    )
-                    if len(paired_peptides) == len(peptides):
-                        peptide_pairs = zip(peptides, paired_peptides)
-                    else:
-                        peptide_pairs = zip(
-                            peptides, ["NA" for j in range(0, len(peptides))]
+                    paired_window = protein_ref[coords[2] : coords[3]]
+                    if len(paired_window) == len(window):
+                        paired_peptides = (
+                            paired_window[i : i + size]
+                            for i in range(len(paired_window) - size + 1)
                         )
-                    for pair in peptide_pairs:
+                    else:
+                        paired_peptides = itertools.repeat("NA")
+                    for pair in zip(peptides, paired_peptides):
                         if pair[0] not in peptides_ref:
+                            mutations = peptide_seqs[pair[0]]
                             if len(coords[4]) == 2 and type(coords[4][0]) == list:
                                 # Dealing with peptide resulting from hybrid interval
                                 data_set = coords[4][0][4]
@@ -3385,11 +3921,11 @@ class Transcript(object):
                                     mutation_data = (
                                         mutation_data + (pair[1],) + transcript_warnings
                                     )
-                                peptide_seqs[pair[0]].append(mutation_data)
-                            peptide_seqs[pair[0]] = list(set(peptide_seqs[pair[0]]))
+                                mutations.add(mutation_data)
                 else:
-                    peptides = list(set(peptides).difference(peptides_ref))
+                    peptides = set(pep for pep in peptides if pep not in peptides_ref)
                     for pep in peptides:
+                        mutations = peptide_seqs[pep]
                         if len(coords[4]) == 2 and type(coords[4][0]) == list:
                             # Dealing with peptide resulting from hybrid interval
                             data_set = coords[4][0][4]
@@ -3429,8 +3965,10 @@ class Transcript(object):
                                 mutation_data = (
                                     mutation_data + ("NA",) + transcript_warnings
                                 )
-                            peptide_seqs[pep].append(mutation_data)
-                        peptide_seqs[pep] = list(set(peptide_seqs[pep]))
+                            mutations.add(mutation_data)
+        peptide_seqs = collections.defaultdict(
+            list, ((pep, list(mutations)) for pep, mutations in peptide_seqs.items())
+        )
         if not return_protein:
             # return list of unique neoepitope sequences
             return peptide_seqs
@@ -3439,103 +3977,225 @@ class Transcript(object):
             return peptide_seqs, protein
 
 
-def gtf_to_cds(gtf_file, dictdir, pickle_it=True):
-    """References cds_dict to get cds bounds for later Bowtie query
-    Keys in the dictionary are transcript IDs, while entries are lists of
-        relevant CDS/stop codon data
-        Data: [chromosome, sequence type, start, stop,
-                +/- strand, transcript type]
-    Writes cds_dict as a pickled dictionary
-    gtf_file: input gtf file to process
-    dictdir: path to directory to store pickled dicts
-    Return value: dictionaries
+# GTF feature types read by gtf_to_cds()
+_gtf_feature_types = frozenset(
+    ["exon", "start_codon", "stop_codon", "CDS", "transcript"]
+)
+# Transcript types whose blocks are stored by gtf_to_cds()
+_indexed_transcript_types = frozenset(
+    [
+        "protein_coding",
+        "nonsense_mediated_decay",
+        "polymorphic_pseudogene",
+        "IG_V_gene",
+        "TR_V_gene",
+    ]
+)
+_transcript_id_expr = re.compile(r'transcript_id "([A-Z0-9._]+)";')
+_transcript_type_expr = re.compile(r'transcript_type "([A-Za-z_]+)";')
+_gene_id_expr = re.compile(r'gene_id "([A-Z0-9._]+)";')
+_gene_name_expr = re.compile(r'gene_name "([A-Za-z0-9._-]+)";')
+_tag_expr = re.compile(r'tag "([A-Za-z0-9_]+)"')
+_support_level_expr = re.compile(r'transcript_support_level "([0-9A-Z]+)";')
+# Lines of a compressed GTF parsed by each task when indexing in parallel
+_gtf_lines_per_task = 100000
+
+
+def _gtf_attribute(attribute_expr, attributes):
+    """Extracts the value of a GTF attribute
+
+    attribute_expr: compiled regular expression matching the attribute,
+        with its value as the only group
+    attributes: attribute column of a GTF line
+
+    Return value: value of the last match, or all of attributes if there is
+        no match
+    """
+    values = attribute_expr.findall(attributes)
+    if values:
+        return values[-1]
+    return attributes
+
+
+def _parse_gtf_lines(lines):
+    """Collects blocks, CDS lines, and transcript data from lines of a GTF
+
+    lines: iterable of lines of a GTF, as strings or bytes
+
+    Return value: tuple of (dictionary linking transcript IDs to lists of
+        blocks, dictionary linking transcript IDs to lists of tokenized CDS
+        lines, dictionary linking transcript IDs to transcript data), each
+        in order of appearance
     """
     cds_dict = collections.defaultdict(list)
     cds_lines = collections.defaultdict(list)
     tx_data_dict = collections.defaultdict(list)
-    # Parse GTF to obtain CDS/stop codon info
-    with xopen(None, gtf_file) as f:
-        for line in f:
-            try:
-                line = line.decode("ascii")
-            except AttributeError:
-                # it's a string
-                pass
-            if line[0] != "#":
-                tokens = line.strip().split("\t")
-                if tokens[2] in ["exon", "start_codon", "stop_codon"]:
-                    transcript_id = re.sub(
-                        r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    transcript_type = re.sub(
-                        r".*transcript_type \"([A-Za-z_]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    if transcript_type in [
-                        "protein_coding",
-                        "nonsense_mediated_decay",
-                        "polymorphic_pseudogene",
-                        "IG_V_gene",
-                        "TR_V_gene",
-                    ]:
-                        # Create new dictionary entry for new transcripts
-                        cds_dict[transcript_id].append(
-                            [
-                                tokens[0],
-                                tokens[2],
-                                int(tokens[3]),
-                                int(tokens[4]),
-                                tokens[6],
-                                transcript_type,
-                            ]
-                        )
-                elif tokens[2] == "CDS":
-                    transcript_id = re.sub(
-                        r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    cds_lines[transcript_id].append(tokens)
-                elif tokens[2] == "transcript":
-                    transcript_id = re.sub(
-                        r".*transcript_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    transcript_type = re.sub(
-                        r".*transcript_type \"([A-Za-z_]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    gene_id = re.sub(
-                        r".*gene_id \"([A-Z0-9._]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    gene_name = re.sub(
-                        r".*gene_name \"([A-Za-z0-9._-]+)\"[;].*", r"\1", tokens[8]
-                    )
-                    tag_expr = re.compile('tag "([A-Za-z0-9_]+)"')
-                    tags = tag_expr.findall(tokens[8])
-                    tsl = None
-                    support_level = re.sub(
-                        r".*transcript_support_level \"([0-9A-Z]+)\"[;].*",
-                        r"\1",
-                        tokens[8],
-                    )
-                    try:
-                        tsl = int(support_level)
-                    except ValueError:
-                        if support_level == "NA":
-                            tsl = "NA"
-                    if transcript_type in [
-                        "protein_coding",
-                        "nonsense_mediated_decay",
-                        "polymorphic_pseudogene",
-                        "IG_V_gene",
-                        "TR_V_gene",
-                    ]:
-                        tx_data_dict[transcript_id] = [
-                            transcript_type,
-                            gene_id,
-                            gene_name,
-                            tags,
-                            tsl,
-                        ]
+    transcript_ids = _transcript_id_expr.findall
+    transcript_types = _transcript_type_expr.findall
+    for line in lines:
+        if not isinstance(line, str):
+            line = line.decode("utf-8")
+        if line[0] == "#":
+            continue
+        tokens = line.strip().split("\t")
+        feature_type = tokens[2]
+        # Skip genes, UTRs, etc. before scanning attributes
+        if feature_type not in _gtf_feature_types:
+            continue
+        attributes = tokens[8]
+        # Block and CDS lines far outnumber transcript lines, so attributes
+        # are extracted inline as by _gtf_attribute()
+        if feature_type == "CDS":
+            # Attributes are not needed to infer faux start/stop codons
+            values = transcript_ids(attributes)
+            cds_lines[values[-1] if values else attributes].append(tokens[:8])
+            continue
+        values = transcript_types(attributes)
+        transcript_type = values[-1] if values else attributes
+        if transcript_type not in _indexed_transcript_types:
+            continue
+        values = transcript_ids(attributes)
+        transcript_id = values[-1] if values else attributes
+        if feature_type != "transcript":
+            # Create new dictionary entry for new transcripts
+            cds_dict[transcript_id].append(
+                [
+                    tokens[0],
+                    feature_type,
+                    int(tokens[3]),
+                    int(tokens[4]),
+                    tokens[6],
+                    transcript_type,
+                ]
+            )
+            continue
+        tsl = None
+        support_level = _gtf_attribute(_support_level_expr, attributes)
+        try:
+            tsl = int(support_level)
+        except ValueError:
+            if support_level == "NA":
+                tsl = "NA"
+        tx_data_dict[transcript_id] = [
+            transcript_type,
+            _gtf_attribute(_gene_id_expr, attributes),
+            _gtf_attribute(_gene_name_expr, attributes),
+            _tag_expr.findall(attributes),
+            tsl,
+        ]
+    return cds_dict, cds_lines, tx_data_dict
+
+
+def _parse_gtf_range(task):
+    """Parses the lines of an uncompressed GTF that begin in a byte range
+
+    task: tuple of (path to GTF, start of range, end of range); ranges
+        are half-open
+
+    Return value: return value of _parse_gtf_lines()
+    """
+    gtf_file, start, end = task
+
+    def range_lines():
+        with open(gtf_file, "rb") as gtf_stream:
+            position = start
+            if start:
+                # Skip the line that begins in the previous range
+                gtf_stream.seek(start - 1)
+                position += len(gtf_stream.readline()) - 1
+            while position < end:
+                line = gtf_stream.readline()
+                if not line:
+                    break
+                position += len(line)
+                yield line
+
+    return _parse_gtf_lines(range_lines())
+
+
+def _gtf_line_batches(gtf_stream):
+    """Splits lines of a GTF into batches
+
+    gtf_stream: file object of GTF
+
+    Yield value: list of lines
+    """
+    batch = []
+    for line in gtf_stream:
+        batch.append(line)
+        if len(batch) == _gtf_lines_per_task:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parse_gtf(gtf_file, processes=1):
+    """Parses a GTF, in parallel if more than one process is used
+    With more than one process, an uncompressed GTF is split into byte
+        ranges that are parsed in parallel (lines of a compressed GTF are
+        decompressed serially and parsed in parallel); dictionaries are
+        identical to those of a serial run
+    gtf_file: input gtf file to process
+    processes: number of processes to use
+    Return value: tuple of dictionaries from _parse_gtf_lines()
+    """
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes=processes)
+    try:
+        # Parse GTF to obtain CDS/stop codon info
+        with xopen(None, gtf_file) as f:
+            if pool is None:
+                cds_dict, cds_lines, tx_data_dict = _parse_gtf_lines(f)
+                parsed_chunks = []
+            elif isinstance(f, io.TextIOBase):
+                size = os.path.getsize(gtf_file)
+                step = max(size // (processes * 4), 1)
+                parsed_chunks = pool.imap(
+                    _parse_gtf_range,
+                    [
+                        (gtf_file, start, min(start + step, size))
+                        for start in range(0, size, step)
+                    ],
+                )
+            else:
+                parsed_chunks = pool.imap(_parse_gtf_lines, _gtf_line_batches(f))
+            if pool is not None:
+                cds_dict = collections.defaultdict(list)
+                cds_lines = collections.defaultdict(list)
+                tx_data_dict = collections.defaultdict(list)
+            # Merge chunks in file order, preserving order of appearance
+            for chunk_cds, chunk_cds_lines, chunk_tx_data in parsed_chunks:
+                for transcript_id, blocks in chunk_cds.items():
+                    cds_dict[transcript_id].extend(blocks)
+                for transcript_id, lines in chunk_cds_lines.items():
+                    cds_lines[transcript_id].extend(lines)
+                for transcript_id, tx_data in chunk_tx_data.items():
+                    if tx_data[4] == "NA":
+                        # Share string among transcripts as a serial run does,
+                        # so that pickled dictionaries are identical
+                        tx_data[4] = "NA"
+                    tx_data_dict[transcript_id] = tx_data
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return cds_dict, cds_lines, tx_data_dict
+
+
+def _add_faux_codons(cds_dict, cds_lines, transcript_ids):
+    """Sorts CDS blocks of transcripts, infers start and stop codons that are
+        not annotated, and removes redundant annotated codons
+    cds_dict: CDS dictionary from _parse_gtf(); modified in place
+    cds_lines: CDS lines dictionary from _parse_gtf()
+    transcript_ids: iterable of IDs of transcripts to process
+    Return value: set of IDs of incompletely annotated transcripts, which
+        should be removed from cds_dict
+    """
     # Sort cds_dict coordinates (left -> right) for each transcript
     delete_txs = set()
-    for transcript_id, tx_data in cds_dict.items():
+    for transcript_id in transcript_ids:
         current_cds = cds_lines[transcript_id]
         cds_dict[transcript_id].sort(key=lambda x: x[0])
         seq_types = [x[1] for x in cds_dict[transcript_id]]
@@ -3734,6 +4394,99 @@ def gtf_to_cds(gtf_file, dictdir, pickle_it=True):
                 for block in stop_codon_blocks:
                     if int(block[2]) != min_stop:
                         cds_dict[transcript_id].remove(block)
+    return delete_txs
+
+
+def _transcript_hash(blocks, lines, tx_data):
+    """Computes digest of the GTF content parsed for a transcript; every
+        entry derived for the transcript by neoepiscope index depends only
+        on this content (and the reference genome)
+    blocks: transcript's entry in CDS dictionary from _parse_gtf(), before
+        start and stop codons are processed
+    lines: transcript's entry in CDS lines dictionary from _parse_gtf()
+    tx_data: transcript's entry in transcript data dictionary from
+        _parse_gtf(), or None
+    Return value: 16-byte digest
+    """
+    return hashlib.blake2b(
+        repr((blocks, lines, tx_data)).encode("utf-8"), digest_size=16
+    ).digest()
+
+
+def _load_index_pickle(dictdir, name):
+    """Loads a pickled dictionary written by neoepiscope index
+    dictdir: path to directory containing pickled dicts
+    name: file name of pickled dictionary
+    Return value: dictionary, or None if it does not exist
+    """
+    pickle_path = os.path.join(dictdir, name)
+    if not os.path.isfile(pickle_path):
+        return None
+    with open(pickle_path, "rb") as pickle_stream:
+        return pickle.load(pickle_stream)
+
+
+def gtf_to_cds(gtf_file, dictdir, pickle_it=True, processes=1, previous_dictdir=None):
+    """References cds_dict to get cds bounds for later Bowtie query
+    Keys in the dictionary are transcript IDs, while entries are lists of
+        relevant CDS/stop codon data
+        Data: [chromosome, sequence type, start, stop,
+                +/- strand, transcript type]
+    Writes cds_dict as a pickled dictionary, along with a digest of each
+        transcript's GTF content (see changed_transcripts())
+    With more than one process, an uncompressed GTF is split into byte
+        ranges that are parsed in parallel (lines of a compressed GTF are
+        decompressed serially and parsed in parallel); dictionaries are
+        identical to those of a serial run
+    If previous_dictdir is provided, start and stop codons are only
+        processed for transcripts whose GTF content differs from that
+        indexed in previous_dictdir; other transcripts' entries are copied
+        from the previous index
+    gtf_file: input gtf file to process
+    dictdir: path to directory to store pickled dicts
+    processes: number of processes to use
+    previous_dictdir: path to directory of pickled dicts from an earlier
+        run of neoepiscope index, or None
+    Return value: dictionaries
+    """
+    cds_dict, cds_lines, tx_data_dict = _parse_gtf(gtf_file, processes=processes)
+    transcript_hashes = {
+        transcript_id: _transcript_hash(
+            blocks, cds_lines.get(transcript_id), tx_data_dict.get(transcript_id)
+        )
+        for transcript_id, blocks in cds_dict.items()
+    }
+    previous_hashes, previous_cds = None, None
+    if previous_dictdir is not None:
+        previous_hashes = _load_index_pickle(
+            previous_dictdir, "transcript_to_hash.pickle"
+        )
+        previous_cds = _load_index_pickle(previous_dictdir, "transcript_to_CDS.pickle")
+        if previous_hashes is None or previous_cds is None:
+            warnings.warn(
+                "".join(
+                    [
+                        "Cannot find transcript hashes and CDS dictionary in ",
+                        previous_dictdir,
+                        "; processing all transcripts",
+                    ]
+                ),
+                Warning,
+            )
+            previous_hashes, previous_cds = None, None
+    if previous_hashes is None:
+        delete_txs = _add_faux_codons(cds_dict, cds_lines, list(cds_dict.keys()))
+    else:
+        changed_txs, delete_txs = [], set()
+        for transcript_id, transcript_hash in transcript_hashes.items():
+            if previous_hashes.get(transcript_id) != transcript_hash:
+                changed_txs.append(transcript_id)
+            elif transcript_id in previous_cds:
+                cds_dict[transcript_id] = previous_cds[transcript_id]
+            else:
+                # Transcript was incompletely annotated in previous index
+                delete_txs.add(transcript_id)
+        delete_txs.update(_add_faux_codons(cds_dict, cds_lines, changed_txs))
     for transcript_id in delete_txs:
         del cds_dict[transcript_id]
     # Write to pickled dictionary
@@ -3744,9 +4497,31 @@ def gtf_to_cds(gtf_file, dictdir, pickle_it=True):
         pickle_dict2 = os.path.join(dictdir, "transcript_to_gene_info.pickle")
         with open(pickle_dict2, "wb") as f:
             pickle.dump(tx_data_dict, f)
+        pickle_dict3 = os.path.join(dictdir, "transcript_to_hash.pickle")
+        with open(pickle_dict3, "wb") as f:
+            pickle.dump(transcript_hashes, f)
     return cds_dict, tx_data_dict
 
 
+def changed_transcripts(dictdir, previous_dictdir):
+    """Finds transcripts whose GTF content differs between two indexes
+    dictdir: path to directory of pickled dicts written by gtf_to_cds()
+    previous_dictdir: path to directory of pickled dicts from an earlier
+        run of neoepiscope index
+    Return value: set of IDs of transcripts that were added, removed, or
+        changed, or None if either index lacks transcript hashes
+    """
+    transcript_hashes = _load_index_pickle(dictdir, "transcript_to_hash.pickle")
+    previous_hashes = _load_index_pickle(previous_dictdir, "transcript_to_hash.pickle")
+    if transcript_hashes is None or previous_hashes is None:
+        return None
+    changed_txs = set(transcript_hashes.keys()) ^ set(previous_hashes.keys())
+    for transcript_id, transcript_hash in transcript_hashes.items():
+        if previous_hashes.get(transcript_id, transcript_hash) != transcript_hash:
+            changed_txs.add(transcript_id)
+    return changed_txs
+
+
 def cds_to_feature_length(cds_dict, tx_data_dict, dictdir, pickle_it=True):
     """Creates a dictionary linking gene ID to gene length
     Gene length is median length of all isoforms
@@ -3776,33 +4551,54 @@ def cds_to_feature_length(cds_dict, tx_data_dict, dictdir, pickle_it=True):
     return feature_to_feature_length
 
 
-def cds_to_tree(cds_dict, dictdir, pickle_it=True):
+def cds_to_tree(cds_dict, dictdir, pickle_it=True, previous_dictdir=None, changed=None):
     """Creates searchable tree of chromosome intervals from CDS dictionary
-    Each chromosome is stored in the dictionary as an interval tree object
+    Each chromosome is stored in the dictionary as a ContigIntervals object
         Intervals are added for each CDS, with the associated transcript ID
         Assumes transcript is all on one chromosome - does not work for
             gene fusions
     Writes the searchable tree as a pickled dictionary
+    If previous_dictdir and changed are provided, the tree in
+        previous_dictdir is updated with intervals of changed transcripts
     cds_dict: CDS dictionary produced by gtf_to_cds()
+    previous_dictdir: path to directory of pickled dicts from an earlier
+        run of neoepiscope index, or None
+    changed: set of transcript IDs from changed_transcripts(), or None
     Return value: searchable tree
     """
-    searchable_tree = {}
+    previous_tree = None
+    if previous_dictdir is not None and changed is not None:
+        previous_tree = _load_index_pickle(
+            previous_dictdir, "intervals_to_transcript.pickle"
+        )
+        if previous_tree is not None and not all(
+            isinstance(contig_tree, ContigIntervals)
+            for contig_tree in previous_tree.values()
+        ):
+            # Trees from older indexes are rebuilt
+            previous_tree = None
+    contig_intervals = collections.defaultdict(list)
     # Add genomic intervals to the tree for each transcript
     for transcript_id in cds_dict:
+        if previous_tree is not None and transcript_id not in changed:
+            continue
         transcript = cds_dict[transcript_id]
         chrom = transcript[0][0]
-        # Add new entry for chromosome if not already encountered
-        if chrom not in searchable_tree:
-            searchable_tree[chrom] = IntervalTree()
         # Add CDS interval to tree with transcript ID
         for cds in transcript:
             start = cds[2]
             stop = cds[3] + 1
             # Interval coordinates are inclusive of start, exclusive of stop
             if stop > start:
-                searchable_tree[chrom][start:stop] = transcript_id
+                contig_intervals[chrom].append((start, stop, transcript_id))
             # else:
             # report an error?
+    if previous_tree is None:
+        searchable_tree = build_interval_index(contig_intervals)
+    else:
+        searchable_tree = update_interval_index(
+            previous_tree, contig_intervals, changed
+        )
     # Write to pickled dictionary
     if pickle_it:
         pickle_dict = os.path.join(dictdir, "intervals_to_transcript.pickle")
@@ -3811,23 +4607,84 @@ def cds_to_tree(cds_dict, dictdir, pickle_it=True):
     return searchable_tree
 
 
+def cds_to_reference_proteome(
+    cds_dict,
+    tx_data_dict,
+    reference_index,
+    dictdir,
+    pickle_it=True,
+    previous_dictdir=None,
+    changed=None,
+):
+    """Creates a dictionary linking transcript IDs to reference proteins
+    Proteins are translated from the reference sequence between each
+        transcript's annotated start and stop codons, and are stored with a
+        digest of that sequence so that they are only reused when the
+        reference sequence compared against an edited transcript matches
+    Writes the proteome as a pickled dictionary
+    If previous_dictdir and changed are provided, proteins of unchanged
+        transcripts are copied from the proteome in previous_dictdir; their
+        digests are still checked against the reference sequence when they
+        are used, so a proteome indexed for another genome build is safe,
+        if unhelpful
+    cds_dict: CDS dictionary produced by gtf_to_cds()
+    tx_data_dict: transcript data dictionary produced by gtf_to_cds()
+    reference_index: BowtieIndexReference object for retrieving
+        reference genome sequence
+    previous_dictdir: path to directory of pickled dicts from an earlier
+        run of neoepiscope index, or None
+    changed: set of transcript IDs from changed_transcripts(), or None
+    Return value: dictionary, keys are transcript IDs, values are outputs of
+        Transcript.reference_protein()
+    """
+    previous_proteome = None
+    if previous_dictdir is not None and changed is not None:
+        previous_proteome = _load_index_pickle(
+            previous_dictdir, "transcript_to_reference_protein.pickle"
+        )
+    proteome = {}
+    for transcript_id in cds_dict:
+        if previous_proteome is not None and transcript_id not in changed:
+            if transcript_id in previous_proteome:
+                proteome[transcript_id] = previous_proteome[transcript_id]
+            continue
+        transcript = _transcript_to_object(
+            reference_index,
+            cds_dict[transcript_id],
+            transcript_id,
+            tx_data_dict[transcript_id],
+        )
+        reference_protein = transcript.reference_protein()
+        if reference_protein is not None:
+            proteome[transcript_id] = reference_protein
+    # Write to pickled dictionary
+    if pickle_it:
+        pickle_dict = os.path.join(dictdir, "transcript_to_reference_protein.pickle")
+        with open(pickle_dict, "wb") as f:
+            pickle.dump(proteome, f)
+    return proteome
+
+
 def get_transcripts_from_tree(chrom, start, stop, cds_tree):
     """Uses cds tree to btain transcript IDs from genomic coordinates
 
     chrom: (String) Specify chrom to use for transcript search.
     start: (Int) Specify start position to use for transcript search.
     stop: (Int) Specify ending position to use for transcript search
-    cds_tree: (Dict) dictionary of IntervalTree() objects containing
-        transcript IDs as function of exon coords indexed by chr/contig ID.
+    cds_tree: (Dict) dictionary of ContigIntervals (or IntervalTree) objects
+        containing transcript IDs as function of exon coords indexed by
+        chr/contig ID.
 
-    Return value: (set) a set of matching unique transcript IDs.
+    Return value: (list) a list of matching unique transcript IDs.
     """
-    transcript_ids = set()
     # Interval coordinates are inclusive of start, exclusive of stop
     if chrom not in cds_tree:
         return []
-    cds = list(cds_tree[chrom].overlap(start, stop))
-    for cd in cds:
+    tree = cds_tree[chrom]
+    if isinstance(tree, ContigIntervals):
+        return tree.overlapping_transcripts(start, stop)
+    transcript_ids = set()
+    for cd in tree.overlap(start, stop):
         transcript_ids.add(cd.data)
     return list(transcript_ids)
 
@@ -3885,57 +4742,231 @@ def add_mut_to_haplotype_block(alternative, contig):
             )
 
 
-def process_haplotypes(hapcut_output, interval_dict, phasing):
-    """Stores all haplotypes relevant to different transcripts as a dictionary
+def _hapcut_line_to_variants(tokens):
+    """Splits a variant line from HapCUT2 output into simple variants
+    tokens: tab-separated fields of the HapCUT2 variant line
+    Return value: list with one entry per alternative allele considered,
+        each a list of [pos, ref, alt, end, mutation_type, gen1, gen2] lists
+        (complex indels yield a deletion followed by an insertion)
+    """
+    allele_variants = []
+    if "," in tokens[6]:
+        alternatives = tokens[6].split(",")
+    else:
+        alternatives = [tokens[6]]
+    for i in range(0, min(len(alternatives), 2)):
+        variants_to_process = []
+        if alternatives[i] == "<DEL>" or alternatives[i] == "*":
+            mutation_type = "D"
+            pos = int(tokens[4])
+            deletion_size = len(tokens[5])
+            ref = tokens[5]
+            alt = deletion_size
+            end = pos + deletion_size
+            variants_to_process.append([pos, ref, alt, end, mutation_type])
+        elif len(tokens[5]) == len(alternatives[i]):
+            mutation_type = "V"
+            pos = int(tokens[4])
+            ref = tokens[5]
+            alt = alternatives[i]
+            mut_size = len(tokens[5])
+            end = pos + mut_size
+            variants_to_process.append([pos, ref, alt, end, mutation_type])
+        elif len(tokens[5]) > len(alternatives[i]):
+            if tokens[5].startswith(alternatives[i]):
+                # Simple deletion
+                mutation_type = "D"
+                deletion_size = len(tokens[5]) - len(alternatives[i])
+                pos = int(tokens[4]) + (len(tokens[5]) - deletion_size)
+                ref = tokens[5][len(alternatives[i]) :]
+                alt = deletion_size
+                end = pos + deletion_size
+                variants_to_process.append([pos, ref, alt, end, mutation_type])
+            else:
+                # Complex indel
+                # Add deletion first
+                mutation_type = "D"
+                pos = int(tokens[4])
+                ref = tokens[5]
+                alt = len(tokens[5])
+                end = pos + alt
+                variants_to_process.append([pos, ref, alt, end, mutation_type])
+                # Then add insertion
+                mutation_type = "I"
+                pos = int(tokens[4]) + len(tokens[5]) - 1
+                ref = ""
+                alt = alternatives[i]
+                end = pos + 1
+                variants_to_process.append([pos, ref, alt, end, mutation_type])
+        elif len(tokens[5]) < len(alternatives[i]):
+            if alternatives[i].startswith(tokens[5]):
+                # Simple insertion
+                mutation_type = "I"
+                insertion_size = len(alternatives[i]) - len(tokens[5])
+                pos = int(tokens[4]) + len(tokens[5]) - 1
+                ref = ""
+                alt = alternatives[i][len(tokens[5]) :]
+                end = pos + 1
+                variants_to_process.append([pos, ref, alt, end, mutation_type])
+            else:
+                # Complex indel - add deletion first
+                mutation_type = "D"
+                pos = int(tokens[4])
+                ref = tokens[5]
+                alt = len(tokens[5])
+                end = pos + alt
+                variants_to_process.append([pos, ref, alt, end, mutation_type])
+                # Then add insertion
+                mutation_type = "I"
+                pos = int(tokens[4]) + len(tokens[5]) - 1
+                ref = ""
+                alt = alternatives[i]
+                end = pos + 1
+                variants_to_process.append((pos, ref, alt, end, mutation_type))
+        # Determine which haplotype carries the allele
+        if len(alternatives) > 1:
+            if i == 0:
+                if tokens[1] == "1":
+                    gen1 = "1"
+                    gen2 = "0"
+                else:
+                    gen1 = "0"
+                    gen2 = "1"
+            elif i == 1:
+                if tokens[1] == "2":
+                    gen1 = "1"
+                    gen2 = "0"
+                else:
+                    gen1 = "0"
+                    gen2 = "1"
+        else:
+            gen1 = tokens[1]
+            gen2 = tokens[2]
+        allele_variants.append(
+            [list(variant) + [gen1, gen2] for variant in variants_to_process]
+        )
+    return allele_variants
+
+
+def _haplotypes_from_records(records, queries, interval_dict, phasing):
+    """Groups parsed HapCUT2 variants into haplotypes for each transcript
+    records: list of (contig, genotype info, variants) tuples for variant
+        lines, with None marking the end of each block
+    queries: list of (contig, start, stop) tuples for all variants in records,
+        in order
+    interval_dict: dictionary linking genomic intervals to transcripts
+    phasing: whether to phase mutations (boolean)
+    Return value: tuple of dictionaries linking transcripts to haplotypes
+        and to homozygous variants
+    """
+    affected_transcripts = collections.defaultdict(list)
+    homozygous_variants = collections.defaultdict(list)
+    overlapping = iter(get_transcripts_from_tree_batch(queries, interval_dict))
+    block_transcripts = collections.defaultdict(list)
+    block_complex_pairs = []
+    for record in records:
+        if record is None:
+            # Process all transcripts for the block
+            for transcript_id in block_transcripts:
+                block_transcripts[transcript_id].sort(key=itemgetter(1))
+                if phasing:
+                    haplotype = []
+                    for mut in block_transcripts[transcript_id]:
+                        haplotype.append(mut)
+                    affected_transcripts[transcript_id].append(haplotype)
+                else:
+                    paired_muts = []
+                    # First add mutations broken down from complex indels as haplotypes
+                    for pair in block_complex_pairs:
+                        affected_transcripts[transcript_id].append(pair)
+                        paired_muts.extend(pair)
+                    # Then add simple mutations as their own haplotypes
+                    for mut in block_transcripts[transcript_id]:
+                        if mut not in paired_muts:
+                            affected_transcripts[transcript_id].append([mut])
+            # Reset transcript dictionary
+            block_transcripts = collections.defaultdict(list)
+            block_complex_pairs = []
+            continue
+        # Add mutation to transcript dictionary for the block
+        contig, genotype_info, allele_variants = record
+        for variants in allele_variants:
+            # Store complex variants together if relevant
+            complex_pairs = []
+            for (pos, ref, alt, end, mutation_type, gen1, gen2) in variants:
+                overlapping_transcripts = next(overlapping)
+                mutation = [
+                    contig,
+                    pos,
+                    ref,
+                    alt,
+                    gen1,
+                    gen2,
+                    genotype_info,
+                    mutation_type,
+                ]
+                if not phasing or gen1 != gen2:
+                    # For each overlapping transcript, add mutation entry
+                    # Contains chromosome, position, reference, alternate, allele
+                    #   A, allele B, genotype line from VCF
+                    for transcript in overlapping_transcripts:
+                        block_transcripts[transcript].append(list(mutation))
+                        complex_pairs.append(list(mutation))
+                else:
+                    for transcript in overlapping_transcripts:
+                        homozygous_variants[transcript].append(list(mutation))
+            # Store complex pairs if the variant was complex
+            if len(complex_pairs) > 1:
+                complex_pairs.sort(key=itemgetter(1))
+                block_complex_pairs.append(complex_pairs)
+    return affected_transcripts, homozygous_variants
+
+
+def iterate_haplotype_blocks(hapcut_output, interval_dict, phasing, block_buffer=None):
+    """Yields haplotypes relevant to different transcripts for successive
+        groups of blocks from HapCUT2 output, so that a file can be processed
+        without holding all of its haplotypes in memory
     hapcut_output: output from HAPCUT2, adjusted to include unphased
                     mutations as their own haplotypes (performed in
                     software's prep mode)
     interval_dict: dictionary linking genomic intervals to transcripts
     phasing: whether to phase mutations (boolean)
-    Return value: dictinoary linking haplotypes to transcripts
+    block_buffer: maximum number of blocks per group, or None to process
+        the whole file as one group
+    Yield value: tuple of dictionaries linking transcripts to haplotypes
+        and to homozygous variants for a group of blocks
     """
     chr_in_intervals = False
     for contig in interval_dict:
         if "chr" in contig:
             chr_in_intervals = True
             continue
-    affected_transcripts = collections.defaultdict(list)
-    homozygous_variants = collections.defaultdict(list)
+    # Parse variants for a group of blocks before finding overlapping
+    # transcripts for all of them in one batch
+    records = []
+    queries = []
+    block_count = 0
     try:
         if hapcut_output == "-":
             input_stream = sys.stdin
         else:
             input_stream = open(hapcut_output)
-        block_transcripts = collections.defaultdict(list)
-        block_complex_pairs = []
         for line in input_stream:
             if line.startswith("BLOCK"):
                 # Skip block header lines
                 continue
             elif line[0] == "*":
-                # Process all transcripts for the block
-                for transcript_id in block_transcripts:
-                    block_transcripts[transcript_id].sort(key=itemgetter(1))
-                    if phasing:
-                        haplotype = []
-                        for mut in block_transcripts[transcript_id]:
-                            haplotype.append(mut)
-                        affected_transcripts[transcript_id].append(haplotype)
-                    else:
-                        paired_muts = []
-                        # First add mutations broken down from complex indels as haplotypes
-                        for pair in block_complex_pairs:
-                            affected_transcripts[transcript_id].append(pair)
-                            paired_muts.extend(pair)
-                        # Then add simple mutations as their own haplotypes
-                        for mut in block_transcripts[transcript_id]:
-                            if mut not in paired_muts:
-                                affected_transcripts[transcript_id].append([mut])
-                # Reset transcript dictionary
-                block_transcripts = collections.defaultdict(list)
-                block_complex_pairs = []
+                # Mark end of block
+                records.append(None)
+                block_count += 1
+                if block_buffer is not None and block_count >= block_buffer:
+                    yield _haplotypes_from_records(
+                        records, queries, interval_dict, phasing
+                    )
+                    records = []
+                    queries = []
+                    block_count = 0
             else:
-                # Add mutation to transcript dictionary for the block
                 tokens = line.strip("\n").split()
                 contig = tokens[3]
                 if (
@@ -3944,165 +4975,36 @@ def process_haplotypes(hapcut_output, interval_dict, phasing):
                     and "".join(["chr", contig]) in interval_dict
                 ):
                     contig = "chr" + contig
-                if "," in tokens[6]:
-                    alternatives = tokens[6].split(",")
-                else:
-                    alternatives = [tokens[6]]
-                for i in range(0, min(len(alternatives), 2)):
-                    variants_to_process = []
-                    if alternatives[i] == "<DEL>" or alternatives[i] == "*":
-                        mutation_type = "D"
-                        pos = int(tokens[4])
-                        deletion_size = len(tokens[5])
-                        ref = tokens[5]
-                        alt = deletion_size
-                        end = pos + deletion_size
-                        variants_to_process.append([pos, ref, alt, end, mutation_type])
-                    elif len(tokens[5]) == len(alternatives[i]):
-                        mutation_type = "V"
-                        pos = int(tokens[4])
-                        ref = tokens[5]
-                        alt = alternatives[i]
-                        mut_size = len(tokens[5])
-                        end = pos + mut_size
-                        variants_to_process.append([pos, ref, alt, end, mutation_type])
-                    elif len(tokens[5]) > len(alternatives[i]):
-                        if tokens[5].startswith(alternatives[i]):
-                            # Simple deletion
-                            mutation_type = "D"
-                            deletion_size = len(tokens[5]) - len(alternatives[i])
-                            pos = int(tokens[4]) + (len(tokens[5]) - deletion_size)
-                            ref = tokens[5][len(alternatives[i]) :]
-                            alt = deletion_size
-                            end = pos + deletion_size
-                            variants_to_process.append(
-                                [pos, ref, alt, end, mutation_type]
-                            )
-                        else:
-                            # Complex indel
-                            # Add deletion first
-                            mutation_type = "D"
-                            pos = int(tokens[4])
-                            ref = tokens[5]
-                            alt = len(tokens[5])
-                            end = pos + alt
-                            variants_to_process.append(
-                                [pos, ref, alt, end, mutation_type]
-                            )
-                            # Then add insertion
-                            mutation_type = "I"
-                            pos = int(tokens[4]) + len(tokens[5]) - 1
-                            ref = ""
-                            alt = alternatives[i]
-                            end = pos + 1
-                            variants_to_process.append(
-                                [pos, ref, alt, end, mutation_type]
-                            )
-                    elif len(tokens[5]) < len(alternatives[i]):
-                        if alternatives[i].startswith(tokens[5]):
-                            # Simple insertion
-                            mutation_type = "I"
-                            insertion_size = len(alternatives[i]) - len(tokens[5])
-                            pos = int(tokens[4]) + len(tokens[5]) - 1
-                            ref = ""
-                            alt = alternatives[i][len(tokens[5]) :]
-                            end = pos + 1
-                            variants_to_process.append(
-                                [pos, ref, alt, end, mutation_type]
-                            )
-                        else:
-                            # Complex indel - add deletion first
-                            mutation_type = "D"
-                            pos = int(tokens[4])
-                            ref = tokens[5]
-                            alt = len(tokens[5])
-                            end = pos + alt
-                            variants_to_process.append(
-                                [pos, ref, alt, end, mutation_type]
-                            )
-                            # Then add insertion
-                            mutation_type = "I"
-                            pos = int(tokens[4]) + len(tokens[5]) - 1
-                            ref = ""
-                            alt = alternatives[i]
-                            end = pos + 1
-                            variants_to_process.append(
-                                (pos, ref, alt, end, mutation_type)
-                            )
-                    # Store complex variants together if relevant
-                    complex_pairs = []
-                    for (pos, ref, alt, end, mutation_type) in variants_to_process:
-                        if len(alternatives) > 1:
-                            if i == 0:
-                                if tokens[1] == "1":
-                                    gen1 = "1"
-                                    gen2 = "0"
-                                else:
-                                    gen1 = "0"
-                                    gen2 = "1"
-                            elif i == 1:
-                                if tokens[1] == "2":
-                                    gen1 = "1"
-                                    gen2 = "0"
-                                else:
-                                    gen1 = "0"
-                                    gen2 = "1"
-                        else:
-                            gen1 = tokens[1]
-                            gen2 = tokens[2]
-                        overlapping_transcripts = get_transcripts_from_tree(
-                            contig, pos, end, interval_dict
-                        )
-                        if not phasing or gen1 != gen2:
-                            # For each overlapping transcript, add mutation entry
-                            # Contains chromosome, position, reference, alternate, allele
-                            #   A, allele B, genotype line from VCF
-                            for transcript in overlapping_transcripts:
-                                block_transcripts[transcript].append(
-                                    [
-                                        contig,
-                                        pos,
-                                        ref,
-                                        alt,
-                                        gen1,
-                                        gen2,
-                                        tokens[7],
-                                        mutation_type,
-                                    ]
-                                )
-                                complex_pairs.append(
-                                    [
-                                        contig,
-                                        pos,
-                                        ref,
-                                        alt,
-                                        gen1,
-                                        gen2,
-                                        tokens[7],
-                                        mutation_type,
-                                    ]
-                                )
-                        else:
-                            for transcript in overlapping_transcripts:
-                                homozygous_variants[transcript].append(
-                                    [
-                                        contig,
-                                        pos,
-                                        ref,
-                                        alt,
-                                        gen1,
-                                        gen2,
-                                        tokens[7],
-                                        mutation_type,
-                                    ]
-                                )
-                    # Store complex pairs if the variant was complex
-                    if len(complex_pairs) > 1:
-                        complex_pairs.sort(key=itemgetter(1))
-                        block_complex_pairs.append(complex_pairs)
+                allele_variants = _hapcut_line_to_variants(tokens)
+                records.append((contig, tokens[7], allele_variants))
+                for variants in allele_variants:
+                    for variant in variants:
+                        queries.append((contig, variant[0], variant[3]))
+        if records:
+            yield _haplotypes_from_records(records, queries, interval_dict, phasing)
     finally:
         if input_stream is not sys.stdin:
             input_stream.close()
+
+
+def process_haplotypes(hapcut_output, interval_dict, phasing):
+    """Stores all haplotypes relevant to different transcripts as a dictionary
+    hapcut_output: output from HAPCUT2, adjusted to include unphased
+                    mutations as their own haplotypes (performed in
+                    software's prep mode)
+    interval_dict: dictionary linking genomic intervals to transcripts
+    phasing: whether to phase mutations (boolean)
+    Return value: dictinoary linking haplotypes to transcripts
+    """
+    affected_transcripts = collections.defaultdict(list)
+    homozygous_variants = collections.defaultdict(list)
+    for block_transcripts, block_homozygous in iterate_haplotype_blocks(
+        hapcut_output, interval_dict, phasing
+    ):
+        for transcript_id in block_transcripts:
+            affected_transcripts[transcript_id].extend(block_transcripts[transcript_id])
+        for transcript_id in block_homozygous:
+            homozygous_variants[transcript_id].extend(block_homozygous[transcript_id])
     return affected_transcripts, homozygous_variants
 
 
@@ -4203,6 +5105,232 @@ def get_haplotype_cliques(haplotype):
     return list(nx.find_cliques(graph))
 
 
+def _transcript_to_object(reference_index, cds, transcript_id, info):
+    """Creates a Transcript object from a transcript's CDS dictionary entry
+
+    reference_index: BowtieIndexReference object for retrieving
+        reference genome sequence
+    cds: list of CDS blocks for the transcript; entry from gtf_to_cds()
+    transcript_id: transcript ID
+    info: transcript information; entry from gtf_to_cds()
+
+    Return value: Transcript object
+    """
+    seleno = False
+    if "seleno" in info[3]:
+        seleno = True
+    return Transcript(
+        reference_index,
+        [
+            [str(chrom), "blah", seq_type, str(start), str(end), ".", strand]
+            for (chrom, seq_type, start, end, strand, tx_type) in cds
+        ],
+        transcript_id,
+        seleno,
+    )
+
+
+def _edit_transcript(transcript, mutation, vaf_pos):
+    """Applies a mutation from process_haplotypes() to a transcript
+
+    transcript: Transcript object
+    mutation: list of [chromosome, position, reference allele,
+        alternate allele, presence on DNA copy 1 (0/1), presence on DNA copy
+        2 (0/1), variant information from VCF, variant type ('V', 'D', or 'I')]
+    vaf_pos: position of VAF in VCF mutation data from HapCUT2
+
+    No return value.
+    """
+    # Determine if mutation is somatic or germline
+    if mutation[6][-1] == "*":
+        mutation_class = "G"
+    else:
+        mutation_class = "S"
+    # Determine VAF if available
+    vaf = None
+    if vaf_pos is not None and mutation_class == "S":
+        vaf_entry = mutation[6].strip("*").split(":")[vaf_pos[0]]
+        if "," in vaf_entry:
+            vaf_entry = [x for x in vaf_entry.split(",") if x != "."]
+            if len(vaf_entry) > 0:
+                vaf = sum([float(x.strip("%")) for x in vaf_entry]) / len(vaf_entry)
+                if vaf_pos[1] == "FREQ":
+                    vaf = vaf / 100.0
+        else:
+            if vaf_entry.strip("%") != ".":
+                vaf = float(vaf_entry.strip("%"))
+                if vaf_pos[1] == "FREQ":
+                    vaf = vaf / 100.0
+    # Determine which copies variant exists on & make edits
+    transcript.edit(
+        mutation[3],
+        mutation[1],
+        mutation_type=mutation[7],
+        mutation_class=mutation_class,
+        vaf=vaf,
+    )
+
+
+def _store_neopeptides(
+    transcript, options, peptide_records, proteins, reference_protein=None
+):
+    """Extracts neoepitopes from an edited transcript
+
+    transcript: Transcript object with edits applied
+    options: dictionary of neopeptide settings built by
+        get_peptides_from_transcripts()
+    peptide_records: list of (peptide, metadata) tuples to extend
+    proteins: list of full-length proteins to extend
+    reference_protein: precomputed reference protein for the transcript;
+        entry from cds_to_reference_proteome(), or None
+
+    No return value.
+    """
+    peptides, protein = transcript.neopeptides(
+        min_size=options["size_list"][0],
+        max_size=options["size_list"][-1],
+        include_somatic=options["include_somatic"],
+        include_germline=options["include_germline"],
+        only_novel_upstream=options["only_novel_upstream"],
+        only_downstream=options["only_downstream"],
+        only_reference=options["only_reference"],
+        allow_partial_codons=options["allow_partial_codons"],
+        return_protein=True,
+        reference_protein=reference_protein,
+    )
+    for pep in peptides:
+        for meta_data in peptides[pep]:
+            peptide_records.append((pep, meta_data + (transcript.transcript_id,)))
+    if options["protein_fasta"]:
+        if len(peptides) > 0 and protein != "":
+            proteins.append(protein)
+
+
+def _haplotype_neoepitopes(
+    reference_index,
+    transcript_id,
+    cds,
+    info,
+    haplotypes,
+    homozygous,
+    options,
+    reference_protein=None,
+):
+    """Enumerates neoepitopes from the haplotypes affecting one transcript
+
+    reference_index: BowtieIndexReference object for retrieving
+        reference genome sequence
+    transcript_id: transcript ID
+    cds: list of CDS blocks for the transcript; entry from gtf_to_cds()
+    info: transcript information; entry from gtf_to_cds()
+    haplotypes: list of haplotypes affecting the transcript; entry from
+        process_haplotypes()
+    homozygous: list of homozygous variants affecting the transcript
+    options: dictionary of neopeptide settings built by
+        get_peptides_from_transcripts()
+    reference_protein: precomputed reference protein for the transcript;
+        entry from cds_to_reference_proteome(), or None
+
+    Return value: tuple of (list of (peptide, metadata) tuples, list of
+        full-length proteins), both in order of enumeration
+    """
+    peptide_records, proteins = [], []
+    # One Transcript object serves all cliques, so each clique's proteins are
+    # translated incrementally from the last clique's (see Transcript._translate())
+    transcript_a = _transcript_to_object(reference_index, cds, transcript_id, info)
+    # Iterate over haplotypes associated with this transcript
+    for ht in haplotypes:
+        # Add homozygous variants on affected transcript
+        ht.extend(homozygous)
+        # Find maximal cliques
+        cliques = get_haplotype_cliques(ht)
+        for c in cliques:
+            # Make edits for each mutation
+            for mutation in c:
+                _edit_transcript(transcript_a, mutation, options["vaf_pos"])
+            # Extract neoepitopes
+            _store_neopeptides(
+                transcript_a, options, peptide_records, proteins, reference_protein
+            )
+            transcript_a.reset(reference=True)
+    return peptide_records, proteins
+
+
+def _homozygous_neoepitopes(
+    reference_index,
+    transcript_id,
+    cds,
+    info,
+    homozygous,
+    options,
+    reference_protein=None,
+):
+    """Enumerates neoepitopes from homozygous variants affecting one transcript
+
+    reference_index: BowtieIndexReference object for retrieving
+        reference genome sequence
+    transcript_id: transcript ID
+    cds: list of CDS blocks for the transcript; entry from gtf_to_cds()
+    info: transcript information; entry from gtf_to_cds()
+    homozygous: list of homozygous variants affecting the transcript that
+        were not already applied alongside a haplotype
+    options: dictionary of neopeptide settings built by
+        get_peptides_from_transcripts()
+    reference_protein: precomputed reference protein for the transcript;
+        entry from cds_to_reference_proteome(), or None
+
+    Return value: tuple of (list of (peptide, metadata) tuples, list of
+        full-length proteins), both in order of enumeration
+    """
+    peptide_records, proteins = [], []
+    transcript_a = _transcript_to_object(reference_index, cds, transcript_id, info)
+    for mutation in homozygous:
+        # Make edits
+        _edit_transcript(transcript_a, mutation, options["vaf_pos"])
+        # Extract neoepitopes
+        _store_neopeptides(
+            transcript_a, options, peptide_records, proteins, reference_protein
+        )
+        transcript_a.reset(reference=True)
+    return peptide_records, proteins
+
+
+# Reference index opened by each worker process of get_peptides_from_transcripts()
+_worker_reference_index = None
+
+
+def _init_peptide_worker(idx_prefix, annotation_server=None):
+    """Opens a worker's own memory-mapped reference index, or its own
+    connection to an annotation server
+
+    idx_prefix: path to reference; Bowtie index prefix, 2bit file, or
+        indexed FASTA file (see open_reference())
+    annotation_server: path to annotation server's Unix socket, or None to
+        open reference locally
+
+    No return value.
+    """
+    global _worker_reference_index
+    if annotation_server is not None:
+        client = connect_annotation_server(annotation_server)
+        if client is not None:
+            _worker_reference_index = client.reference
+            return
+    _worker_reference_index = open_reference(idx_prefix)
+
+
+def _peptide_worker(task):
+    """Runs one transcript's neoepitope enumeration in a worker process
+
+    task: tuple of (enumeration function, arguments following the
+        reference index)
+
+    Return value: return value of enumeration function
+    """
+    function, args = task
+    return function(_worker_reference_index, *args)
+
+
 def get_peptides_from_transcripts(
     relevant_transcripts,
     homozygous_variants,
@@ -4224,6 +5352,10 @@ def get_peptides_from_transcripts(
     include_germline=2,
     include_somatic=1,
     protein_fasta=False,
+    processes=1,
+    used_homozygous_variants=None,
+    process_homozygous=True,
+    reference_proteome=None,
 ):
     """For transcripts that are affected by a mutation, mutations are applied
     and neoepitopes resulting from mutations are called
@@ -4260,12 +5392,41 @@ def get_peptides_from_transcripts(
     allow_partial_codons: attempt to translate partial codons at ends of transcripts
     protein_fasta: wheather to generate full-length protein sequences
         for fasta file
+    processes: number of worker processes across which to distribute
+        transcripts; each worker reopens the Bowtie index, and results
+        are merged in the same order as a single-process run
+    used_homozygous_variants: set of homozygous variants (as tuples) already
+        applied to haplotypes; updated in place. Pass the same set when
+        processing haplotypes in groups (see iterate_haplotype_blocks())
+    process_homozygous: whether to enumerate neoepitopes from homozygous
+        variants not applied to any haplotype; when processing haplotypes
+        in groups, disable for each group and make a final call with no
+        relevant transcripts
+    reference_proteome: dictionary linking transcript IDs to precomputed
+        reference proteins; output from cds_to_reference_proteome(), or
+        None to translate reference sequences as needed
     return value: dictionary linking neoepitopes to their associated
         metadata
     """
-    neoepitopes = collections.defaultdict(list)
-    fasta_entries = collections.defaultdict(set)
-    used_homozygous_variants = set()
+    options = {
+        "vaf_pos": vaf_pos,
+        "only_novel_upstream": only_novel_upstream,
+        "only_downstream": only_downstream,
+        "only_reference": only_reference,
+        "size_list": size_list,
+        "allow_partial_codons": allow_partial_codons,
+        "include_germline": include_germline,
+        "include_somatic": include_somatic,
+        "protein_fasta": protein_fasta,
+    }
+    tasks = []
+    if used_homozygous_variants is None:
+        used_homozygous_variants = set()
+    if reference_proteome is None:
+        reference_proteome = {}
+    if hasattr(cds_dict, "prefetch"):
+        # Retrieve annotation held by an annotation server in one request
+        cds_dict.prefetch(list(relevant_transcripts) + list(homozygous_variants))
     for affected_transcript in relevant_transcripts:
         # Filter out NMD, polymorphic pseudogene, IG V, TR V transcripts if relevant
         if cds_dict[affected_transcript][0][5] == "nonsense_mediated_decay" and not nmd:
@@ -4287,162 +5448,91 @@ def get_peptides_from_transcripts(
             and not allow_nonstop
         ):
             continue
-        # Create transcript object
-        seleno = False
-        if "seleno" in info_dict[affected_transcript][3]:
-            seleno = True
-        transcript_a = Transcript(
-            reference_index,
-            [
-                [str(chrom), "blah", seq_type, str(start), str(end), ".", strand]
-                for (chrom, seq_type, start, end, strand, tx_type) in cds_dict[
-                    affected_transcript
-                ]
-            ],
-            affected_transcript,
-            seleno,
-        )
-        # Iterate over haplotypes associated with this transcript
+        # Check for homozygous variants on affected transcript
         haplotypes = relevant_transcripts[affected_transcript]
-        for ht in haplotypes:
-            # Check for homozygous variants on affected transcript
-            if affected_transcript in homozygous_variants:
-                for homozygous in homozygous_variants[affected_transcript]:
-                    ht.append(homozygous)
-                    used_homozygous_variants.add(tuple(homozygous))
-            # Find maximal cliques
-            cliques = get_haplotype_cliques(ht)
-            for c in cliques:
-                # Make edits for each mutation
-                for mutation in c:
-                    # Determine if mutation is somatic or germline
-                    if mutation[6][-1] == "*":
-                        mutation_class = "G"
-                    else:
-                        mutation_class = "S"
-                    # Determine VAF if available
-                    vaf = None
-                    if vaf_pos is not None and mutation_class == "S":
-                        vaf_entry = mutation[6].strip("*").split(":")[vaf_pos[0]]
-                        if "," in vaf_entry:
-                            vaf_entry = [x for x in vaf_entry.split(",") if x != "."]
-                            if len(vaf_entry) > 0:
-                                vaf = sum(
-                                    [float(x.strip("%")) for x in vaf_entry]
-                                ) / len(vaf_entry)
-                                if vaf_pos[1] == "FREQ":
-                                    vaf = vaf / 100.0
-                        else:
-                            if vaf_entry.strip("%") != ".":
-                                vaf = float(vaf_entry.strip("%"))
-                                if vaf_pos[1] == "FREQ":
-                                    vaf = vaf / 100.0
-                    # Determine which copies variant exists on & make edits
-                    transcript_a.edit(
-                        mutation[3],
-                        mutation[1],
-                        mutation_type=mutation[7],
-                        mutation_class=mutation_class,
-                        vaf=vaf,
-                    )
-                # Extract neoepitopes
-                peptides, protein = transcript_a.neopeptides(
-                    min_size=size_list[0],
-                    max_size=size_list[-1],
-                    include_somatic=include_somatic,
-                    include_germline=include_germline,
-                    only_novel_upstream=only_novel_upstream,
-                    only_downstream=only_downstream,
-                    only_reference=only_reference,
-                    allow_partial_codons=allow_partial_codons,
-                    return_protein=True,
-                )
-                # Store neoepitopes and their metadata
-                for pep in peptides:
-                    for meta_data in peptides[pep]:
-                        adj_meta_data = meta_data + (transcript_a.transcript_id,)
-                        if adj_meta_data not in neoepitopes[pep]:
-                            neoepitopes[pep].append(adj_meta_data)
-                if protein_fasta:
-                    if len(peptides) > 0 and protein != "":
-                        fasta_entries[affected_transcript].add(protein)
-                transcript_a.reset(reference=True)
-    for transcript in homozygous_variants:
-        # Filter out NMD, polymorphic pseudogene, IG V, TR V transcripts if relevant
-        if cds_dict[transcript][0][5] == "nonsense_mediated_decay" and not nmd:
-            continue
-        elif cds_dict[transcript][0][5] == "polymorphic_pseudogene" and not pp:
-            continue
-        elif cds_dict[transcript][0][5] == "IG_V_gene" and not igv:
-            continue
-        elif cds_dict[transcript][0][5] == "TR_V_gene" and not trv:
-            continue
-        seleno = False
-        if "seleno" in info_dict[transcript][3]:
-            seleno = True
-        transcript_a = Transcript(
-            reference_index,
-            [
-                [str(chrom), "blah", seq_type, str(start), str(end), ".", strand]
-                for (chrom, seq_type, start, end, strand, tx_type) in cds_dict[
-                    transcript
-                ]
-            ],
-            transcript,
-            seleno,
+        homozygous = []
+        if affected_transcript in homozygous_variants and haplotypes:
+            homozygous = homozygous_variants[affected_transcript]
+            used_homozygous_variants.update([tuple(x) for x in homozygous])
+        tasks.append(
+            (
+                affected_transcript,
+                (
+                    _haplotype_neoepitopes,
+                    (
+                        affected_transcript,
+                        cds_dict[affected_transcript],
+                        info_dict[affected_transcript],
+                        haplotypes,
+                        homozygous,
+                        options,
+                        reference_proteome.get(affected_transcript),
+                    ),
+                ),
+            )
         )
-        for mutation in homozygous_variants[transcript]:
-            if tuple(mutation) not in used_homozygous_variants:
-                # Determine if mutation is somatic or germline
-                if mutation[6][-1] == "*":
-                    mutation_class = "G"
-                else:
-                    mutation_class = "S"
-                # Determine VAF if available
-                vaf = None
-                if vaf_pos is not None and mutation_class == "S":
-                    vaf_entry = mutation[6].strip("*").split(":")[vaf_pos[0]]
-                    if "," in vaf_entry:
-                        vaf_entry = [x for x in vaf_entry.split(",") if x != "."]
-                        if len(vaf_entry) > 0:
-                            vaf = sum([float(x.strip("%")) for x in vaf_entry]) / len(
-                                vaf_entry
-                            )
-                            if vaf_pos[1] == "FREQ":
-                                vaf = vaf / 100.0
-                    else:
-                        if vaf_entry.strip("%") != ".":
-                            vaf = float(vaf_entry.strip("%"))
-                            if vaf_pos[1] == "FREQ":
-                                vaf = vaf / 100.0
-                # Make edits
-                transcript_a.edit(
-                    mutation[3],
-                    mutation[1],
-                    mutation_type=mutation[7],
-                    mutation_class=mutation_class,
-                    vaf=vaf,
+    if process_homozygous:
+        for transcript in homozygous_variants:
+            # Filter out NMD, polymorphic pseudogene, IG V, TR V transcripts if relevant
+            if cds_dict[transcript][0][5] == "nonsense_mediated_decay" and not nmd:
+                continue
+            elif cds_dict[transcript][0][5] == "polymorphic_pseudogene" and not pp:
+                continue
+            elif cds_dict[transcript][0][5] == "IG_V_gene" and not igv:
+                continue
+            elif cds_dict[transcript][0][5] == "TR_V_gene" and not trv:
+                continue
+            tasks.append(
+                (
+                    transcript,
+                    (
+                        _homozygous_neoepitopes,
+                        (
+                            transcript,
+                            cds_dict[transcript],
+                            info_dict[transcript],
+                            [
+                                mutation
+                                for mutation in homozygous_variants[transcript]
+                                if tuple(mutation) not in used_homozygous_variants
+                            ],
+                            options,
+                            reference_proteome.get(transcript),
+                        ),
+                    ),
                 )
-                # Extract neoepitopes
-                peptides, protein = transcript_a.neopeptides(
-                    min_size=size_list[0],
-                    max_size=size_list[-1],
-                    include_somatic=include_somatic,
-                    include_germline=include_germline,
-                    only_novel_upstream=only_novel_upstream,
-                    only_downstream=only_downstream,
-                    only_reference=only_reference,
-                    allow_partial_codons=allow_partial_codons,
-                    return_protein=True,
+            )
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(
+            processes=processes,
+            initializer=_init_peptide_worker,
+            initargs=(
+                reference_index.idx_prefix,
+                getattr(reference_index, "annotation_server", None),
+            ),
+        )
+        try:
+            # imap returns results in task order, keeping output deterministic
+            results = list(
+                pool.imap(
+                    _peptide_worker,
+                    [task for _, task in tasks],
+                    chunksize=max(1, len(tasks) // (processes * 4)),
                 )
-                # Store neoepitopes and their metadata
-                for pep in peptides:
-                    for meta_data in peptides[pep]:
-                        adj_meta_data = meta_data + (transcript_a.transcript_id,)
-                        if adj_meta_data not in neoepitopes[pep]:
-                            neoepitopes[pep].append(adj_meta_data)
-                if protein_fasta:
-                    if len(peptides) > 0 and protein != "":
-                        fasta_entries[transcript].add(protein)
-            transcript_a.reset(reference=True)
+            )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [function(reference_index, *args) for _, (function, args) in tasks]
+    # Merge results in enumeration order
+    neoepitopes = collections.defaultdict(list)
+    fasta_entries = collections.defaultdict(set)
+    for (transcript_id, _), (peptide_records, proteins) in zip(tasks, results):
+        # Store neoepitopes and their metadata
+        for pep, adj_meta_data in peptide_records:
+            if adj_meta_data not in neoepitopes[pep]:
+                neoepitopes[pep].append(adj_meta_data)
+        for protein in proteins:
+            fasta_entries[transcript_id].add(protein)
     return neoepitopes, fasta_entries
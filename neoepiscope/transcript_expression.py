@@ -355,7 +355,7 @@ def get_expressed_variants(bam, reference_index, neopeptides, remove_files=True)
     subprocess.check_call(["samtools", "index", new_bam, "".join([new_bam, ".bai"])])
     # Process BAM file
     bam_reader = pysam.AlignmentFile(new_bam, "rb")
-    for contig in reference_index.recs.keys():
+    for contig in reference_index.length.keys():
         # ID contig name
         if contig in bam_reader.references:
             search_contig = copy.copy(contig)
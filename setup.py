@@ -76,13 +76,14 @@ setup(
     license="MIT",
     packages=["neoepiscope"],
     include_package_data=True,
-    package_data={"neoepiscope": ["*.py", "*.pickle"]},
+    package_data={"neoepiscope": ["*.py", "*.pickle", "*.tsv"]},
     zip_safe=True,
     install_requires=[
         "intervaltree==3.0.2",
         "mhcflurry>=2.0.0",
         "mhcnuggets",
         "networkx",
+        "numpy",
         "pysam",
     ],
     entry_points={"console_scripts": ["neoepiscope=neoepiscope:main"]},
@@ -34,10 +34,34 @@ from collections import defaultdict
 import os.path as path, sys
 
 from neoepiscope import *
+from neoepiscope.binding_scores import (
+    get_affinity_mhcflurry_alleles,
+    get_affinity_mhcnuggets,
+    get_affinity_netMHCpan,
+)
+from neoepiscope.transcript import (
+    _CoordinateMap,
+    _KmerIndex,
+    kmerize_peptide,
+    seq_to_peptide,
+)
 
 import unittest
+import unittest.mock as mock
+import collections
 import filecmp
+import functools
 import os
+import pickle
+import random
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import warnings
 
 neoepiscope_dir = os.path.dirname(
     os.path.dirname((os.path.abspath(getsourcefile(lambda: 0))))
@@ -109,6 +133,25 @@ class TestGTFprocessing(unittest.TestCase):
             ],
         )
 
+    def test_batch_transcript_extraction(self):
+        """Fails if batch query disagrees with single queries"""
+        queries = [
+            ("chrY", 150860, 150861),
+            ("chrY", 150860, 150860),
+            ("chrY", 1, 2),
+            ("chrZ", 150860, 150861),
+            ("chrY", 150000, 160000),
+        ]
+        batch = get_transcripts_from_tree_batch(queries, self.Ytree)
+        self.assertEqual(len(batch[0]), 10)
+        self.assertEqual(batch[1], [])
+        self.assertEqual(batch[3], [])
+        for query, transcripts in zip(queries, batch):
+            self.assertEqual(
+                transcripts,
+                get_transcripts_from_tree(query[0], query[1], query[2], self.Ytree),
+            )
+
     def test_feature_lengths(self):
         """Fails if feature lengths are counted incorrectly"""
         self.assertEqual(self.lengths11["ENST00000332865.10_1"], 0.533)
@@ -118,6 +161,112 @@ class TestGTFprocessing(unittest.TestCase):
         self.assertEqual(self.tpm11["ENST00000325207.9_2"], 820065.9484656778)
 
 
+class TestAnnotationStore(unittest.TestCase):
+    """Tests memory-mappable annotation store"""
+
+    def setUp(self):
+        """Sets up gtf file and writes annotation store for tests"""
+        self.base_dir = os.path.join(neoepiscope_dir, "tests")
+        self.gtf = os.path.join(self.base_dir, "Chr14.gtf")
+        self.dict_dir = tempfile.mkdtemp()
+        self.cds, self.tx = gtf_to_cds(self.gtf, "NA", pickle_it=False)
+        self.tree = cds_to_tree(self.cds, "NA", pickle_it=False)
+        self.lengths = cds_to_feature_length(self.cds, self.tx, "NA", pickle_it=False)
+        write_annotation_store(self.cds, self.tx, self.lengths, self.dict_dir)
+        (
+            self.store_tree,
+            self.store_cds,
+            self.store_tx,
+            self.store_lengths,
+        ) = load_annotation(self.dict_dir)
+
+    def test_parallel_parsing(self):
+        """Fails if parsing GTF in parallel changes dictionaries"""
+        cds, tx = gtf_to_cds(self.gtf, "NA", pickle_it=False, processes=3)
+        self.assertEqual(list(cds.items()), list(self.cds.items()))
+        self.assertEqual(list(tx.items()), list(self.tx.items()))
+
+    def test_incremental_index(self):
+        """Fails if updating an index differs from indexing from scratch"""
+        with open(self.gtf) as gtf_stream:
+            gtf_lines = gtf_stream.readlines()
+
+        def write_gtf(gtf, copies):
+            # Writes copies of transcript, optionally without a start codon
+            with open(gtf, "w") as gtf_stream:
+                for transcript_id, start_codon in copies:
+                    for line in gtf_lines:
+                        if start_codon or "\tstart_codon\t" not in line:
+                            gtf_stream.write(
+                                line.replace("ENST00000409832.3", transcript_id)
+                            )
+
+        index_dirs = [os.path.join(self.dict_dir, x) for x in ["old", "new", "inc"]]
+        for index_dir in index_dirs:
+            os.mkdir(index_dir)
+        old_gtf = os.path.join(self.dict_dir, "old.gtf")
+        new_gtf = os.path.join(self.dict_dir, "new.gtf")
+        write_gtf(
+            old_gtf,
+            [("ENST00000409832.3", True), ("ENSTA.1", True), ("ENSTB.1", True)],
+        )
+        write_gtf(
+            new_gtf,
+            [("ENST00000409832.3", True), ("ENSTA.1", False), ("ENSTC.1", True)],
+        )
+        old_cds, _ = gtf_to_cds(old_gtf, index_dirs[0])
+        cds_to_tree(old_cds, index_dirs[0])
+        cds, tx = gtf_to_cds(new_gtf, index_dirs[1])
+        tree = cds_to_tree(cds, index_dirs[1])
+        inc_cds, inc_tx = gtf_to_cds(
+            new_gtf, index_dirs[2], previous_dictdir=index_dirs[0]
+        )
+        changed = changed_transcripts(index_dirs[2], index_dirs[0])
+        self.assertEqual(changed, set(["ENSTA.1", "ENSTB.1", "ENSTC.1"]))
+        inc_tree = cds_to_tree(
+            inc_cds, index_dirs[2], previous_dictdir=index_dirs[0], changed=changed
+        )
+        self.assertEqual(dict(inc_cds), dict(cds))
+        self.assertEqual(dict(inc_tx), dict(tx))
+        self.assertIn("start_codon_faux", [block[1] for block in cds["ENSTA.1"]])
+        self.assertEqual(sorted(inc_tree), sorted(tree))
+        self.assertEqual(list(inc_tree["chr14"]), list(tree["chr14"]))
+
+    def test_store_contents(self):
+        """Fails if store does not reproduce dictionaries"""
+        self.assertEqual(dict(self.store_cds), dict(self.cds))
+        self.assertEqual(dict(self.store_tx), dict(self.tx))
+        self.assertEqual(dict(self.store_lengths), self.lengths)
+        self.assertNotIn("ENST00000000000.1", self.store_cds)
+
+    def test_store_intervals(self):
+        """Fails if store intervals differ from interval tree"""
+        self.assertEqual(sorted(self.store_tree), sorted(self.tree))
+        self.assertEqual(len(self.store_tree["chr14"]), len(self.tree["chr14"]))
+        for start, stop in [
+            (19553364, 19553366),
+            (19553365, 19553366),
+            (19590078, 19590079),
+            (19590079, 19590080),
+            (19560000, 19580000),
+            (19560000, 19560000),
+        ]:
+            self.assertEqual(
+                self.store_tree["chr14"].overlap(start, stop),
+                self.tree["chr14"].overlap(start, stop),
+            )
+            self.assertEqual(
+                sorted(
+                    get_transcripts_from_tree("chr14", start, stop, self.store_tree)
+                ),
+                sorted(get_transcripts_from_tree("chr14", start, stop, self.tree)),
+            )
+
+    def tearDown(self):
+        """Removes annotation store"""
+        shutil.rmtree(self.dict_dir)
+
+
 class TestVCFmerging(unittest.TestCase):
     """Tests proper merging of somatic and germline VCFS"""
 
@@ -764,6 +913,66 @@ class TestHaplotypeProcessing(unittest.TestCase):
             ],
         )
 
+    def test_parallel_peptide_gathering(self):
+        Chr11_txs = {
+            "ENST00000398531.2_2": [
+                [
+                    [
+                        "11",
+                        71277229,
+                        "A",
+                        "C",
+                        "0",
+                        "1",
+                        "0/1:.:35:34:0:15.7%:19,15,0,0:.:2",
+                        "V",
+                    ]
+                ]
+            ]
+        }
+        homozygous_vars = {
+            "ENST00000299106.8_2": [
+                [
+                    "11",
+                    134018663,
+                    "A",
+                    "G",
+                    "1",
+                    "1",
+                    "1/1:.:17:17:0:0%:17,0,0,0:.:2",
+                    "V",
+                ]
+            ]
+        }
+        results = []
+        for processes in [1, 2]:
+            results.append(
+                get_peptides_from_transcripts(
+                    Chr11_txs,
+                    homozygous_vars,
+                    (5, "FREQ"),
+                    self.Chr11cds,
+                    self.Chr11tx,
+                    True,
+                    False,
+                    False,
+                    self.reference_index,
+                    [8, 9, 10, 11],
+                    False,
+                    False,
+                    False,
+                    False,
+                    False,
+                    False,
+                    2,
+                    1,
+                    protein_fasta=True,
+                    processes=processes,
+                )
+            )
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(list(results[0][0].keys()), list(results[1][0].keys()))
+
 
 class TestExpression(unittest.TestCase):
     """Tests variant-level expression"""
@@ -923,5 +1132,1177 @@ class TestOutput(unittest.TestCase):
         os.remove(self.out_file)
 
 
+class TestSpilling(unittest.TestCase):
+    """Tests spilling and merging of neoepitopes from groups of blocks"""
+
+    def setUp(self):
+        """Sets up directory and groups of neoepitopes"""
+        self.spill_dir = tempfile.mkdtemp()
+        self.groups = [
+            {
+                "FVKNNRRA": [("2", 141242, "GGT", "", "D", None, "NA", "nonstop", "B")],
+                "PVCCPCKI": [("11", 712, "A", "C", "V", 0.157, "NA", "NA", "A")],
+            },
+            {
+                "AAAAAAAA": [("1", 10, "C", "A", "V", None, "NA", "NA", "C")],
+                "FVKNNRRA": [
+                    ("2", 141242, "GGT", "", "D", None, "NA", "NA", "B"),
+                    ("2", 141242, "GGT", "", "D", None, "NA", "nonstop", "B"),
+                ],
+            },
+            {
+                "FVKNNRRA": [("2", 141240, "G", "A", "V", None, "NA", "NA", "A")],
+            },
+        ]
+
+    def test_merge_order(self):
+        """Fails if merged neoepitopes or metadata are out of order"""
+        spill_files = [
+            spill_neoepitopes(group, spill_dir=self.spill_dir) for group in self.groups
+        ]
+        merged = list(merge_spilled_neoepitopes(spill_files))
+        self.assertEqual(
+            [epitope for epitope, _ in merged], ["AAAAAAAA", "FVKNNRRA", "PVCCPCKI"]
+        )
+        self.assertEqual(
+            merged[1][1],
+            [
+                ("2", 141242, "GGT", "", "D", None, "NA", "nonstop", "B"),
+                ("2", 141242, "GGT", "", "D", None, "NA", "NA", "B"),
+                ("2", 141240, "G", "A", "V", None, "NA", "NA", "A"),
+            ],
+        )
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_merge_sort_key(self):
+        """Fails if metadata are not ordered by sort key"""
+        spill_files = [
+            spill_neoepitopes(group, spill_dir=self.spill_dir) for group in self.groups
+        ]
+        merged = dict(
+            merge_spilled_neoepitopes(
+                spill_files, sort_key=lambda i, meta_data: meta_data[8]
+            )
+        )
+        self.assertEqual(
+            merged["FVKNNRRA"],
+            [
+                ("2", 141240, "G", "A", "V", None, "NA", "NA", "A"),
+                ("2", 141242, "GGT", "", "D", None, "NA", "nonstop", "B"),
+                ("2", 141242, "GGT", "", "D", None, "NA", "NA", "B"),
+            ],
+        )
+
+    def tearDown(self):
+        """Removes spill directory"""
+        shutil.rmtree(self.spill_dir)
+
+
+class TestScoreCache(unittest.TestCase):
+    """Tests on-disk cache of binding scores"""
+
+    def setUp(self):
+        """Sets up cache file"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = BindingScoreCache(
+            os.path.join(self.cache_dir, "scores", "binding_scores.sqlite")
+        )
+
+    def test_lookup(self):
+        """Fails if cached scores are not returned for the same key only"""
+        self.cache.store(
+            "netMHCpan4",
+            "HLA-A*02:01",
+            ["affinity", "rank"],
+            [("AAAAAAAA", 50.5, "1.2"), ("CCCCCCCCC", "NA", "NA")],
+        )
+        self.assertEqual(
+            self.cache.lookup(
+                "netMHCpan4",
+                "HLA-A*02:01",
+                ["affinity", "rank"],
+                ["AAAAAAAA", "CCCCCCCCC", "DDDDDDDD"],
+            ),
+            {
+                "AAAAAAAA": ("AAAAAAAA", 50.5, "1.2"),
+                "CCCCCCCCC": ("CCCCCCCCC", "NA", "NA"),
+            },
+        )
+        self.assertEqual(
+            self.cache.lookup(
+                "netMHCpan4_1", "HLA-A*02:01", ["affinity", "rank"], ["AAAAAAAA"]
+            ),
+            {},
+        )
+        self.assertEqual(
+            self.cache.lookup("netMHCpan4", "HLA-A*01:01", ["affinity"], ["AAAAAAAA"]),
+            {},
+        )
+
+    def test_plain_text(self):
+        """Fails if scores are not stored as text or pickles are loaded"""
+        self.cache.store(
+            "mhcflurry1", "HLA-A*02:01", ["affinity"], [("AAAAAAAA", 50.5)]
+        )
+        self.assertEqual(
+            self.cache.connection.execute(
+                "SELECT typeof(result), result FROM scores"
+            ).fetchall(),
+            [("text", '["AAAAAAAA", 50.5]')],
+        )
+        with self.cache.connection:
+            self.cache.connection.execute(
+                "UPDATE scores SET result = ?",
+                (sqlite3.Binary(pickle.dumps(("AAAAAAAA", 50.5), protocol=2)),),
+            )
+        self.assertEqual(
+            self.cache.lookup("mhcflurry1", "HLA-A*02:01", ["affinity"], ["AAAAAAAA"]),
+            {},
+        )
+
+    def test_eviction(self):
+        """Fails if cache is not reduced to maximum size"""
+        peptides = ["".join(["A" * 8, str(i)]) for i in range(5000)]
+        self.cache.store(
+            "mhcnuggets2",
+            "HLA-A*02:01",
+            ["affinity"],
+            [(peptide, 100.0) for peptide in peptides],
+        )
+        self.cache.lookup("mhcnuggets2", "HLA-A*02:01", ["affinity"], peptides[:10])
+        self.cache.evict(50000)
+        self.assertTrue(self.cache.size() <= 50000)
+        self.assertTrue(os.path.getsize(self.cache.cache_file) <= 50000)
+        # Most recently used scores are kept
+        self.assertEqual(
+            len(
+                self.cache.lookup(
+                    "mhcnuggets2", "HLA-A*02:01", ["affinity"], peptides[:10]
+                )
+            ),
+            10,
+        )
+
+    def tearDown(self):
+        """Removes cache"""
+        self.cache.close()
+        shutil.rmtree(self.cache_dir)
+
+
+class TestBindingChunks(unittest.TestCase):
+    """Tests chunked scoring of peptides"""
+
+    def setUp(self):
+        """Sets up peptides and scoring functions"""
+        self.peptides = ["".join(["PEPTIDE", str(i)]) for i in range(25)]
+        self.failures = []
+
+        def score_reversed(peptides):
+            return [(peptide, len(peptide)) for peptide in reversed(peptides)]
+
+        def fail_once(peptides):
+            if not self.failures:
+                self.failures.append(peptides[0])
+                raise IOError("Tool output is truncated")
+            return [(peptide, "NA") for peptide in peptides]
+
+        self.score_reversed = score_reversed
+        self.fail_once = fail_once
+
+    def test_chunking(self):
+        """Fails if peptides are not split into chunks of the right size"""
+        self.assertEqual(chunk_peptides(self.peptides), [self.peptides])
+        chunks = chunk_peptides(self.peptides, 10)
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        self.assertEqual(
+            [peptide for chunk in chunks for peptide in chunk], self.peptides
+        )
+
+    def test_reassembly(self):
+        """Fails if scores are not returned in order of input peptides"""
+        for jobs in [1, 4]:
+            results = score_in_chunks(
+                [(self.score_reversed, self.peptides), (self.score_reversed, ["AAA"])],
+                chunk_size=4,
+                jobs=jobs,
+            )
+            self.assertEqual(
+                [scores for scores, _ in results],
+                [
+                    [(peptide, len(peptide)) for peptide in self.peptides],
+                    [("AAA", 3)],
+                ],
+            )
+
+    def test_retries(self):
+        """Fails if failed chunks are not rerun"""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            results = score_in_chunks(
+                [(self.fail_once, self.peptides)], chunk_size=10, retries=1
+            )
+        self.assertEqual(len(results[0][0]), 25)
+        self.failures = []
+        self.assertRaises(
+            IOError,
+            score_in_chunks,
+            [(self.fail_once, self.peptides)],
+            chunk_size=10,
+            retries=0,
+        )
+
+
+class TestGatherBindingScores(unittest.TestCase):
+    """Tests adding binding scores from concurrent jobs to metadata"""
+
+    def setUp(self):
+        """Sets up neoepitopes, tools, cache, and stub prediction tool"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = BindingScoreCache(os.path.join(self.cache_dir, "scores.sqlite"))
+        self.peptides = ["".join(["PEPTIDE", str(i)]) for i in range(12)]
+        self.alleles = ["HLA-A*02:01", "HLA-B*07:02", "HLA-C*07:02"]
+        self.tool_dict = {
+            "netMHCpan4": ["netMHCpan", ["affinity", "rank"]],
+            "mhcnuggets2": ["NA", ["affinity"]],
+        }
+        self.calls = []
+        # Later jobs finish first
+        self.delays = {}
+        for allele in self.alleles:
+            for tool in sorted(self.tool_dict):
+                self.delays[(tool, allele)] = 0.05 * (6 - len(self.delays))
+
+        def run_binding_tool(tool, allele, peptides, tool_dict, size_list):
+            self.calls.append((tool, allele, list(peptides)))
+            time.sleep(self.delays[(tool, allele)])
+            return [
+                (peptide,)
+                + tuple(
+                    ":".join([tool, allele, score, peptide])
+                    for score in tool_dict[tool][1]
+                )
+                for peptide in peptides
+            ]
+
+        self.run_binding_tool = run_binding_tool
+
+    def test_column_order(self):
+        """Fails if scores are not added in allele order, then tool order,
+        or if cached scores are sent to tools
+        """
+        self.cache.store(
+            "netMHCpan4",
+            "HLA-B*07:02",
+            ["affinity", "rank"],
+            [(peptide, "cached", "cached") for peptide in self.peptides[:5]],
+        )
+        neoepitopes = dict((peptide, [("meta", peptide)]) for peptide in self.peptides)
+        with mock.patch(
+            "neoepiscope.binding_scores._run_binding_tool", self.run_binding_tool
+        ):
+            neoepitopes = gather_binding_scores(
+                neoepitopes,
+                self.tool_dict,
+                self.alleles,
+                [8, 9],
+                score_cache=self.cache,
+                jobs=6,
+                chunk_size=5,
+            )
+        for peptide in self.peptides:
+            expected = ["meta", peptide]
+            for allele in self.alleles:
+                for tool in sorted(self.tool_dict):
+                    for score in self.tool_dict[tool][1]:
+                        if (
+                            tool == "netMHCpan4"
+                            and allele == "HLA-B*07:02"
+                            and peptide in self.peptides[:5]
+                        ):
+                            expected.append("cached")
+                        else:
+                            expected.append(":".join([tool, allele, score, peptide]))
+            self.assertEqual(neoepitopes[peptide], [tuple(expected)])
+        self.assertEqual(
+            sorted(
+                peptide
+                for tool, allele, peptides in self.calls
+                if (tool, allele) == ("netMHCpan4", "HLA-B*07:02")
+                for peptide in peptides
+            ),
+            sorted(self.peptides[5:]),
+        )
+        # Fresh scores are cached
+        self.assertEqual(
+            len(
+                self.cache.lookup(
+                    "mhcnuggets2", "HLA-C*07:02", ["affinity"], self.peptides
+                )
+            ),
+            len(self.peptides),
+        )
+
+    def tearDown(self):
+        """Removes cache"""
+        self.cache.close()
+        shutil.rmtree(self.cache_dir)
+
+
+class TestMHCflurryBatches(unittest.TestCase):
+    """Tests scoring every allele at once with MHCflurry"""
+
+    def setUp(self):
+        """Sets up stub MHCflurry predictor and mhcflurry-predict"""
+        self.peptides = ["AAAA", "CCCCCCCC", "DDDDDDDDD", "EEEEEEEEEE", "F" * 16]
+        self.alleles = ["HLA-A*02:01", "HLA-B*07:02", "not an allele"]
+        self.scores = ["affinity", "affinity_percentile", "presentation_score"]
+        self.calls = []
+        columns = [
+            "affinity",
+            "affinity_percentile",
+            "processing_score",
+            "presentation_score",
+            "presentation_percentile",
+        ]
+
+        def predicted(peptide, allele, column):
+            return sum(map(ord, peptide + allele)) / (columns.index(column) + 1.0)
+
+        class Column(list):
+            def tolist(self):
+                return list(self)
+
+        class Predictor(object):
+            def predict(
+                predictor, peptides, alleles, include_affinity_percentile, verbose
+            ):
+                self.calls.append((list(peptides), sorted(alleles)))
+                rows = [(peptide, allele) for allele in alleles for peptide in peptides]
+                predictions = {
+                    "peptide": Column(peptide for peptide, _ in rows),
+                    "sample_name": Column(allele for _, allele in rows),
+                }
+                for column in columns:
+                    predictions[column] = Column(
+                        predicted(peptide, allele, column) for peptide, allele in rows
+                    )
+                return predictions
+
+        def mhcflurry_predict(command):
+            # Writes CSV in the format of mhcflurry-predict
+            with open(command[-1]) as input_stream:
+                input_stream.readline()
+                rows = [
+                    line.strip().split(",") for line in input_stream if line.strip()
+                ]
+            with open(command[2], "w") as output_stream:
+                output_stream.write(
+                    "allele,peptide,mhcflurry_affinity,mhcflurry_affinity_percentile,"
+                    "mhcflurry_processing_score,mhcflurry_presentation_score,"
+                    "mhcflurry_presentation_percentile\n"
+                )
+                for allele, peptide in rows:
+                    output_stream.write(
+                        ",".join(
+                            [allele, peptide]
+                            + [
+                                str(predicted(peptide, allele, column))
+                                for column in columns
+                            ]
+                        )
+                        + "\n"
+                    )
+            return 0
+
+        self.predictor = Predictor()
+        self.mhcflurry_predict = mhcflurry_predict
+
+    def score(self, predictor):
+        """Scores peptides for all alleles with or without predictor"""
+        with mock.patch(
+            "neoepiscope.binding_scores._mhcflurry_predictor", predictor
+        ), mock.patch(
+            "neoepiscope.binding_scores.subprocess.check_call", self.mhcflurry_predict
+        ), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return get_affinity_mhcflurry_alleles(
+                self.peptides, self.alleles, self.scores, "2"
+            )
+
+    def test_in_process(self):
+        """Fails if in-process scores differ from mhcflurry-predict's"""
+        in_process = self.score(self.predictor)
+        self.assertEqual(in_process, self.score(False))
+        self.assertEqual(
+            self.calls, [(self.peptides[1:4], ["HLA-A*02:01", "HLA-B*07:02"])]
+        )
+        for allele in self.alleles:
+            self.assertEqual([score[0] for score in in_process[allele]], self.peptides)
+            for score in in_process[allele]:
+                self.assertEqual(
+                    score[1:] == ("NA", "NA", "NA"),
+                    allele == "not an allele" or len(score[0]) in [4, 16],
+                )
+
+    def test_gather(self):
+        """Fails if chunks are not scored for all alleles at once"""
+        neoepitopes = dict((peptide, [("meta",)]) for peptide in self.peptides)
+        with mock.patch(
+            "neoepiscope.binding_scores._mhcflurry_predictor", self.predictor
+        ), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            neoepitopes = gather_binding_scores(
+                neoepitopes,
+                {"mhcflurry2": ["NA", self.scores]},
+                self.alleles,
+                [8, 10],
+                jobs=2,
+                chunk_size=2,
+            )
+        # Last chunk has no peptides MHCflurry can score
+        self.assertEqual(len(self.calls), 2)
+        for _, alleles in self.calls:
+            self.assertEqual(alleles, ["HLA-A*02:01", "HLA-B*07:02"])
+        expected = self.score(self.predictor)
+        for i, peptide in enumerate(self.peptides):
+            self.assertEqual(
+                neoepitopes[peptide],
+                [
+                    ("meta",)
+                    + tuple(
+                        value
+                        for allele in self.alleles
+                        for value in expected[allele][i][1:]
+                    )
+                ],
+            )
+
+
+class TestMHCnuggetsModels(unittest.TestCase):
+    """Tests scoring with MHCnuggets models kept loaded in process"""
+
+    def setUp(self):
+        """Sets up stub MHCnuggets models and predict()"""
+        self.peptides = ["AAAAAAAAA", "CCCCCCCCCC", "D" * 16]
+        self.built = []
+        self.predicted = []
+        self.files = []
+        self.fail = False
+
+        def ic50(peptide, allele):
+            return str(round(sum(map(ord, peptide + allele)) / 7.0, 2))
+
+        class Model(object):
+            def __init__(model, allele, allele_class):
+                self.built.append((allele, allele_class))
+                model.allele = allele
+
+            def predict(model, peptides):
+                self.predicted.append((model.allele, list(peptides)))
+                if self.fail:
+                    raise ValueError("incompatible weights")
+                return dict(
+                    (peptide, ic50(peptide, model.allele)) for peptide in peptides
+                )
+
+        def predict(class_, peptides_path, mhc, output):
+            # Writes CSV in the format of mhcnuggets' predict()
+            self.files.extend([peptides_path, output])
+            with open(peptides_path) as input_stream:
+                peptides = [line.strip() for line in input_stream if line.strip()]
+            with open(output, "w") as output_stream:
+                output_stream.write("peptide,ic50\n")
+                for peptide in peptides:
+                    output_stream.write(",".join([peptide, ic50(peptide, mhc)]) + "\n")
+
+        self.model = Model
+        predict_module = mock.MagicMock()
+        predict_module.predict = predict
+        self.modules = {
+            "mhcnuggets": mock.MagicMock(),
+            "mhcnuggets.src": mock.MagicMock(),
+            "mhcnuggets.src.predict": predict_module,
+        }
+        self.expected = {
+            allele: [(peptide, ic50(peptide, allele)) for peptide in self.peptides[:2]]
+            + [(self.peptides[2], "NA")]
+            for allele in ["HLA-A02:01", "HLA-B07:02"]
+        }
+
+    def score(self, allele):
+        """Scores peptides for an allele with stub models"""
+        with mock.patch(
+            "neoepiscope.binding_scores.MHCnuggetsModel", self.model
+        ), mock.patch.dict(sys.modules, self.modules), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return get_affinity_mhcnuggets(self.peptides, allele, "2")
+
+    def test_reuse(self):
+        """Fails if models are not built once per allele and used in process"""
+        with mock.patch.dict("neoepiscope.binding_scores._mhcnuggets_models", {}):
+            for allele in ["HLA-A*02:01", "HLA-B*07:02", "HLA-A*02:01"]:
+                self.assertEqual(
+                    self.score(allele), self.expected[allele.replace("*", "")]
+                )
+        self.assertEqual(self.built, [("HLA-A02:01", "I"), ("HLA-B07:02", "I")])
+        self.assertEqual(
+            self.predicted,
+            [
+                (allele, self.peptides[:2])
+                for allele in ["HLA-A02:01", "HLA-B07:02", "HLA-A02:01"]
+            ],
+        )
+        self.assertEqual(self.files, [])
+
+    def test_fallback(self):
+        """Fails if failed in-process predictions are not rescored by predict()"""
+        self.fail = True
+        with mock.patch.dict("neoepiscope.binding_scores._mhcnuggets_models", {}):
+            for _ in range(2):
+                self.assertEqual(self.score("HLA-A*02:01"), self.expected["HLA-A02:01"])
+        # Model is dropped after failing once
+        self.assertEqual(self.built, [("HLA-A02:01", "I")])
+        self.assertEqual(self.predicted, [("HLA-A02:01", self.peptides[:2])])
+        self.assertEqual(len(self.files), 4)
+        for scoring_file in self.files:
+            self.assertFalse(os.path.exists(scoring_file))
+
+
+class TestAlleleRegistry(unittest.TestCase):
+    """Tests registry of alleles available for binding prediction tools"""
+
+    def setUp(self):
+        """Sets up paths to allele pickle and index"""
+        self.pickle_file = os.path.join(
+            neoepiscope_dir, "neoepiscope", "availableAlleles.pickle"
+        )
+        self.index_file = os.path.join(
+            neoepiscope_dir, "neoepiscope", "availableAlleles.tsv"
+        )
+
+    def test_index(self):
+        """Fails if index does not match pickled alleles"""
+        with open(self.pickle_file, "rb") as allele_stream:
+            avail_alleles = pickle.load(allele_stream)
+        registry = AlleleRegistry(self.pickle_file, self.index_file)
+        self.assertEqual(sorted(registry), sorted(avail_alleles))
+        for key in avail_alleles:
+            self.assertEqual(registry[key], avail_alleles[key])
+
+    def test_resolution(self):
+        """Fails if alleles are resolved incorrectly"""
+        self.assertEqual(resolve_allele("netMHCpan", "4", "HLA-A*02:01"), "HLA-A02:01")
+        self.assertEqual(resolve_allele("netMHCpan", 4, "HLA-A02:01"), "HLA-A02:01")
+        self.assertEqual(resolve_allele("mhcflurry", "", "HLA-A*02:01"), "HLA-A*02:01")
+        self.assertEqual(resolve_allele("netMHCIIpan", "4", "HLA-A*02:01"), None)
+        self.assertEqual(resolve_allele("netMHCpan", "4", "not an allele"), None)
+
+    def test_wrappers(self):
+        """Fails if tool wrappers do not resolve alleles with resolve_allele()"""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.assertEqual(
+                get_affinity_mhcnuggets(["AAAAAAAAA"], "not an allele", "2"),
+                [("AAAAAAAAA", "NA")],
+            )
+            with mock.patch(
+                "neoepiscope.binding_scores.resolve_allele", return_value=None
+            ) as resolver:
+                self.assertEqual(
+                    get_affinity_netMHCpan(
+                        ["AAAAAAAAA", "CCCCCCCC"],
+                        "HLA-A*02:01",
+                        "netMHCpan",
+                        "4",
+                        ["affinity", "rank"],
+                    ),
+                    [("AAAAAAAAA", "NA", "NA"), ("CCCCCCCC", "NA", "NA")],
+                )
+        resolver.assert_called_once_with("netMHCpan", "4", "HLA-A*02:01")
+
+
+class TestReferenceSequenceCache(unittest.TestCase):
+    """Tests cache of spliced reference transcript sequences"""
+
+    def setUp(self):
+        """Sets up reference sequence and transcript"""
+
+        class StringReference(object):
+            def __init__(self, sequence):
+                self.idx_prefix = "string"
+                self.sequence = sequence
+                self.calls = 0
+
+            def get_stretches(self, ref_id, stretches):
+                self.calls += 1
+                return [
+                    self.sequence[ref_off : ref_off + count]
+                    for ref_off, count in stretches
+                ]
+
+        self.reference = StringReference("".join(["ACGTTGCA"] * 10))
+        self.cds = [
+            ["1", "blah", "exon", "3", "10", ".", "+"],
+            ["1", "blah", "exon", "21", "30", ".", "+"],
+            ["1", "blah", "start_codon", "3", "5", ".", "+"],
+            ["1", "blah", "stop_codon", "28", "30", ".", "+"],
+        ]
+        self.cache = ReferenceSequenceCache(max_transcripts=1)
+
+    def test_lookup(self):
+        """Fails if spliced sequence is wrong or not reused"""
+        intervals = [1, 9, 19, 29]
+        spliced = self.cache.lookup(self.reference, "tx1", "1", intervals)
+        self.assertEqual(
+            spliced,
+            (
+                self.reference.sequence[2:10] + self.reference.sequence[20:30],
+                [2, 20],
+                [10, 30],
+                [0, 8],
+            ),
+        )
+        self.assertEqual(
+            self.cache.lookup(self.reference, "tx1", "1", intervals), spliced
+        )
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(self.reference.calls, 1)
+        # Only one transcript is kept
+        self.cache.lookup(self.reference, "tx2", "1", intervals)
+        self.cache.lookup(self.reference, "tx1", "1", intervals)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        # Entries for different intervals are not reused
+        self.cache.lookup(self.reference, "tx1", "1", [1, 9])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 4))
+        self.cache.max_transcripts = 0
+        self.assertEqual(self.cache.lookup(self.reference, "tx1", "1", intervals), None)
+
+    def test_transcript_stretches(self):
+        """Fails if cached stretches differ from reference stretches"""
+        transcript = Transcript(self.reference, self.cds, "tx1", False)
+        self.assertEqual(transcript.start_codon_seq, self.reference.sequence[2:5])
+        self.assertEqual(transcript.stop_codon_seq, self.reference.sequence[27:30])
+        stretches = [(2, 3), (5, 20), (25, 5), (0, 1), (28, 0), (29, 4)]
+        self.assertEqual(
+            transcript._reference_stretches(stretches),
+            self.reference.get_stretches("1", stretches),
+        )
+
+
+class TestReferenceProteome(unittest.TestCase):
+    """Tests precomputed reference proteins"""
+
+    def setUp(self):
+        """Sets up transcript"""
+
+        class StringReference(object):
+            def __init__(self, sequence):
+                self.idx_prefix = "string"
+                self.sequence = sequence
+
+            def get_stretches(self, ref_id, stretches):
+                return [
+                    self.sequence[ref_off : ref_off + count]
+                    for ref_off, count in stretches
+                ]
+
+        self.transcript = Transcript(
+            StringReference("GGATGAAATTTTAAGGGG"),
+            [
+                ["1", "blah", "exon", "3", "14", ".", "+"],
+                ["1", "blah", "start_codon", "3", "5", ".", "+"],
+                ["1", "blah", "stop_codon", "12", "14", ".", "+"],
+            ],
+            "tx1",
+            False,
+        )
+
+    def test_reference_protein(self):
+        """Fails if reference protein is wrong"""
+        self.assertEqual(
+            self.transcript.reference_protein(),
+            (reference_digest("ATGAAATTT"), "MKF"),
+        )
+
+    def test_reuse(self):
+        """Fails if precomputed protein is reused for a different sequence"""
+        reference_protein = (reference_digest("ATGAAATTT"), "precomputed")
+        self.assertEqual(
+            self.transcript._translate_reference("ATGAAATTT", reference_protein),
+            "precomputed",
+        )
+        self.assertEqual(
+            self.transcript._translate_reference("ATGAAACTT", reference_protein),
+            "MKL",
+        )
+        self.assertEqual(
+            self.transcript._translate_reference("ATGAAATTTA", reference_protein),
+            "MKF",
+        )
+
+    def test_incremental_translation(self):
+        """Fails if translation reusing the last one differs from a full one"""
+        for mitochondrial in [False, True]:
+            self.transcript.mitochondrial = mitochondrial
+            self.transcript.translations = {}
+            for seq in [
+                "ATGAAATTTCCCGGGTAA",
+                "ATGAAATTACCCGGGTAA",
+                "AAATTACCCGGGTAA",
+                "ATGAAATTACCNGGGTA",
+                "ATGCCCAAATTACCCGGGTAA",
+                "ATGAAATTTCCCGGGTAA",
+            ]:
+                self.assertEqual(
+                    self.transcript._translate(seq, allow_partial_codons=True),
+                    seq_to_peptide(
+                        seq, mitochondrial=mitochondrial, allow_partial_codons=True
+                    ),
+                )
+
+    def test_window_translation(self):
+        """Fails if neoepitopes translated from reference protein differ from
+        those of full translations, across SNVs, in-frame and frameshift indels,
+        and edits to start and stop codons
+        """
+        rng = random.Random(0)
+        codons = [
+            a + b + c
+            for a in "ACGT"
+            for b in "ACGT"
+            for c in "ACGT"
+            if a + b + c not in ["TAA", "TAG", "TGA"]
+        ]
+        orf = "ATG" + "".join(rng.choice(codons) for _ in range(58)) + "TAA"
+        sequence = "GG" + orf[:60] + "CCCCC" + orf[60:120] + "CCCCC" + orf[120:] + "GG"
+        blocks = [
+            ["1", "blah", "exon", "3", "62", ".", "+"],
+            ["1", "blah", "exon", "68", "127", ".", "+"],
+            ["1", "blah", "exon", "133", "192", ".", "+"],
+            ["1", "blah", "start_codon", "3", "5", ".", "+"],
+            ["1", "blah", "stop_codon", "190", "192", ".", "+"],
+        ]
+        exonic = list(range(3, 63)) + list(range(68, 128)) + list(range(133, 193))
+
+        def full_translation(transcript, seq, allow_partial_codons=False, **kwargs):
+            return seq_to_peptide(
+                seq,
+                mitochondrial=transcript.mitochondrial,
+                allow_partial_codons=allow_partial_codons,
+            )
+
+        for trial in range(60):
+            # Every fourth trial also edits start and stop codons
+            sites = exonic[10:-10:10] + ([4, 191] if trial % 4 == 0 else [])
+            edits = []
+            for pos in rng.sample(sites, rng.randint(1, 3)):
+                kind = rng.choice(["V", "V", "I", "D"])
+                if kind == "V":
+                    base = rng.choice([x for x in "ACGT" if x != sequence[pos - 1]])
+                    edits.append((base, pos, kind))
+                elif kind == "I":
+                    length = rng.choice([1, 3, 6])
+                    edits.append(
+                        ("".join(rng.choice("ACGT") for _ in range(length)), pos, kind)
+                    )
+                else:
+                    edits.append((rng.choice([1, 2, 3, 6]), pos, kind))
+            neopeptides = []
+            for full in [False, True]:
+                transcript = Transcript(
+                    type(self.transcript.bowtie_reference_index)(sequence),
+                    blocks,
+                    "tx2",
+                    False,
+                )
+                if full:
+                    transcript._translate = functools.partial(
+                        full_translation, transcript
+                    )
+                for seq, pos, kind in edits:
+                    transcript.edit(seq, pos, kind, "S")
+                neopeptides.append(
+                    transcript.neopeptides(
+                        allow_partial_codons=True,
+                        reference_protein=transcript.reference_protein(),
+                    )
+                )
+            self.assertEqual(neopeptides[0], neopeptides[1])
+
+
+class TestTranslation(unittest.TestCase):
+    """Tests translation with codon tables"""
+
+    def test_codon_tables(self):
+        """Fails if short or long sequences are translated incorrectly"""
+        for mitochondrial, peptide in [(False, "MA?XIL"), (True, "MA?WML")]:
+            self.assertEqual(
+                seq_to_peptide("ATGGCNAGNTGAATACTN", mitochondrial=mitochondrial),
+                (peptide, []),
+            )
+            self.assertEqual(
+                seq_to_peptide(
+                    "ATGGCNAGNTGAATACTN" * 8 + "GC",
+                    mitochondrial=mitochondrial,
+                    allow_partial_codons=True,
+                ),
+                (peptide * 8 + "A", ["incomplete_CDS"]),
+            )
+        self.assertEqual(seq_to_peptide("CTGNNAGCN" * 20)[0], "L?A" * 20)
+
+
+class TestKmerIndex(unittest.TestCase):
+    """Tests indexes of reference protein subsequences"""
+
+    def test_membership(self):
+        """Fails if index disagrees with sets of subsequences"""
+        protein = "MKVLAAGKVLAAGRVLAAGKVLSSM"
+        kmer_index = _KmerIndex(protein, 3)
+        for size in range(3, 9):
+            kmers = set(kmerize_peptide(protein, min_size=size, max_size=size))
+            queries = kmers.union(
+                kmerize_peptide(protein[::-1] + "AAGKVX", min_size=size, max_size=size)
+            )
+            for query in queries:
+                self.assertEqual(query in kmer_index, query in kmers)
+
+
+class TestCoordinateMap(unittest.TestCase):
+    """Tests run-length coordinate maps"""
+
+    def test_runs(self):
+        """Fails if map differs from dictionary assigned the same runs"""
+        coordinate_map, dictionary = _CoordinateMap(), {}
+        for key_start, key_step, value_start, value_step, length in [
+            (100, 1, 0, 1, 10),
+            (110, 1, 10, 1, 5),
+            (200, -1, 15, 1, 20),
+            (195, -1, 35, 0, 3),
+            (104, 1, 40, 1, 2),
+            (300, 1, 0, 1, 0),
+        ]:
+            coordinate_map.add_run(key_start, key_step, value_start, value_step, length)
+            dictionary.update(
+                (key_start + i * key_step, value_start + i * value_step)
+                for i in range(length)
+            )
+        # Second run continues the first
+        self.assertEqual(len(coordinate_map.runs), 4)
+        self.assertEqual(list(coordinate_map), list(dictionary))
+        self.assertEqual(len(coordinate_map), len(dictionary))
+        for key in range(90, 210):
+            self.assertEqual(key in coordinate_map, key in dictionary)
+            self.assertEqual(coordinate_map.get(key), dictionary.get(key))
+        self.assertNotIn(None, coordinate_map)
+
+
+class TestSequenceReferences(unittest.TestCase):
+    """Tests 2bit and indexed FASTA references"""
+
+    def setUp(self):
+        """Writes a small genome as FASTA and 2bit files"""
+        self.ref_dir = tempfile.mkdtemp()
+        self.genome = collections.OrderedDict(
+            [("1", "ACGTacgtNNNNGGCCTTAAcg" * 3), ("2", "TTGCA")]
+        )
+        self.fasta = os.path.join(self.ref_dir, "genome.fa")
+        with open(self.fasta, "w") as fasta_stream, open(
+            self.fasta + ".fai", "w"
+        ) as fai_stream:
+            for name, seq in self.genome.items():
+                fasta_stream.write(">" + name + "\n")
+                fai_stream.write(
+                    "\t".join(
+                        [name, str(len(seq)), str(fasta_stream.tell()), "10", "11"]
+                    )
+                    + "\n"
+                )
+                for i in range(0, len(seq), 10):
+                    fasta_stream.write(seq[i : i + 10] + "\n")
+        self.twobit = os.path.join(self.ref_dir, "genome.2bit")
+        records = []
+        for name, seq in self.genome.items():
+            n_blocks = [
+                (m.start(), m.end() - m.start()) for m in re.finditer("N+", seq)
+            ]
+            packed = bytearray()
+            for i in range(0, len(seq), 4):
+                byte = 0
+                for base in seq[i : i + 4].upper().ljust(4, "T"):
+                    byte = (byte << 2) | "TCAG".find(base) % 4
+                packed.append(byte)
+            records.append(
+                struct.pack("<II", len(seq), len(n_blocks))
+                + b"".join(struct.pack("<I", start) for start, _ in n_blocks)
+                + b"".join(struct.pack("<I", size) for _, size in n_blocks)
+                + struct.pack("<II", 0, 0)
+                + bytes(packed)
+            )
+        header = struct.pack("<IIII", 0x1A412743, 0, len(records), 0)
+        offset = len(header) + sum(5 + len(name) for name in self.genome)
+        for name, record in zip(self.genome, records):
+            header += struct.pack("<B", len(name)) + name.encode("ascii")
+            header += struct.pack("<I", offset)
+            offset += len(record)
+        with open(self.twobit, "wb") as twobit_stream:
+            twobit_stream.write(header + b"".join(records))
+
+    def test_open_reference(self):
+        """Fails if wrong reference type is opened"""
+        self.assertIsInstance(open_reference(self.fasta), FastaReference)
+        self.assertIsInstance(open_reference(self.twobit), TwoBitReference)
+        with self.assertRaises(RuntimeError):
+            open_reference(os.path.join(self.ref_dir, "missing"))
+
+    def test_get_stretch(self):
+        """Fails if retrieved sequence is wrong"""
+        for reference in [FastaReference(self.fasta), TwoBitReference(self.twobit)]:
+            self.assertEqual(reference.length, {"1": 66, "2": 5})
+            for name, seq in self.genome.items():
+                padded = "NN" + seq.upper() + "NN"
+                for start in range(-2, len(seq) + 1):
+                    for count in [1, 3, 12]:
+                        self.assertEqual(
+                            reference.get_stretch(name, start, count),
+                            padded[start + 2 : start + 2 + count].ljust(count, "N"),
+                        )
+            self.assertEqual(
+                reference.get_stretches("1", [(12, 4), (2, 3)]), ["GGCC", "GTA"]
+            )
+            self.assertEqual(reference.recs["2"], [(0, 5, True)])
+            self.assertEqual(
+                [rec[:2] for rec in reference.recs["1"]],
+                [(0, 8), (4, 18), (4, 18), (4, 10)],
+            )
+
+    def tearDown(self):
+        """Removes reference files"""
+        shutil.rmtree(self.ref_dir)
+
+
+class TestBowtieStretches(unittest.TestCase):
+    """Tests retrieving many stretches at once from a Bowtie index"""
+
+    def setUp(self):
+        """Writes a small genome as a Bowtie index"""
+        self.ref_dir = tempfile.mkdtemp()
+        self.genome = collections.OrderedDict(
+            [
+                ("1", "NNACGTACGTNNNNGGCCTTAACGNACGGTTCAN" + "GATTACA" * 6),
+                ("2", "TTGCANNNNNNNNNNCAGT"),
+            ]
+        )
+        prefix = os.path.join(self.ref_dir, "genome")
+        records, unambiguous = [], []
+        for seq in self.genome.values():
+            stretches = list(re.finditer("N*([ACGT]+)", seq))
+            for i, m in enumerate(stretches):
+                records.append((m.start(1) - m.start(), m.end(1) - m.start(1), i == 0))
+                unambiguous.append(m.group(1))
+        unambiguous = "".join(unambiguous)
+        # Only fields read by BowtieIndexReference are filled in
+        line_rate, lines_per_side, ftab_chars = 6, 1, 2
+        side_size = (1 << line_rate) * lines_per_side
+        side_pairs = (len(unambiguous) // 4 + 1 + 2 * (side_size - 8) - 1) // (
+            2 * (side_size - 8)
+        )
+        with open(prefix + ".1.ebwt", "wb") as index_stream:
+            index_stream.write(
+                struct.pack(
+                    "<iIiiiiiI",
+                    1,
+                    len(unambiguous),
+                    line_rate,
+                    lines_per_side,
+                    5,
+                    ftab_chars,
+                    0,
+                    len(self.genome),
+                )
+            )
+            index_stream.write(b"\0" * (4 * len(self.genome)))
+            index_stream.write(struct.pack("<I", len(records)))
+            index_stream.write(
+                b"\0"
+                * (
+                    12 * len(records)
+                    + 2 * side_size * side_pairs
+                    + 24
+                    + 4 * ((1 << (ftab_chars * 2)) + 1 + ftab_chars * 2)
+                )
+            )
+            for name in self.genome:
+                index_stream.write((name + " description\n").encode("ascii"))
+            index_stream.write(b"\0")
+        with open(prefix + ".3.ebwt", "wb") as index_stream:
+            index_stream.write(struct.pack("<iI", 1, len(records)))
+            for record in records:
+                index_stream.write(struct.pack("<II?", *record))
+        packed = bytearray((len(unambiguous) + 3) // 4)
+        for i, base in enumerate(unambiguous):
+            packed[i // 4] |= "ACGT".index(base) << (2 * (i % 4))
+        with open(prefix + ".4.ebwt", "wb") as index_stream:
+            index_stream.write(bytes(packed))
+        self.reference = bowtie_index.BowtieIndexReference(prefix)
+
+    def test_get_stretch(self):
+        """Fails if retrieved sequence is wrong"""
+        self.assertEqual(self.reference.length, {"1": 76, "2": 19})
+        for name, seq in self.genome.items():
+            padded = "NN" + seq + "NN"
+            for start in range(-2, len(seq) + 1):
+                for count in [1, 3, 12]:
+                    self.assertEqual(
+                        self.reference.get_stretch(name, start, count),
+                        padded[start + 2 : start + 2 + count].ljust(count, "N"),
+                    )
+
+    def test_get_stretches(self):
+        """Fails if get_stretches differs from separate get_stretch calls"""
+        get_stretch = self.reference.get_stretch
+        stretches = [
+            # Gap of 3 between requests, in reverse order
+            (20, 4),
+            (13, 4),
+            # Gaps of 8 and 20 from neighboring requests
+            (30, 2),
+            (72, 2),
+            # Overlapping and nested requests
+            (40, 10),
+            (45, 2),
+            (44, 8),
+            # Past either end of reference
+            (-4, 8),
+            (73, 5),
+            (80, 3),
+            # Spanning ambiguous characters
+            (8, 8),
+            (22, 4),
+            # Empty requests
+            (5, 0),
+            (9, -1),
+        ]
+        expected = [get_stretch("1", ref_off, count) for ref_off, count in stretches]
+        self.assertEqual(expected[7], "NNNNNNAC")
+        self.assertEqual(expected[10], "GTNNNNGG")
+        # Number of spans retrieved for each max_gap
+        spans = collections.OrderedDict(
+            [(0, 7), (1, 7), (2, 6), (3, 5), (4, 3), (8, 2), (19, 2), (20, 1)]
+        )
+        for max_gap, span_count in spans.items():
+            with mock.patch.object(
+                self.reference, "get_stretch", wraps=get_stretch
+            ) as patched:
+                self.assertEqual(
+                    self.reference.get_stretches("1", stretches, max_gap=max_gap),
+                    expected,
+                )
+            self.assertEqual(patched.call_count, span_count)
+        self.assertEqual(self.reference.get_stretches("2", []), [])
+        rng = random.Random(0)
+        for _ in range(200):
+            stretches = [
+                (rng.randint(-5, 80), rng.randint(-1, 15))
+                for _ in range(rng.randint(1, 8))
+            ]
+            self.assertEqual(
+                self.reference.get_stretches(
+                    "1", stretches, max_gap=rng.choice([0, 1, 8, 32])
+                ),
+                [get_stretch("1", ref_off, count) for ref_off, count in stretches],
+            )
+
+    def tearDown(self):
+        """Removes index files"""
+        shutil.rmtree(self.ref_dir)
+
+
+class TestAnnotationServer(unittest.TestCase):
+    """Tests serving annotation and reference sequence over a Unix socket"""
+
+    def setUp(self):
+        """Starts annotation server on a thread"""
+        self.base_dir = os.path.join(neoepiscope_dir, "tests")
+        self.server_dir = tempfile.mkdtemp()
+        self.cds, self.tx = gtf_to_cds(
+            os.path.join(self.base_dir, "Chr14.gtf"), "NA", pickle_it=False
+        )
+        self.tree = cds_to_tree(self.cds, "NA", pickle_it=False)
+        self.lengths = cds_to_feature_length(self.cds, self.tx, "NA", pickle_it=False)
+        self.sequence = "ACGTTGCANN" * 10
+        fasta = os.path.join(self.server_dir, "genome.fa")
+        with open(fasta, "w") as fasta_stream:
+            fasta_stream.write(">chr14\n" + self.sequence + "\n")
+        with open(fasta + ".fai", "w") as fai_stream:
+            fai_stream.write("chr14\t100\t7\t100\t101\n")
+        self.socket_path = os.path.join(self.server_dir, "annotation.sock")
+        self.server = AnnotationServer(
+            self.socket_path,
+            self.tree,
+            self.cds,
+            self.tx,
+            self.lengths,
+            None,
+            open_reference(fasta),
+        )
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = connect_annotation_server(self.socket_path)
+
+    def test_annotation(self):
+        """Fails if served annotation differs from local annotation"""
+        transcript_id = sorted(self.cds)[0]
+        self.assertEqual(self.client.cds[transcript_id], self.cds[transcript_id])
+        self.assertEqual(self.client.info[transcript_id], self.tx[transcript_id])
+        self.assertEqual(dict(self.client.feature_lengths), self.lengths)
+        self.assertNotIn("ENST00000000000.1", self.client.cds)
+        self.assertIsNone(self.client.reference_proteome)
+        self.assertEqual(sorted(self.client.intervals), sorted(self.tree))
+        queries = [
+            ("chr14", 19553364, 19553366),
+            ("chr14", 19560000, 19580000),
+            ("chr1", 100, 200),
+        ]
+        self.assertEqual(
+            get_transcripts_from_tree_batch(queries, self.client.intervals),
+            get_transcripts_from_tree_batch(queries, self.tree),
+        )
+        self.assertEqual(
+            sorted(
+                get_transcripts_from_tree(
+                    "chr14", 19560000, 19580000, self.client.intervals
+                )
+            ),
+            sorted(get_transcripts_from_tree("chr14", 19560000, 19580000, self.tree)),
+        )
+
+    def test_reference(self):
+        """Fails if served reference sequence is wrong"""
+        reference = self.client.reference
+        self.assertEqual(reference.length, {"chr14": 100})
+        self.assertEqual(reference.get_stretch("chr14", 6, 6), "CANNAC")
+        self.assertEqual(
+            reference.get_stretches("chr14", [(98, 4), (0, 3)]), ["NNNN", "ACG"]
+        )
+        self.assertEqual(reference.recs["chr14"][:2], [(0, 8, True), (2, 8, False)])
+
+    def test_fallback(self):
+        """Fails if connecting to a missing server does not warn"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.assertIsNone(
+                connect_annotation_server(os.path.join(self.server_dir, "missing"))
+            )
+        self.assertEqual(len(caught), 1)
+
+    def tearDown(self):
+        """Stops annotation server"""
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.server_dir)
+
+
 if __name__ == "__main__":
     unittest.main()